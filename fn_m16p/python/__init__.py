@@ -23,4 +23,11 @@ This decoder stacks on top of the 'uart' PD and decodes the serial protocol used
 [More to come...]
 '''
 
-from .pd import Decoder
+try:
+    import sigrokdecode                          # pylint: disable=unused-import
+except ImportError:
+    # Imported from outside libsigrokdecode (e.g. for fn_m16p_batch), where only the
+    # modules that don't need the sigrokdecode runtime can be used
+    pass
+else:
+    from .pd import Decoder
@@ -0,0 +1,273 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Batch (offline) FN_M16P decoding of whole arrays of UART bytes, using NumPy
+
+    Gives the same results as feeding the bytes one at a time through pd.Decoder, but
+    frames are located with array operations instead of a per-byte state machine (both
+    run a module variant's transition table, compiled by fn_m16p_schema; pass the same
+    engine as pd.Decoder's "variant" option).  Needs NumPy, but not the sigrokdecode
+    runtime.  Example:
+
+        from fn_m16p.fn_m16p_batch import decode_arrays
+        result = decode_arrays(start_smpl, end_smpl, data, rxtx)
+        for ss, es, rxtx, label in result.packets():
+            ...
+'''
+
+import numpy as np
+
+from .fn_m16p_messages import field_label
+from .fn_m16p_labels   import LabelCache
+from .fn_m16p_frame    import CMD, FEED, MSB, LSB, IDLE, FIELD_CLASS, PACKET_CLASS, \
+                              ACT_START, ACT_FIELD, ACT_END, ACT_FRAME_ERR
+from .fn_m16p_schema   import FIELDS, DEFAULT
+
+END_FIELD   = FIELDS['end']                      # field_label entry for an End byte
+FRAME_ERROR = 15                                 # field_label entry for a byte that
+                                                 # broke a frame
+
+    # Annotation class (RX) for each field_label entry, as a lookup array
+CLASS_OF_FIELD = np.zeros(max(FIELD_CLASS) + 1, dtype=np.uint8)
+for _field, _cls in FIELD_CLASS.items():
+    CLASS_OF_FIELD[_field] = _cls
+
+
+def transition_table(engine):
+    '''Return an engine's transition table as an array: [state, byte] -> action'''
+    return np.frombuffer(b''.join(engine.rows), dtype=np.uint8).reshape(-1, 256)
+
+
+def find_frames(data, rows):
+    '''Return (starts, lengths, ends) of every frame the streaming state machine would
+       enter, for the bytes of ONE direction, starting from IDLE, with transition table
+       rows.  A frame runs to its End byte (its "ends" entry is ACT_END) or to the byte
+       that broke it (ACT_FRAME_ERR); one cut off by the end of the data is given the
+       longest length a frame can have (and ACT_FIELD).'''
+    count = len(data)
+    cand  = np.flatnonzero(rows[IDLE][data] == ACT_START)   # Might each start a frame
+    lengths = np.full(len(cand), len(rows), dtype=np.int64)
+    ends    = np.full(len(cand), ACT_FIELD, dtype=np.uint8)
+    if not len(cand):
+        return cand, lengths, ends
+
+        # Run every candidate through the table at once, a byte offset at a time, until
+        # a byte ends (or breaks) it
+    going = np.flatnonzero(cand + 1 < count)
+    for offset in range(1, len(rows)):
+        action  = rows[offset][data[cand[going] + offset]]
+        stop    = action != ACT_FIELD
+        lengths[going[stop]] = offset + 1
+        ends[going[stop]]    = action[stop]
+        going   = going[~stop]
+        going   = going[cand[going] + offset + 1 < count]
+
+        # After a frame, the state machine is IDLE until the next Start byte, so each
+        # candidate has exactly one successor.  The real frames are the chain of
+        # successors from the first candidate, found here by pointer doubling rather
+        # than a per-frame loop.
+    last = len(cand)                             # "No successor" marker
+    jump = np.append(np.searchsorted(cand, cand + lengths), last)
+    on_chain    = np.zeros(last + 1, dtype=bool)
+    on_chain[0] = True
+    while True:                                  # After k passes, the first 2**k frames of
+        on_chain[jump[on_chain]] = True          # the chain have been marked
+        if jump[0] == last:
+            break
+        jump = jump[jump]
+    on_chain = on_chain[:last]
+    return cand[on_chain], lengths[on_chain], ends[on_chain]
+
+
+class BatchResult:
+    '''Columnar results of decode_arrays()
+
+       Per packet (in order of the packet's End byte):
+         ss, es         Start/end sample of the packet
+         rxtx           0 = RX, 1 = TX
+         cmd, feed,     Command code, feedback flag and parameter bytes
+         msb, lsb
+         length         8 or 10 (10 = with checksum bytes)
+         label          Index into the engine's label table (fn_m16p_labels.label_table
+                        for the variants in fn_m16p_schema), i.e. (cmd << 1) | rxtx
+         last_byte      Index (into the input arrays) of the packet's End byte
+
+       Per input byte:
+         byte_field     field_label entry used to annotate the byte
+         byte_class     Annotation class used to annotate the byte
+    '''
+    __slots__ = ('ss', 'es', 'rxtx', 'cmd', 'feed', 'msb', 'lsb', 'length', 'label',
+                 'last_byte', 'byte_field', 'byte_class', 'start_smpl', 'end_smpl')
+
+    def __len__(self):
+        return len(self.ss)
+
+    def packets(self, cache=None):
+        '''Yield (ss, es, rxtx, label strings) for each packet (cache: a LabelCache of
+           the engine's label table)'''
+        cache = cache if cache is not None else LabelCache()
+        for ss, es, rxtx, cmd, msb, lsb in zip(self.ss.tolist(),  self.es.tolist(),
+                                               self.rxtx.tolist(), self.cmd.tolist(),
+                                               self.msb.tolist(),  self.lsb.tolist()):
+            yield ss, es, rxtx, cache.lookup(cmd, rxtx, msb, lsb)
+
+    def annotations(self, cache=None):
+        '''Yield (ss, es, [class, strings]) in the same order that pd.Decoder put()s them'''
+        pkt_at = {}                              # End byte index -> packet number
+        for num, last in enumerate(self.last_byte.tolist()):
+            pkt_at[last] = num
+        labels = list(self.packets(cache))
+        for idx, (ss, es, field, cls) in enumerate(zip(self.start_smpl.tolist(),
+                                                       self.end_smpl.tolist(),
+                                                       self.byte_field.tolist(),
+                                                       self.byte_class.tolist())):
+            yield ss, es, [cls, field_label[field]]
+            if idx in pkt_at:
+                pkt_ss, pkt_es, rxtx, label = labels[pkt_at[idx]]
+                yield pkt_ss, pkt_es, [PACKET_CLASS + rxtx, label]
+
+
+def concatenate(results):
+    '''Return one BatchResult holding the packets and bytes of several, in order'''
+    merged = BatchResult()
+    for name in BatchResult.__slots__:
+        columns = [getattr(result, name) for result in results]
+        if name == 'last_byte':                  # Byte indexes are within each result
+            offsets = np.cumsum([0] + [len(result.start_smpl) for result in results])
+            columns = [column + offset for column, offset in zip(columns, offsets)]
+        setattr(merged, name, np.concatenate(columns))
+    return merged
+
+
+def decode_arrays(start_smpl, end_smpl, data, rxtx, engine=DEFAULT):
+    '''Decode parallel arrays of UART bytes (both directions interleaved, in time order)
+       and return a BatchResult'''
+    return decode_block(start_smpl, end_smpl, data, rxtx, final=True, engine=engine)[0]
+
+
+class BatchDecoder:
+    '''Decode a long capture as a series of blocks of UART bytes
+
+       A frame that is still incomplete at the end of a block is held back, with every
+       byte after its first, and decoded with the next block, so results (and their
+       order) are the same as for one big block.'''
+    __slots__ = ('carry', 'engine')
+
+    def __init__(self, engine=DEFAULT):
+        self.carry  = None                       # Held-back (ss, es, data, rxtx) arrays
+        self.engine = engine                     # Compiled frame schema (fn_m16p_schema)
+
+    def feed(self, start_smpl, end_smpl, data, rxtx):
+        '''Decode the next block of bytes; return a BatchResult for the bytes (and
+           packets) that are now complete'''
+        arrays = (np.asarray(start_smpl, dtype=np.int64), np.asarray(end_smpl, dtype=np.int64),
+                  np.asarray(data, dtype=np.uint8),       np.asarray(rxtx, dtype=np.uint8))
+        if self.carry is not None:
+            arrays = tuple(np.concatenate(pair) for pair in zip(self.carry, arrays))
+        result, pending = decode_block(*arrays, final=False, engine=self.engine)
+        self.carry = tuple(column[pending] for column in arrays)
+        return result
+
+    def flush(self):
+        '''Decode whatever is still held back, at the end of the capture'''
+        if self.carry is None:
+            return decode_arrays([], [], [], [], self.engine)
+        result = decode_block(*self.carry, final=True, engine=self.engine)[0]
+        self.carry = None
+        return result
+
+
+def decode_block(start_smpl, end_smpl, data, rxtx, final, engine=DEFAULT):
+    '''Decode one block of bytes, starting with both directions IDLE.  Returns the
+       BatchResult and a mask of the bytes from the first byte of the earliest frame
+       that is unfinished at the end of the block on; unless final is set, those bytes
+       (and any packets ending among them) are left out of the BatchResult.'''
+    start_smpl = np.asarray(start_smpl, dtype=np.int64)
+    end_smpl   = np.asarray(end_smpl,   dtype=np.int64)
+    data       = np.asarray(data,       dtype=np.uint8)
+    rxtx       = np.asarray(rxtx,       dtype=np.uint8)
+    rows       = transition_table(engine)
+    fields     = np.array([FIELDS[name] for name in engine.layout], dtype=np.uint8)
+
+    byte_field = np.zeros(len(data), dtype=np.uint8)   # Default: Unexpected byte
+    cut        = len(data)                              # First byte held back
+    spans      = []                                     # Frames' first/last byte, per
+    columns    = []                                     # direction; packet columns
+
+    for chan in (0, 1):
+        where = np.flatnonzero(rxtx == chan)     # Each direction has its own packets
+        chan_data = data[where]
+        count = len(chan_data)
+        starts, lengths, ends = find_frames(chan_data, rows)
+
+        for offset in range(len(fields)):        # Label every byte inside a frame
+            sel = (offset < lengths) & (starts + offset < count)
+            byte_field[where[starts[sel] + offset]] = fields[offset]
+        last = starts + lengths - 1              # (End byte, wherever it arrived)
+        byte_field[where[last[ends == ACT_END]]]       = END_FIELD
+        byte_field[where[last[ends == ACT_FRAME_ERR]]] = FRAME_ERROR
+
+        complete = ends != ACT_FIELD             # Frame wasn't cut off by end of data?
+        if not final and not complete.all():     # (Only the last one can be cut off)
+            cut = min(cut, where[starts[-1]])
+        spans.append((where[starts], where[np.minimum(starts + lengths, count) - 1]))
+        good = ends == ACT_END
+        starts, lengths = starts[good], lengths[good]
+        columns.append((where[starts], where[starts + lengths - 1], lengths,
+                        *(chan_data[starts + offset] for offset in (CMD, FEED, MSB, LSB))))
+
+        # The next block starts both directions IDLE, so move the cut back to the start
+        # of any frame (of either direction) that it would split.  That keeps the bytes
+        # (and packets) of successive blocks in the same order as for one big block.
+    moved = True
+    while moved:
+        moved = False
+        for first_byte, last_byte in spans:
+            split = np.flatnonzero((first_byte < cut) & (last_byte >= cut))
+            if len(split):
+                cut   = int(first_byte[split[0]])
+                moved = True
+    pending = np.arange(len(data)) >= cut
+
+        # Merge both directions, ordered by End byte (the point at which the streaming
+        # decoder labels a packet)
+    first, last, lengths, cmd, feed, msb, lsb = (np.concatenate(col) for col in zip(*columns))
+    order = np.argsort(last, kind='stable')
+    order = order[last[order] < cut]
+    first, last = first[order], last[order]
+
+    keep = ~pending                              # Bytes reported in this result, and their
+    new_index = np.cumsum(keep) - 1              # positions within it
+
+    result = BatchResult()
+    result.start_smpl = start_smpl[keep]
+    result.end_smpl   = end_smpl[keep]
+    result.byte_field = byte_field[keep]
+    result.byte_class = CLASS_OF_FIELD[result.byte_field] + rxtx[keep]
+    result.ss         = start_smpl[first]
+    result.es         = end_smpl[last]
+    result.rxtx       = rxtx[first]
+    result.cmd        = cmd[order]
+    result.feed       = feed[order]
+    result.msb        = msb[order]
+    result.lsb        = lsb[order]
+    result.length     = lengths[order].astype(np.uint8)
+    result.last_byte  = new_index[last]
+    result.label      = (result.cmd.astype(np.uint16) << 1) | result.rxtx
+    return result, pending
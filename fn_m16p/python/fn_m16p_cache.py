@@ -0,0 +1,242 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Persistent on-disk cache of decoded results, one entry per session chunk
+
+    Re-opening a capture decodes only the logic-1-N chunks that have changed.  Each
+    chunk's decoded bytes and packets (a BatchResult, as from fn_m16p_session) are stored
+    under a content address: a hash of the chunk's samples, of the decoding state at its
+    start (a UART frame or packet can straddle chunks), of the decoding parameters (the
+    module variant among them), and of the decoder version (its source) and
+    fn_m16p_messages.TABLE_VERSION.  The state at the chunk's end is stored with it, so
+    the next chunk's key is known without decoding.
+    Sample numbers are stored relative to the chunk, so identical chunks at different
+    places in a capture share an entry.
+
+    Entries are .npz files in one directory, evicted least recently used first (by file
+    modification time, updated on every hit) to keep the directory under its size cap:
+
+        python -m fn_m16p.fn_m16p_session --rx D5 --tx D6 --cache ~/.cache/fn_m16p x.sr
+'''
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from .fn_m16p_batch    import BatchDecoder, BatchResult, concatenate
+from .fn_m16p_messages import TABLE_VERSION
+from .fn_m16p_schema   import DEFAULT
+from .fn_m16p_session  import LineReceivers, BLOCK_SIZE
+
+CACHE_SIZE  = 1 << 30                            # Default size cap, in bytes
+HASH_BLOCK  = 1 << 22                            # Bytes hashed at a time
+
+    # Modules whose code decides what is decoded from the samples
+DECODER_MODULES = ('fn_m16p_frame', 'fn_m16p_schema', 'fn_m16p_uart', 'fn_m16p_batch',
+                   'fn_m16p_session', 'fn_m16p_cache')
+
+SAMPLE_COLUMNS = ('ss', 'es', 'start_smpl', 'end_smpl')   # Stored relative to the chunk
+CARRY_COLUMNS  = ('ss', 'es', 'data', 'rxtx')             # BatchDecoder.carry
+
+
+def decoder_version():
+    '''Return a hash of the decoding modules' source'''
+    digest = hashlib.blake2b(digest_size=16)
+    here   = os.path.dirname(os.path.abspath(__file__))
+    for name in DECODER_MODULES:
+        with open(os.path.join(here, name + '.py'), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def default_path():
+    '''Return the default cache directory'''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                            '.cache')
+    return os.path.join(base, 'fn_m16p')
+
+
+class DecodeCache:
+    '''A directory of cached chunk results, with LRU eviction under a size cap'''
+
+    def __init__(self, path=None, max_bytes=CACHE_SIZE):
+        self.path      = path or default_path()
+        self.max_bytes = max_bytes
+        self.version   = decoder_version()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        os.makedirs(self.path, exist_ok=True)
+        entries = []                             # Least recently used first
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        self.index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.bytes = sum(self.index.values())
+
+    def key(self, *parts):
+        '''Return the entry key for a chunk: a hash of the given parts (bytes, or
+           anything with a stable repr()), the decoder version and the table version'''
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (self.version, TABLE_VERSION) + parts:
+            digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        '''File name of an entry'''
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        '''Return an entry's arrays (as a dict), or None if it isn't cached'''
+        if key in self.index:
+            try:
+                with np.load(self.entry_path(key)) as entry:
+                    arrays = {name: entry[name] for name in entry.files}
+                os.utime(self.entry_path(key))   # Most recently used, from now on
+                self.index.move_to_end(key)
+                self.hits += 1
+                return arrays
+            except (OSError, ValueError, KeyError):   # Evicted by another process, or
+                self.discard(key)                      # damaged: treat as a miss
+        self.misses += 1
+        return None
+
+    def put(self, key, arrays):
+        '''Store an entry, then evict old ones if the cache is over its cap'''
+        handle, temp = tempfile.mkstemp(suffix='.npz', dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as out:
+                np.savez(out, **arrays)
+            os.replace(temp, self.entry_path(key))   # (Atomic: readers never see half)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        self.discard(key)
+        self.index[key] = os.path.getsize(self.entry_path(key))
+        self.bytes += self.index[key]
+        while self.bytes > self.max_bytes and len(self.index) > 1:
+            oldest = next(iter(self.index))
+            self.discard(oldest)
+            try:
+                os.unlink(self.entry_path(oldest))
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def discard(self, key):
+        '''Forget an entry (but leave its file)'''
+        size = self.index.pop(key, None)
+        if size is not None:
+            self.bytes -= size
+
+    def stats(self):
+        '''Return hit/miss/eviction counts and the cache's size, as a dict'''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.index), 'bytes': self.bytes}
+
+
+def chunk_hash(reader, info):
+    '''Return a hash of a session chunk's samples'''
+    digest = hashlib.blake2b(digest_size=20)
+    with reader.zipfile.open(info) as chunk:
+        while True:
+            data = chunk.read(HASH_BLOCK)
+            if not data:
+                break
+            digest.update(data)
+    return digest.digest()
+
+
+def save_state(receivers, decoder, base):
+    '''Return the decoding state (receivers and BatchDecoder) as arrays, with sample
+       numbers relative to base'''
+    state = {}
+    for rxtx, (_, _, receiver) in enumerate(receivers.lines):
+        state['carry%d' % rxtx]  = receiver.carry
+        state['line%d' % rxtx]   = np.array([receiver.carry_base - base, receiver.prev_level,
+                                             receiver.skip], dtype=np.int64)
+    carry = decoder.carry or tuple(np.zeros(0, dtype=dtype) for dtype in
+                                   (np.int64, np.int64, np.uint8, np.uint8))
+    for name, column in zip(CARRY_COLUMNS, carry):
+        state['bytes_' + name] = column - base if name in ('ss', 'es') else column
+    return state
+
+
+def load_state(state, receivers, decoder, base):
+    '''Restore the decoding state saved by save_state(), at base'''
+    for rxtx, (_, _, receiver) in enumerate(receivers.lines):
+        carry_base, prev_level, skip = state['line%d' % rxtx].tolist()
+        receiver.carry      = state['carry%d' % rxtx]
+        receiver.carry_base = carry_base + base
+        receiver.prev_level = prev_level
+        receiver.skip       = skip
+    decoder.carry = tuple(state['bytes_' + name] + base if name in ('ss', 'es')
+                          else state['bytes_' + name] for name in CARRY_COLUMNS)
+
+
+def state_hash(state):
+    '''Return a hash of a decoding state'''
+    digest = hashlib.blake2b(digest_size=20)
+    for name in sorted(state):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(state[name]).tobytes())
+    return digest.digest()
+
+
+def decode_cached(reader, rx, tx, baudrate=9600, block_size=BLOCK_SIZE, cache=None,
+                  engine=DEFAULT):
+    '''Yield the same BatchResults as fn_m16p_session.decode_session() (though one per
+       chunk, rather than per block), taking each chunk's from the cache if it's there
+       and decoding (and caching) it if not'''
+    cache     = cache if cache is not None else DecodeCache()
+    receivers = LineReceivers(reader, rx, tx, baudrate)
+    decoder   = BatchDecoder(engine)
+    params    = (reader.samplerate, reader.unitsize, baudrate,
+                 reader.channel_bit(rx), reader.channel_bit(tx), engine.name)
+    base      = 0
+    for info in reader.chunks:
+        size  = info.file_size // reader.unitsize
+        start = save_state(receivers, decoder, base)
+        key   = cache.key(params, chunk_hash(reader, info), state_hash(start))
+        entry = cache.get(key)
+        if entry is None:                        # Decode it, then remember it
+            results = [decoder.feed(*receivers.feed(block_base, block))
+                       for block_base, block in reader.blocks(block_size, base, base + size)]
+            result  = concatenate(results) if results else decoder.feed([], [], [], [])
+            entry   = {name: getattr(result, name) - base if name in SAMPLE_COLUMNS
+                       else getattr(result, name) for name in BatchResult.__slots__}
+            entry.update(('end_' + name, array) for name, array in
+                         save_state(receivers, decoder, base + size).items())
+            cache.put(key, entry)
+        else:                                    # Cached: carry on from its end state
+            result = BatchResult()
+            for name in BatchResult.__slots__:
+                setattr(result, name, entry[name] + base if name in SAMPLE_COLUMNS
+                        else entry[name])
+            load_state({name[4:]: array for name, array in entry.items()
+                        if name.startswith('end_')}, receivers, decoder, base + size)
+        base += size
+        yield result
+    yield decoder.flush()
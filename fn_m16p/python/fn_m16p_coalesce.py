@@ -0,0 +1,166 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Run-length coalescing of repeated transactions (pd.Decoder's "coalesce" option)
+
+    A transaction is a TX packet plus the RX packets that follow it, up to the next TX
+    packet.  When a transaction is identical (same bytes, packet for packet) to the one
+    before it, its annotations are dropped, and once the run of identical transactions
+    ends a single annotation spanning the whole run gives the repeat count.  The first
+    transaction of a run keeps all its annotations.  Unexpected bytes and frame errors
+    end a run, also when the decoder's "detail" option leaves them unannotated (it then
+    calls error() directly).  OUTPUT_PYTHON/OUTPUT_BINARY outputs are never coalesced.
+
+    The Coalescer sits between the decoder and its put(): each packet's field
+    annotations are held until the packet is complete, and the packets of a transaction
+    that matches the previous one so far are held until it is known whether it repeats.
+'''
+
+from .fn_m16p_frame import PACKET_CLASS
+
+TX = 1
+
+REPEAT_CLASS = 26                                # Annotation class of a run's summary
+
+
+class Coalescer:
+    '''Replacement put() for a decoder, dropping the annotations of repeated
+       transactions'''
+    __slots__ = ('decoder', 'emit', 'out_ann', 'special', 'fields', 'template',
+                 'current', 'current_ss', 'current_es', 'current_label', 'matching',
+                 'held', 'repeats', 'run_ss', 'run_es', 'run_label', 'received',
+                 'emitted')
+
+    def __init__(self, decoder, put, out_ann, unexpected, frame_error):
+        self.decoder       = decoder
+        self.emit          = put                 # The real put()
+        self.out_ann       = out_ann
+        self.special       = {id(payload) for payload in unexpected + frame_error}
+        self.fields        = [[], []]            # Per direction: held field annotations
+        self.template      = None                # Packet keys of the run's transaction
+        self.current       = []                  # Packet keys of the transaction so far
+        self.current_ss    = None
+        self.current_es    = None
+        self.current_label = None                # Label of its first packet
+        self.matching      = False               # Is it matching the template so far?
+        self.held          = []                  # Its annotations, while it is
+        self.repeats       = 0                   # Transactions dropped in this run
+        self.run_ss        = None                # Span of the run (first transaction to
+        self.run_es        = None                #  the last repeat)
+        self.run_label     = None                # Label of the run's first packet
+        self.received      = 0                   # Annotations put() by the decoder
+        self.emitted       = 0                   # Annotations actually passed on
+
+    def counts(self):
+        '''Return annotation counts before and after coalescing'''
+        return {'before': self.received, 'after': self.emitted}
+
+    def put(self, start_smpl, end_smpl, output_id, data):
+        '''Take a decoder put(): pass it on, hold it back, or drop it'''
+        if output_id != self.out_ann:
+            self.emit(start_smpl, end_smpl, output_id, data)
+            return
+        self.received += 1
+        cls = data[0]
+        if id(data) in self.special:             # Unexpected byte or frame error
+            self.error(cls & 1)
+            self.pass_on([(start_smpl, end_smpl, output_id, data)])
+        elif cls < PACKET_CLASS or PACKET_CLASS + 2 <= cls < PACKET_CLASS + 4:
+            self.fields[cls & 1].append((start_smpl, end_smpl, output_id, data))
+                                                 # Field (or checksum error) of a packet
+        elif cls < PACKET_CLASS + 2:             # Packet label: the packet is complete
+            rxtx = cls - PACKET_CLASS
+            chan = self.decoder.channel[rxtx]    # (Still holds the packet's bytes)
+            puts = self.fields[rxtx]
+            puts.append((start_smpl, end_smpl, output_id, data))
+            self.fields[rxtx] = []
+            self.packet(rxtx, bytes(chan.data[:chan.state + 1]), puts,
+                        start_smpl, end_smpl, data[1])
+        else:                                    # Transaction annotations, etc.
+            self.pass_on([(start_smpl, end_smpl, output_id, data)])
+
+    def error(self, rxtx):
+        '''An unexpected byte or frame error (called directly by the decoder when it
+           doesn't annotate them): end the transaction in progress and the run'''
+        self.end_transaction()
+        self.break_run()
+        self.pass_on(self.fields[rxtx])          # (Fields of a frame that went bad)
+        self.fields[rxtx] = []
+
+    def pass_on(self, puts):
+        '''put() annotations for real'''
+        for put in puts:
+            self.emit(*put)
+        self.emitted += len(puts)
+
+    def packet(self, rxtx, data, puts, start_smpl, end_smpl, label):
+        '''Add a complete packet to the transaction in progress (or start a new one)'''
+        if rxtx == TX:
+            self.end_transaction()
+        if not self.current:
+            self.current_ss    = start_smpl
+            self.current_label = label
+        key = (rxtx, data)
+        self.current.append(key)
+        self.current_es = end_smpl
+        pos = len(self.current) - 1
+        if self.matching and pos < len(self.template) and self.template[pos] == key:
+            self.held.extend(puts)               # Might be a repeat: wait and see
+        else:
+            self.break_run()                     # Not a repeat (if it might have been)
+            self.pass_on(puts)
+
+    def end_transaction(self):
+        '''The transaction in progress is complete: drop it if it was a repeat'''
+        if not self.current:
+            return
+        if self.matching and self.current == self.template:
+            self.repeats += 1                    # Repeat: drop its annotations
+            self.run_es = self.current_es
+            self.held   = []
+        else:                                    # New transaction: start a new run
+            self.break_run()
+            self.template  = self.current
+            self.run_ss    = self.current_ss
+            self.run_es    = self.current_es
+            self.run_label = self.current_label
+        self.current  = []
+        self.matching = True                     # Next one might repeat this one
+
+    def break_run(self):
+        '''Finish the run of repeated transactions (if any): label it, and pass on
+           whatever was held back in case the transaction in progress repeated it'''
+        if self.repeats:
+            count = self.repeats + 1
+            self.pass_on([(self.run_ss, self.run_es, self.out_ann,
+                           [REPEAT_CLASS, ['%d x %s' % (count, self.run_label[0]),
+                                           '%d x %s' % (count, self.run_label[-1]),
+                                           '%dx' % count]])])
+        self.pass_on(self.held)
+        self.held     = []
+        self.repeats  = 0
+        self.matching = False
+
+    def flush(self):
+        '''End of decoding: pass on everything still held back'''
+        self.end_transaction()
+        self.break_run()
+        for rxtx in (0, 1):
+            self.pass_on(self.fields[rxtx])
+            self.fields[rxtx] = []
@@ -0,0 +1,173 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Packet encoder: the inverse of packet_msg, for building test traffic
+
+    Frames are built from a command name and a parameter:
+
+        encoder = FrameEncoder()
+        encoder.frame('Set Volume to', 20)       # -> (TX, b'\\x7e\\xff\\x06\\x06...')
+        encoder.frame('Vol=^W', 20, rxtx=RX)     # Any of the entry's strings will do
+        encoder.frame(0x06, 20)                  # Or the command code itself
+
+    or from a complete label, as the decoder would show it:
+
+        encoder.frame_from_label('Set Equalization to Rock')
+        encoder.frame_from_label('Status:SD Card / Playing')
+
+    Names are matched ignoring case and runs of spaces, with or without their
+    placeholder markers.  Labels are matched against every string of every entry (with
+    each marker standing for any of its possible values), and the parameter found is
+    checked by rendering the label again.
+'''
+
+import re
+
+from .fn_m16p_frame    import encode_frame
+from .fn_m16p_labels   import MARKERS, label_table
+from .fn_m16p_messages import packet_msg, RX, TX,                         \
+                              list_A,  list_B,  list_C, list_D,   list_E, \
+                              list_LS, list_MS, list_O, list_40RX
+
+    # Parameter values that each marker stands for: (regex for its text, function
+    # returning the (msb, lsb) parts it fixes, as {'msb'/'lsb'/'msb_hi'/'msb_lo': value})
+def list_value(strings, part):
+    '''Marker that selects one of a list of strings, indexed by the MSB or LSB'''
+    choices = sorted(set(strings), key=len, reverse=True)    # (Longest first)
+    regex   = '(' + '|'.join(re.escape(text) for text in choices) + ')'
+    return regex, lambda text: {part: strings.index(text)}
+
+VALUES = {
+    '^MLL': (r'(\d+)', lambda text: {'msb_lo': int(text) >> 8, 'lsb': int(text) & 0xFF}),
+    '^LA':  list_value(list_A,  'lsb'),
+    '^LB':  list_value(list_B,  'lsb'),
+    '^LC':  list_value(list_C,  'lsb'),
+    '^LD':  list_value(list_D,  'lsb'),
+    '^LE':  list_value(list_E,  'lsb'),
+    '^LS':  list_value(list_LS, 'lsb'),
+    '^MA':  list_value(list_A,  'msb'),
+    '^MS':  list_value(list_MS, 'msb'),
+    '^MH':  (r'(\d+)', lambda text: {'msb_hi': int(text)}),
+    '^L':   (r'(\d+)', lambda text: {'lsb': int(text)}),
+    '^M':   (r'(\d+)', lambda text: {'msb': int(text)}),
+    '^W':   (r'(\d+)', lambda text: {'msb': int(text) >> 8, 'lsb': int(text) & 0xFF}),
+}
+
+MARKER_RE = re.compile('|'.join(re.escape(marker) for marker, _ in MARKERS))
+
+
+def normalize(name):
+    '''Command name as matched: lower case, single spaces'''
+    return ' '.join(name.lower().split())
+
+
+def compile_label(org_str):
+    '''Return a regex matching the label strings that org_str can expand to, and the
+       list of VALUES functions for its groups'''
+    pattern = []
+    parts   = []
+    pos     = 0
+    for match in MARKER_RE.finditer(org_str):
+        regex, part = VALUES[match.group()]
+        pattern.append(re.escape(org_str[pos:match.start()]))
+        pattern.append(regex)
+        parts.append(part)
+        pos = match.end()
+    pattern.append(re.escape(org_str[pos:]))
+    return re.compile(''.join(pattern) + r'\Z'), parts
+
+
+class FrameEncoder:
+    '''Builds packets from command names (or labels) and parameters'''
+    __slots__ = ('names', 'labels')
+
+    def __init__(self):
+        self.names  = {}                         # Normalized name -> [(cmd, rxtx), ...]
+        self.labels = []                         # (cmd, rxtx, regex, parts), in cmd order
+        for (cmd, rxtx), msg in sorted(packet_msg.items()):
+            if cmd == 0xFF:                      # ("Unknown" isn't a command of its own)
+                continue
+            if msg[0] in ('^LO', '^LX'):         # Whole label chosen by the LSB
+                choices = list_O if msg[0] == '^LO' else list_40RX
+                for lsb, strings in enumerate(choices):
+                    for text in strings:
+                        regex = re.compile('(' + re.escape(text) + r')\Z')
+                        self.labels.append((cmd, rxtx, regex,
+                                            [lambda text, lsb=lsb: {'lsb': lsb}]))
+                continue
+            for text in msg:
+                for name in (text, MARKER_RE.sub('', text)):
+                    keys = self.names.setdefault(normalize(name), [])
+                    if (cmd, rxtx) not in keys:
+                        keys.append((cmd, rxtx))
+                regex, parts = compile_label(text)
+                self.labels.append((cmd, rxtx, regex, parts))
+
+    def command(self, name, rxtx=None):
+        '''Return (cmd, rxtx) for a command name or code (rxtx defaults to TX for a
+           code, and to whichever direction has that name otherwise)'''
+        if isinstance(name, int):
+            return name, TX if rxtx is None else rxtx
+        keys = [key for key in self.names.get(normalize(name), ())
+                if rxtx is None or key[1] == rxtx]
+        if not keys:
+            raise ValueError('Unknown command name: %r' % name)
+        if len(keys) > 1:
+            raise ValueError('Ambiguous command name %r: could be %s'
+                             % (name, ', '.join('0x%02X %s' % (cmd, ('RX', 'TX')[key_rxtx])
+                                                for cmd, key_rxtx in keys)))
+        return keys[0]
+
+    def frame(self, name, param=0, rxtx=None, feed=0, with_checksum=True):
+        '''Return (rxtx, packet bytes) for a command name or code.  param is the 16-bit
+           parameter, or an (msb, lsb) pair.'''
+        cmd, rxtx = self.command(name, rxtx)
+        msb, lsb  = param if isinstance(param, tuple) else divmod(param, 256)
+        if not (0 <= msb < 256 and 0 <= lsb < 256):
+            raise ValueError('Parameter out of range: %r' % (param,))
+        return rxtx, encode_frame(cmd, msb, lsb, feed, with_checksum)
+
+    def parse(self, label, rxtx=None):
+        '''Return (cmd, rxtx, msb, lsb) for a packet whose label (any of its strings)
+           is the given text'''
+        for cmd, key_rxtx, regex, parts in self.labels:
+            if rxtx is not None and key_rxtx != rxtx:
+                continue
+            match = regex.match(label)
+            if match is None:
+                continue
+            fixed = {}
+            for part, text in zip(parts, match.groups()):
+                fixed.update(part(text))
+            msb = fixed.get('msb', (fixed.get('msb_hi', 0) << 4) | fixed.get('msb_lo', 0))
+            lsb = fixed.get('lsb', 0)
+            if not (0 <= msb < 256 and 0 <= lsb < 256):
+                continue
+            try:                                 # Does it really render as that label?
+                strings = label_table[(cmd << 1) | key_rxtx].render(msb, lsb)
+            except IndexError:
+                continue
+            if label in strings:
+                return cmd, key_rxtx, msb, lsb
+        raise ValueError('No packet has the label %r' % label)
+
+    def frame_from_label(self, label, rxtx=None, feed=0, with_checksum=True):
+        '''Return (rxtx, packet bytes) for a packet with the given label'''
+        cmd, rxtx, msb, lsb = self.parse(label, rxtx)
+        return rxtx, encode_frame(cmd, msb, lsb, feed, with_checksum)
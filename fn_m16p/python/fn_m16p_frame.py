@@ -0,0 +1,161 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' FN_M16P packet framing: byte offsets, byte actions and channel state
+
+    Nothing in here depends on the sigrokdecode module, so the same state machine can
+    be driven from outside libsigrokdecode.
+'''
+
+#                             ==========================
+#                             FN_M16P DATA PACKET FORMAT
+#                             ==========================
+#                                                  Parameter        Checksum
+#       START    VER     LEN     CMD    FEED     MSB     LSB    CHK1    CHK2     END
+#     +-------+-------+-------+-------+-------+-------+-------+-------+-------+-------+
+#     | 0x7E  | 0xFF  | 0x06  |[DATA] | 0 or 1|[DATA] |[DATA] |[CALC] |[CALC] | 0xEF  |
+#     +-------+-------+-------+-------+-------+-------+-------+-------+-------+-------+
+
+    # Byte offsets within each packet
+# START = 0, VER = 1, LEN = 2, END = 9 (or 7, when there are no checksum bytes)
+CMD  = 3
+FEED = 4
+MSB  = 5
+LSB  = 6
+CHK1 = 7
+CHK2 = 8
+
+START_BYTE = 0x7E
+END_BYTE   = 0xEF
+VERSION    = 0xFF                                # Ver and Len bytes of every packet
+LENGTH     = 0x06
+
+PKT_MAX = 10                                     # Longest possible packet (with checksum)
+
+    # Channel states: IDLE means "not currently in a packet"; any other state number is
+    # the count of packet bytes received so far (1 to PKT_MAX-1)
+IDLE = 0
+
+    # Annotation class (RX; add 1 for TX) for each field_label entry, as listed in
+    # Decoder.annotations.  A byte received in state N is field_label entry N+1.
+FIELD_CLASS = {
+    0:  0,                                       # Unexpected
+    1:  2,  2:  4,  3:  6,  4:  8,  5: 10,       # Start, Ver, Len, Cmd, Feed
+    6: 12,  7: 14,                               # Param MSB, LSB (shares the checksum class)
+    8: 14,  9: 14,                               # Checksum MSB, LSB
+    10: 16,                                      # End
+    14: 20,                                      # Checksum Mismatch
+    15:  0,                                      # Frame Error
+}
+PACKET_CLASS = 18                                # Overall packet
+
+    # Actions taken for a byte, looked up from the channel's state and the byte's value
+    # (in the transition table compiled from a frame schema: see fn_m16p_schema)
+ACT_UNKNOWN   = 0                                # Unexpected byte while IDLE
+ACT_START     = 1                                # Start byte: a packet begins
+ACT_FIELD     = 2                                # Ver/Len/Cmd/Feed/MSB/LSB/Chk1/Chk2 byte
+ACT_END       = 3                                # End byte: the packet is complete
+ACT_FRAME_ERR = 4                                # Byte not allowed here (e.g. 10th byte
+                                                 # wasn't an End byte)
+
+
+    # Checksum status of a complete packet
+CHK_NONE = 0                                     # 8-byte packet, without checksum bytes
+CHK_OK   = 1                                     # Checksum bytes match
+CHK_BAD  = 2                                     # Checksum bytes don't match
+
+
+def checksum(data):
+    '''DFPlayer checksum of a packet's Ver/Len/Cmd/Feed/MSB/LSB bytes, as a 16-bit value
+       (CHK1 is the high byte, CHK2 the low byte)'''
+    return -sum(data[1:CHK1]) & 0xFFFF
+
+
+def checksum_status(data, length):
+    '''Return CHK_NONE, CHK_OK or CHK_BAD for a complete packet of the given length'''
+    if length < PKT_MAX:
+        return CHK_NONE
+    if (data[CHK1] << 8) + data[CHK2] == checksum(data):
+        return CHK_OK
+    return CHK_BAD
+
+
+def encode_frame(cmd, msb=0, lsb=0, feed=0, with_checksum=True):
+    '''Return the bytes of a packet: 10 of them with checksum bytes, 8 without'''
+    data = bytearray((START_BYTE, VERSION, LENGTH, cmd, feed, msb, lsb))
+    if with_checksum:
+        value = checksum(data)
+        data += bytes((value >> 8, value & 0xFF))
+    data.append(END_BYTE)
+    return bytes(data)
+
+
+class Channel:
+    '''Packet-in-progress state for one direction (RX or TX)'''
+    __slots__ = ('rows', 'field_ann', 'state', 'packet_ss', 'packet_es', 'data',
+                 'byte_ss', 'byte_es', 'chk_sum')
+
+    def __init__(self, rows=(), field_ann=()):
+        self.rows      = rows                    # Transition table: [state][byte] -> action
+        self.field_ann = field_ann               # Field annotation payload for each state
+        self.data      = bytearray(PKT_MAX)      # Fixed buffers, reused for every packet:
+        self.byte_ss   = [-1] * PKT_MAX          #  data bytes and (when annotations are
+        self.byte_es   = [-1] * PKT_MAX          #  held back: see hold()) their samples
+        self.chk_sum   = 0                       # Running sum of the checksummed bytes
+        self.reset()
+
+    def reset(self):
+        '''Return to IDLE, ready for the next packet'''
+        self.state     = IDLE                    # Not currently in a packet
+        self.packet_ss = -1                      # Set Start Sample number out of range
+        self.packet_es = -1                      # Set End Sample number out of range
+
+    def hold(self, byte, start_smpl, end_smpl):
+        '''Run one byte through the transition table, holding it (and its samples) in
+           the frame buffer until the frame is known to be good or bad; return its
+           action.  On ACT_END the complete packet is left in the buffer, and on
+           ACT_FRAME_ERR the offending byte is held after the frame's other bytes: the
+           caller handles them, then calls reset().'''
+        state  = self.state
+        action = self.rows[state][byte]
+        if action == ACT_FIELD:
+            if state < CHK1:                     # Ver/Len/Cmd/Feed/MSB/LSB byte?
+                self.chk_sum += byte             #  Yes, it's covered by the checksum
+            self.state = state + 1
+        elif action == ACT_START:
+            self.packet_ss = start_smpl
+            self.chk_sum   = 0
+            self.state     = 1
+        elif action == ACT_END:
+            self.packet_es = end_smpl
+        elif action == ACT_UNKNOWN:
+            return action
+        self.data[state]    = byte
+        self.byte_ss[state] = start_smpl
+        self.byte_es[state] = end_smpl
+        return action
+
+    def checksum_status(self):
+        '''Return CHK_NONE, CHK_OK or CHK_BAD for the complete packet held (using the
+           running sum, rather than summing its bytes again)'''
+        if self.state < PKT_MAX - 1:
+            return CHK_NONE
+        if (self.data[CHK1] << 8) + self.data[CHK2] == -self.chk_sum & 0xFFFF:
+            return CHK_OK
+        return CHK_BAD
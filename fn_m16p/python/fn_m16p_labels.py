@@ -0,0 +1,204 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Packet label tables, "compiled" once at import time from fn_m16p_messages
+
+    Every entry of packet_msg is turned into a small label object that knows how to
+    produce its final string list from the packet's MSB/LSB without re-scanning the
+    entry for placeholder markers.  The objects are stored in a dense dispatch table
+    indexed by (cmd << 1) | rxtx, so finding the right one costs a single list index.
+'''
+
+from .fn_m16p_messages import packet_msg,                                 \
+                              list_A,  list_B,  list_C, list_D,   list_E, \
+                              list_LS, list_MS, list_O, list_40RX
+
+    # Placeholder markers, each with a function that produces its replacement text
+    # from the parameter bytes.  Longer markers come first so that, for example,
+    # '^MLL' is never mistaken for '^M' followed by 'LL' (see legend in fn_m16p_messages).
+MARKERS = (
+    ('^MLL', lambda msb, lsb: str(((msb & 0x0F) << 8) + lsb)),
+    ('^LA',  lambda msb, lsb: list_A[lsb]                   ),
+    ('^LB',  lambda msb, lsb: list_B[lsb]                   ),
+    ('^LC',  lambda msb, lsb: list_C[lsb]                   ),
+    ('^LD',  lambda msb, lsb: list_D[lsb]                   ),
+    ('^LE',  lambda msb, lsb: list_E[lsb]                   ),
+    ('^LS',  lambda msb, lsb: list_LS[lsb]                  ),
+    ('^MA',  lambda msb, lsb: list_A[msb]                   ),
+    ('^MS',  lambda msb, lsb: list_MS[msb%16]               ),
+    ('^MH',  lambda msb, lsb: str(msb >> 4)                 ),
+    ('^L',   lambda msb, lsb: str(lsb)                      ),
+    ('^M',   lambda msb, lsb: str(msb)                      ),
+    ('^W',   lambda msb, lsb: str((msb << 8) + lsb)         ),
+)
+
+CACHE_SIZE = 4096                                # Max number of expanded labels to remember
+
+
+def compile_str(org_str):
+    '''Split a label string into a str.format() pattern and the list of functions
+       that produce the values for its {} fields'''
+    pattern = []
+    fields  = []
+    pos     = 0
+    while pos < len(org_str):
+        if org_str[pos] == '^':                  # Possible start of a marker?
+            for marker, func in MARKERS:
+                if org_str.startswith(marker, pos):
+                    pattern.append('{}')         #  Yes, leave a field for its value
+                    fields.append(func)
+                    pos += len(marker)
+                    break
+            else:                                #  No, it's just a literal '^'
+                pattern.append('^')
+                pos += 1
+        else:                                    # Copy literal characters, escaping
+                                                 # any braces for str.format()
+            pattern.append(org_str[pos].replace('{', '{{').replace('}', '}}'))
+            pos += 1
+    return ''.join(pattern), tuple(fields)
+
+
+class StaticLabel:
+    '''Packet label with no placeholders: always the same string list'''
+    __slots__ = ('strings',)
+    cacheable = False
+
+    def __init__(self, strings):
+        self.strings = strings
+
+    def render(self, msb, lsb):                  # pylint: disable=unused-argument
+        '''Return the label's string list'''
+        return self.strings
+
+
+class IndexedLabel:
+    '''Packet label chosen whole from a separate list, indexed by the LSB (^LO, ^LX)'''
+    __slots__ = ('choices',)
+    cacheable = False
+
+    def __init__(self, choices):
+        self.choices = choices
+
+    def render(self, msb, lsb):                  # pylint: disable=unused-argument
+        '''Return the string list selected by the LSB'''
+        return self.choices[lsb]
+
+
+class TemplateLabel:
+    '''Packet label whose strings contain placeholders to be filled in'''
+    __slots__ = ('templates',)
+    cacheable = True
+
+    def __init__(self, strings):
+        self.templates = tuple(compile_str(org_str) for org_str in strings)
+
+    def render(self, msb, lsb):
+        '''Return a new string list with all placeholders replaced by actual values'''
+        return [pattern.format(*[func(msb, lsb) for func in fields])
+                for pattern, fields in self.templates]
+
+
+def compile_msg(msg):
+    '''Build the appropriate label object for one packet_msg entry'''
+    if msg[0].find('^') < 0:                     # Same tests (and order) as the original
+        return StaticLabel(msg)                  # per-packet code in pd.py
+    if msg[0] == '^LO':
+        return IndexedLabel(list_O)
+    if msg[0] == '^LX':
+        return IndexedLabel(list_40RX)
+    return TemplateLabel(msg)
+
+
+def build_table(messages=packet_msg):
+    '''Build the dense 256 x 2 (cmd, rxtx) dispatch table of label objects for a
+       packet_msg-style table of messages'''
+    compiled = {key: compile_msg(msg) for key, msg in messages.items()}
+    table    = []
+    for cmd in range(256):
+        for rxtx in (0, 1):                      # Commands with no entry of their own get
+                                                 # the "Unknown Feedback / Command" label
+            table.append(compiled.get((cmd, rxtx), compiled[0xFF, rxtx]))
+    return table
+
+label_table = build_table()                      # Index with (cmd << 1) | rxtx
+
+
+class LabelCache:
+    '''Bounded memo of expanded packet labels, keyed on (cmd, rxtx, msb, lsb)
+
+       The returned string lists are shared between calls, so callers must not modify
+       them.  (libsigrokdecode copies the strings out of each annotation it is given.)
+
+       A parameter beyond the strings of its message (e.g. track folder 200) gets a raw
+       label instead, naming the command and parameter bytes, and is counted in
+       bad_params.  With strict=True the IndexError is raised instead, for callers
+       that look for parameters having a proper label.'''
+    __slots__ = ('table', 'labels', 'maxsize', 'strict', 'hits', 'misses', 'bad_params')
+
+    def __init__(self, maxsize=CACHE_SIZE, table=None, strict=False):
+        self.table      = label_table if table is None else table   # (See build_table())
+        self.labels     = {}
+        self.maxsize    = maxsize
+        self.strict     = strict
+        self.hits       = 0
+        self.misses     = 0
+        self.bad_params = [0, 0]                 # Raw labels given, per direction
+
+    def lookup(self, cmd, rxtx, msb, lsb):
+        '''Return the string list labelling a packet with the given values'''
+        entry = self.table[(cmd << 1) | rxtx]
+        if not entry.cacheable:                  # Static/indexed labels are already
+            try:                                 # as cheap as a cache lookup
+                return entry.render(msb, lsb)
+            except IndexError:
+                return self.raw_label(cmd, rxtx, msb, lsb)
+
+        key    = (cmd << 17) | (rxtx << 16) | (msb << 8) | lsb
+        output = self.labels.get(key)
+        if output is None:                       # Not seen recently, so expand it
+            self.misses += 1
+            try:
+                output = entry.render(msb, lsb)
+            except IndexError:                   # (Not cached: these should be rare)
+                return self.raw_label(cmd, rxtx, msb, lsb)
+            if len(self.labels) >= self.maxsize: #  Cache full?  Start over rather than
+                self.labels.clear()              #  paying for LRU bookkeeping per hit
+            self.labels[key] = output
+        else:
+            self.hits += 1
+        return output
+
+    def raw_label(self, cmd, rxtx, msb, lsb):
+        '''Label a packet whose parameter is out of range by its command and parameter
+           bytes, under the "Unknown Command/Feedback" strings of its direction'''
+        if self.strict:
+            raise IndexError('Parameter 0x%02X 0x%02X out of range for command 0x%02X'
+                             % (msb, lsb, cmd))
+        self.bad_params[rxtx] += 1
+        long, short, shortest = self.table[(0xFF << 1) | rxtx].strings
+        return ['%s 0x%02X (0x%02X 0x%02X)' % (long, cmd, msb, lsb),
+                '%s 0x%02X' % (short, cmd), shortest]
+
+    def clear(self):
+        '''Forget all cached labels and statistics'''
+        self.labels.clear()
+        self.hits       = 0
+        self.misses     = 0
+        self.bad_params = [0, 0]
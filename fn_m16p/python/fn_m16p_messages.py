@@ -34,6 +34,7 @@ field_label = {
     9:  ['Chksum LSB',     'C LSB',   'CL',  'C' ],
     10: ['End Byte',       'End',            'E' ],
 
+    14: ['Chksum Mismatch', 'Bad Chk', 'BC'      ],
     15: ['Frame Error',    'Frm Err', 'FE'       ]
 }
 
@@ -182,3 +183,15 @@ list_40RX = [       # eXceptions / errors
               ['Entered Sleep Mode',      'Entered Sleep',  'Enter Slp' ]   # Different than
                                                                             # 'Module is Sleeping'?
             ]
+
+
+    # DFPlayer Mini (YX5200 chip) messages, where they differ from the FN-M16P's: per the
+    # DFPlayer Mini manual, 0x08 selects a playback mode (0 = Repeat, 1 = Folder Repeat,
+    # 2 = Single Repeat, 3 = Random) rather than looping a track
+packet_msg_yx5200 = dict(packet_msg)
+packet_msg_yx5200[(0x08, TX)] = ['Set Playback Mode ^L',     'Play Mode ^L',      'Mode ^L'     ]
+
+
+    # Version of the tables above.  Caches of decoded results (fn_m16p_cache) are keyed
+    # on it, so bump it whenever an entry changes.
+TABLE_VERSION = 2
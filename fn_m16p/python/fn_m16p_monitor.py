@@ -0,0 +1,275 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Live monitoring of FN-M16P traffic read straight from serial ports (asyncio)
+
+    Two byte streams -- the module's RX and TX lines, each wired to a serial port (or a
+    pty, for testing) -- are decoded with the same state machine and label tables as
+    pd.py, stamped with the host's clock instead of sample numbers:
+
+        python -m fn_m16p.fn_m16p_monitor --rx /dev/ttyUSB0 --tx /dev/ttyUSB1
+
+    Decoded packets go to subscribers' bounded queues.  By default a full queue holds up
+    reading (backpressure, until the OS buffer overflows); with drop=True the oldest
+    queued packet is dropped instead.  The most recent packets are kept in a ring
+    buffer, so memory use stays flat however long the monitor runs.  POSIX only.
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import termios
+import time
+import tty
+from collections import deque
+
+from .fn_m16p_frame    import CMD, MSB, LSB, ACT_UNKNOWN, ACT_START, ACT_FIELD, ACT_END, \
+                              checksum_status
+from .fn_m16p_labels   import LabelCache
+from .fn_m16p_schema   import ENGINES, DEFAULT
+from .fn_m16p_transact import LatencyHistogram
+
+RING_SIZE  = 1000                                # Recent packets kept
+QUEUE_SIZE = 1000                                # Packets queued per subscriber
+READ_SIZE  = 4096                                # Bytes read from a port at a time
+
+BAUD_RATES = {rate: getattr(termios, 'B%d' % rate) for rate in
+              (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200, 230400)
+              if hasattr(termios, 'B%d' % rate)}
+
+
+class LiveFrame:
+    '''A packet received from one of the lines'''
+    __slots__ = ('rxtx', 'data', 'label', 'chk', 'start_time', 'end_time', 'latency')
+
+    def __init__(self, rxtx, data, label, start_time, end_time):
+        self.rxtx       = rxtx                   # 0 = RX, 1 = TX
+        self.data       = data                   # Packet bytes
+        self.label      = label                  # Packet label strings (longest first)
+        self.chk        = checksum_status(data, len(data))   # fn_m16p_frame.CHK_*
+        self.start_time = start_time             # Host time (time.time()) of the reads
+        self.end_time   = end_time               #  holding its Start and End bytes
+        self.latency    = None                   # Seconds from read to delivery
+
+    @property
+    def cmd(self):
+        '''Command code'''
+        return self.data[CMD]
+
+    def __repr__(self):
+        return '%.6f %s %s' % (self.start_time, ('RX', 'TX')[self.rxtx], self.label[0])
+
+
+class StreamDecoder:
+    '''Byte-at-a-time packet decoder for both lines, without sigrokdecode, running the
+       same byte engine as pd.Decoder (Channel.hold())'''
+    __slots__ = ('channel', 'label_cache', 'unexpected', 'frame_errors')
+
+    def __init__(self, engine=DEFAULT):
+        self.channel      = engine.channels()    # (See fn_m16p_schema)
+        self.label_cache  = LabelCache(table=engine.labels)
+        self.unexpected   = [0, 0]               # Bytes outside packets, per direction
+        self.frame_errors = [0, 0]               # Bad frames, per direction
+
+    def feed(self, rxtx, chunk, stamp):
+        '''Decode bytes read from one line at host time "stamp"; return the LiveFrames
+           they complete'''
+        chan   = self.channel[rxtx]
+        frames = []
+        for byte in chunk:
+            action = chan.hold(byte, stamp, stamp)   # (Host times, not sample numbers)
+            if action == ACT_FIELD or action == ACT_START:
+                continue
+            if action == ACT_END:
+                frames.append(self.packet(rxtx))
+            elif action == ACT_UNKNOWN:
+                self.unexpected[rxtx] += 1
+                continue
+            else:
+                self.frame_errors[rxtx] += 1
+            chan.reset()
+        return frames
+
+    def packet(self, rxtx):
+        '''Return a LiveFrame for the complete packet held in a channel'''
+        chan = self.channel[rxtx]
+        data = bytes(chan.data[:chan.state + 1])
+        label = self.label_cache.lookup(data[CMD], rxtx, data[MSB], data[LSB])
+        return LiveFrame(rxtx, data, label, chan.packet_ss, chan.packet_es)
+
+
+def open_port(path, baudrate):
+    '''Open a serial port (or pty) for non-blocking reads: raw, 8N1, at baudrate'''
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[2] = (attrs[2] & ~(termios.PARENB | termios.CSTOPB | termios.CSIZE)) \
+                   | termios.CS8 | termios.CLOCAL | termios.CREAD
+        attrs[4] = attrs[5] = BAUD_RATES[baudrate]   # Input and output speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    return fd
+
+
+class Monitor:
+    '''Reads both lines, decodes them and hands the packets to subscribers'''
+
+    def __init__(self, ring_size=RING_SIZE, engine=DEFAULT):
+        self.decoder     = StreamDecoder(engine)
+        self.recent      = deque(maxlen=ring_size)   # Ring buffer of recent LiveFrames
+        self.subscribers = []                    # (queue, drop) pairs
+        self.latency     = LatencyHistogram()    # Decode latency, in microseconds
+        self.packets     = [0, 0]                # Per direction
+        self.bytes       = [0, 0]
+        self.dropped     = 0                     # Packets dropped from full queues
+        self.started     = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def subscribe(self, maxsize=QUEUE_SIZE, drop=False):
+        '''Return a new asyncio.Queue that will receive every LiveFrame from now on'''
+        queue = asyncio.Queue(maxsize)
+        self.subscribers.append((queue, drop))
+        return queue
+
+    def unsubscribe(self, queue):
+        '''Stop sending LiveFrames to a queue'''
+        self.subscribers = [sub for sub in self.subscribers if sub[0] is not queue]
+
+    async def read_line(self, rxtx, fd):
+        '''Read and decode one line until it closes'''
+        reader = asyncio.StreamReader(limit=READ_SIZE)
+        loop   = asyncio.get_running_loop()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', 0))
+        try:
+            while True:
+                try:
+                    chunk = await reader.read(READ_SIZE)
+                except OSError:                  # (EIO: the other end of a pty closed)
+                    break
+                if not chunk:
+                    break
+                received = time.perf_counter()
+                self.bytes[rxtx] += len(chunk)
+                for frame in self.decoder.feed(rxtx, chunk, time.time()):
+                    await self.publish(frame, received)
+        finally:
+            transport.close()
+
+    async def publish(self, frame, received):
+        '''Record a frame and pass it to each subscriber'''
+        self.recent.append(frame)
+        self.packets[frame.rxtx] += 1
+        for queue, drop in self.subscribers:
+            if queue.full() and drop:
+                queue.get_nowait()               # Make room: lose the oldest
+                self.dropped += 1
+            await queue.put(frame)               # (Waits for room, when not dropping)
+        frame.latency = time.perf_counter() - received
+        self.latency.add(int(frame.latency * 1e6))
+
+    async def run(self, rx_fd, tx_fd):
+        '''Monitor both lines until they close'''
+        await asyncio.gather(self.read_line(0, rx_fd), self.read_line(1, tx_fd))
+
+    def report(self):
+        '''Return throughput, CPU load and decode latency figures, as a dict'''
+        elapsed = time.perf_counter() - self.started
+        cpu     = time.process_time() - self.cpu_started
+        return {'elapsed': elapsed, 'bytes': list(self.bytes), 'packets': list(self.packets),
+                'unexpected': list(self.decoder.unexpected),
+                'frame_errors': list(self.decoder.frame_errors),
+                'bad_params': list(self.decoder.label_cache.bad_params),
+                'dropped': self.dropped,
+                'cpu': cpu / elapsed if elapsed else 0.0,
+                'latency_us': self.latency.summary()}
+
+
+def print_report(report, out=sys.stderr):
+    '''Print a report() one-liner'''
+    lat = report['latency_us']
+    print('%.0f s: RX %d/TX %d bytes, %d/%d packets, %d/%d unexpected, %d/%d frame errors, '
+          '%d dropped, CPU %.1f%%, latency p50 %s p99 %s max %s us'
+          % (report['elapsed'], report['bytes'][0], report['bytes'][1],
+             report['packets'][0], report['packets'][1],
+             report['unexpected'][0], report['unexpected'][1],
+             report['frame_errors'][0], report['frame_errors'][1], report['dropped'],
+             report['cpu'] * 100.0, lat['p50'], lat['p99'], lat['max']), file=out)
+
+
+async def monitor_main(args):
+    '''Monitor the ports given on the command line, printing packets and reports'''
+    monitor = Monitor(args.ring_size, ENGINES[args.variant])
+    queue   = monitor.subscribe(args.queue_size, drop=args.drop)
+
+    async def printer():
+        while True:
+            frame = await queue.get()
+            if not args.quiet:
+                stamp = time.strftime('%H:%M:%S', time.localtime(frame.start_time))
+                print('%s %s %s' % (stamp, ('RX', 'TX')[frame.rxtx], frame.label[0]),
+                      flush=True)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(args.report)
+            print_report(monitor.report())
+
+    tasks = [asyncio.ensure_future(printer())]
+    if args.report:
+        tasks.append(asyncio.ensure_future(reporter()))
+    try:
+        await monitor.run(open_port(args.rx, args.baudrate), open_port(args.tx, args.baudrate))
+        while not queue.empty():                 # Let the printer catch up
+            await asyncio.sleep(0)
+    finally:
+        for task in tasks:
+            task.cancel()
+        print_report(monitor.report())
+
+
+def main(argv=None):
+    '''Command-line entry point'''
+    parser = argparse.ArgumentParser(description='Monitor FN-M16P traffic on two serial '
+                                                 'ports.')
+    parser.add_argument('--rx', required=True, help='port wired to the module\'s RX line')
+    parser.add_argument('--tx', required=True, help='port wired to the module\'s TX line')
+    parser.add_argument('--baudrate', type=int, default=9600, choices=sorted(BAUD_RATES))
+    parser.add_argument('--variant', default=DEFAULT.name, choices=sorted(ENGINES),
+                        help='module variant (default: %(default)s)')
+    parser.add_argument('--ring-size', type=int, default=RING_SIZE,
+                        help='recent packets kept (default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help='packets queued for printing (default: %(default)s)')
+    parser.add_argument('--drop', action='store_true',
+                        help='drop packets when printing falls behind, rather than '
+                             'holding up reading')
+    parser.add_argument('--report', type=float, default=60.0,
+                        help='seconds between reports, 0 for none (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='don\'t print packets')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(monitor_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
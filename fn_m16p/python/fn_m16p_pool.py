@@ -0,0 +1,252 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Batch decoding of many sigrok session (.sr) files on a pool of worker processes
+
+    Each capture is decoded (as in fn_m16p_session) by one worker; the packets of all
+    captures are merged, as they are decoded, into a single columnar NumPy .npz file:
+
+        python -m fn_m16p.fn_m16p_pool --rx D5 --tx D6 -o packets.npz captures/
+
+    Packet columns (one row per packet, captures one after another, in file name order):
+        ss, es, rxtx, cmd, feed, msb, lsb, length   As in fn_m16p_batch.BatchResult
+        capture                                     Capture number (row of the index)
+    Per-capture index:
+        files, offset, count                        File name, first row and number of
+                                                    packets of each capture
+        samplerate, samples                         From the capture's metadata
+        errors                                      Error message ('' if decoded OK)
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from .fn_m16p_schema  import ENGINES, DEFAULT
+from .fn_m16p_session import SessionReader, decode_session, BLOCK_SIZE
+
+COLUMNS = ('ss', 'es', 'rxtx', 'cmd', 'feed', 'msb', 'lsb', 'length')
+DTYPES  = (np.int64, np.int64, np.uint8, np.uint8, np.uint8, np.uint8, np.uint8, np.uint8)
+
+
+def find_captures(paths):
+    '''Return the .sr files named by paths (files, or directories to search), sorted'''
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names
+                             if name.endswith('.sr'))
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def empty_columns():
+    '''Return a dict of empty packet columns'''
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in zip(COLUMNS, DTYPES)}
+
+
+def decode_capture(path, rx, tx, baudrate=9600, block_size=BLOCK_SIZE,
+                   variant=DEFAULT.name):
+    '''Decode one capture (in a worker process), for a module variant (named, as in
+       fn_m16p_schema.ENGINES).  Returns (columns, samplerate, samples, error), where
+       columns is a dict of packet column arrays.'''
+    try:
+        with SessionReader(path) as reader:
+            parts = [[] for _ in COLUMNS]
+            for result in decode_session(reader, rx, tx, baudrate, block_size,
+                                         ENGINES[variant]):
+                for part, name in zip(parts, COLUMNS):
+                    part.append(getattr(result, name))
+            columns = {name: np.concatenate(part).astype(dtype, copy=False)
+                       for name, part, dtype in zip(COLUMNS, parts, DTYPES)}
+            return columns, reader.samplerate, reader.samples, ''
+    except Exception as err:                     # pylint: disable=broad-except
+        return empty_columns(), 0, 0, '%s: %s' % (type(err).__name__, err)
+
+
+class MergedOutput:
+    '''Collects the packet columns of each capture as they arrive (in any order), and
+       streams them to disk in capture order: each capture's columns are appended to a
+       raw file per column (next to the output) as soon as the captures before it are
+       written, so only the captures that finished early are held in memory.  save()
+       then copies the column files into the .npz file, with the per-capture index.'''
+    __slots__ = ('files', 'path', 'tmpdir', 'columns', 'early', 'written', 'packets',
+                 'index')
+
+    def __init__(self, files, path):
+        self.files   = files
+        self.path    = path
+        self.tmpdir  = tempfile.mkdtemp(prefix='.fn_m16p-', dir=os.path.dirname(path) or '.')
+        self.columns = {name: open(os.path.join(self.tmpdir, name), 'wb')
+                        for name in COLUMNS + ('capture',)}
+        self.early   = {}                        # Capture number -> result, not yet written
+        self.written = 0                         # Captures written so far
+        self.packets = 0                         # Rows written so far
+        self.index   = []                        # Per capture written: (offset, count,
+                                                 #  samplerate, samples, error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''Remove the column files'''
+        for column in self.columns.values():
+            column.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def waiting(self):
+        '''Return the number of captures held in memory, waiting for earlier ones'''
+        return len(self.early)
+
+    def add(self, num, result):
+        '''Take the result (from decode_capture()) for capture number num, and write out
+           every result now next in order'''
+        self.early[num] = result
+        while self.written in self.early:
+            self.write(self.early.pop(self.written))
+
+    def write(self, result):
+        '''Append the next capture's columns to the column files'''
+        columns, rate, samples, error = result
+        count = len(columns['ss'])
+        for name, dtype in zip(COLUMNS, DTYPES):
+            np.ascontiguousarray(columns[name], dtype=dtype).tofile(self.columns[name])
+        np.full(count, self.written, dtype=np.uint32).tofile(self.columns['capture'])
+        self.index.append((self.packets, count, rate, samples, error))
+        self.written += 1
+        self.packets += count
+
+    def save(self):
+        '''Write the .npz file (any capture not decoded is recorded as such); return the
+           per-capture index, as a dict of arrays'''
+        for num in range(self.written, len(self.files)):
+            self.add(num, self.early.get(num, (empty_columns(), 0, 0, 'Not decoded')))
+        index = {
+            'files':      np.array(self.files, dtype=str),
+            'offset':     np.array([row[0] for row in self.index], dtype=np.int64),
+            'count':      np.array([row[1] for row in self.index], dtype=np.int64),
+            'samplerate': np.array([row[2] for row in self.index], dtype=np.int64),
+            'samples':    np.array([row[3] for row in self.index], dtype=np.int64),
+            'errors':     np.array([row[4] for row in self.index], dtype=str),
+        }
+        dtypes = dict(zip(COLUMNS, DTYPES), capture=np.uint32)
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True) as out:
+            for name, column in self.columns.items():
+                column.close()
+                header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtypes[name])),
+                          'fortran_order': False, 'shape': (self.packets,)}
+                with out.open(name + '.npy', 'w', force_zip64=True) as member, \
+                     open(column.name, 'rb') as data:
+                    np.lib.format.write_array_header_2_0(member, header)
+                    shutil.copyfileobj(data, member, 1 << 20)
+            for name, array in index.items():
+                with out.open(name + '.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, array, allow_pickle=False)
+        return index
+
+
+def run_pool(output, args, progress=sys.stderr):
+    '''Decode output.files on a pool of args.jobs workers into output (a MergedOutput),
+       keeping at most args.queue captures queued, in progress or waiting to be written
+       at a time'''
+    files   = output.files
+    started = time.perf_counter()
+    done    = 0
+
+    def report(num, result):
+        nonlocal done
+        output.add(num, result)
+        done += 1
+        columns, _, samples, error = result
+        print('[%d/%d] %s: %s (%.1f s)'
+              % (done, len(files), files[num],
+                 error or '%d samples, %d packets' % (samples, len(columns['ss'])),
+                 time.perf_counter() - started), file=progress)
+
+    decode_args = (args.rx, args.tx, args.baudrate, args.block_size, args.variant)
+    if args.jobs == 1:                           # No pool: easier to debug or profile
+        for num, path in enumerate(files):
+            report(num, decode_capture(path, *decode_args))
+        return output
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        queued = {}                              # Future -> capture number
+        for num, path in enumerate(files):
+            queued[pool.submit(decode_capture, path, *decode_args)] = num
+                                                 # Bounded: wait for room in the queue
+            while queued and len(queued) + output.waiting() >= args.queue:
+                finished, _ = wait(queued, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    report(queued.pop(future), future.result())
+        for future in wait(queued)[0]:
+            report(queued[future], future.result())
+    return output
+
+
+def main(argv=None):
+    '''Command-line entry point'''
+    parser = argparse.ArgumentParser(description='Decode FN-M16P packets from many sigrok '
+                                                 'session (.sr) files, in parallel.')
+    parser.add_argument('paths', nargs='+', help='.sr files, or directories holding them')
+    parser.add_argument('-o', '--output', required=True, help='merged .npz file to write')
+    parser.add_argument('--rx', required=True, help='channel on the module\'s RX line')
+    parser.add_argument('--tx', required=True, help='channel on the module\'s TX line')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--variant', default=DEFAULT.name, choices=sorted(ENGINES),
+                        help='module variant (default: %(default)s)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help='samples per block (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core, %(default)s)')
+    parser.add_argument('--queue', type=int, default=None,
+                        help='captures queued at once (default: twice the workers)')
+    args = parser.parse_args(argv)
+    args.jobs  = max(args.jobs, 1)
+    args.queue = max(args.queue or 2 * args.jobs, 1)
+
+    files = find_captures(args.paths)
+    if not files:
+        parser.error('no .sr files found')
+    started = time.perf_counter()
+    with MergedOutput(files, args.output) as output:
+        index = run_pool(output, args).save()
+    elapsed = time.perf_counter() - started
+
+    failed = sum(1 for error in index['errors'] if error)
+    print('%d captures (%d failed), %d packets, %d samples in %.3f s with %d workers'
+          % (len(files), failed, index['count'].sum(), index['samples'].sum(), elapsed,
+             args.jobs), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
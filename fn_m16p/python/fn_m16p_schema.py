@@ -0,0 +1,167 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Frame schemas of the DFPlayer family, compiled into the decoders' byte engine
+
+    Each module variant is described by data alone: the order of its frame's fields,
+    the byte values a field must have (any value, for a field not listed), the fields
+    that may be left out (with the End byte arriving in their place) and its packet_msg
+    table.  compile_schema() turns a schema into a FrameEngine: the (state, byte) ->
+    action transition table, the annotation payload for a byte in each state, and the
+    label table, so every variant runs through the same table-driven decode() loop.
+
+    The parameter and command bytes must stay at the offsets in fn_m16p_frame (CMD,
+    MSB, etc.), and any checksum bytes at CHK1/CHK2, as packets are read from there.
+
+    pd.Decoder (its "variant" option), fn_m16p_batch and the offline decoders built on
+    it (fn_m16p_session, _split, _cache and _pool, with --variant) and fn_m16p_monitor
+    all take a compiled engine, so a variant decodes the same way everywhere.
+
+    The variants below model only what the protocol notes and datasheets at hand
+    document: the DFPlayer Mini and MP3-TF-16P check the Ver and Len bytes (0xFF, 0x06)
+    that the FN-M16P decoder accepts whatever their values, the DFPlayer Mini always
+    sends checksum bytes, and its 0x08 command selects a playback mode.  Clone-specific
+    version bytes, lengths or further messages are not known here; a variant that has
+    them gets its own 'values' and 'messages' in its schema.
+'''
+
+from .fn_m16p_frame    import CMD, FEED, MSB, LSB, CHK1, CHK2, START_BYTE, END_BYTE,  \
+                              VERSION, LENGTH, PKT_MAX, IDLE, FIELD_CLASS, Channel,   \
+                              ACT_UNKNOWN, ACT_START, ACT_FIELD, ACT_END, ACT_FRAME_ERR
+from .fn_m16p_labels   import build_table, label_table
+from .fn_m16p_messages import field_label, packet_msg, packet_msg_yx5200
+
+    # field_label entry (and so annotation class) of each field a frame can have
+FIELDS = {'start': 1, 'ver': 2, 'len': 3, 'cmd': 4, 'feed': 5, 'msb': 6, 'lsb': 7,
+          'chk1': 8, 'chk2': 9, 'end': 10}
+
+    # Fields whose offset is fixed, as the rest of the decoder reads them from there
+OFFSETS = {'cmd': CMD, 'feed': FEED, 'msb': MSB, 'lsb': LSB, 'chk1': CHK1, 'chk2': CHK2}
+
+    # Annotation payloads of every field_label entry, [rxtx][entry], shared by all the
+    # engines (the decoders recognize some of them by identity)
+FIELD_PAYLOAD = tuple({entry: [FIELD_CLASS[entry] + rxtx, field_label[entry]]
+                       for entry in FIELD_CLASS} for rxtx in (0, 1))
+
+DFPLAYER_LAYOUT = ('start', 'ver', 'len', 'cmd', 'feed', 'msb', 'lsb', 'chk1', 'chk2', 'end')
+
+FN_M16P = {
+    'name':     'FN-M16P',
+    'layout':   DFPLAYER_LAYOUT,
+    'values':   {'start': (START_BYTE,), 'end': (END_BYTE,)},
+    'optional': ('chk1', 'chk2'),                # 8-byte packets, without checksum
+    'messages': packet_msg,
+}
+
+YX5200 = dict(FN_M16P,                           # DFPlayer Mini chip: strict Ver/Len,
+    name     = 'YX5200',                         # and always sends the checksum
+    values   = {'start': (START_BYTE,), 'ver': (VERSION,), 'len': (LENGTH,),
+                'end': (END_BYTE,)},
+    optional = (),
+    messages = packet_msg_yx5200,
+)
+
+MP3_TF_16P = dict(FN_M16P,                       # Strict Ver/Len, optional checksum
+    name     = 'MP3-TF-16P',
+    values   = YX5200['values'],
+)
+
+SCHEMAS = (FN_M16P, YX5200, MP3_TF_16P)
+
+
+class FrameEngine:
+    '''A frame schema, compiled: what decode() needs to run it'''
+    __slots__ = ('name', 'layout', 'rows', 'field_ann', 'labels')
+
+    def __init__(self, name, layout, rows, field_ann, labels):
+        self.name      = name
+        self.layout    = layout                  # Field names, in order
+        self.rows      = rows                    # Transition table: [state][byte] -> action
+        self.field_ann = field_ann               # [rxtx][state] -> annotation payload
+        self.labels    = labels                  # Label table (see fn_m16p_labels)
+
+    def channels(self):
+        '''Return new (RX, TX) Channels, running this engine'''
+        return tuple(Channel(self.rows, self.field_ann[rxtx]) for rxtx in (0, 1))
+
+
+def check_schema(schema):
+    '''Raise ValueError if a schema can't be compiled'''
+    layout   = schema['layout']
+    optional = schema.get('optional', ())
+    values   = schema.get('values', {})
+    unknown  = set(layout) - set(FIELDS)
+    if unknown:
+        raise ValueError('%s: unknown fields %s' % (schema['name'], sorted(unknown)))
+    if layout[0] != 'start' or layout[-1] != 'end' or len(layout) > PKT_MAX:
+        raise ValueError('%s: a frame is Start ... End, of up to %d bytes'
+                         % (schema['name'], PKT_MAX))
+    if not values.get('start') or not values.get('end'):
+        raise ValueError('%s: the Start and End byte values are needed' % schema['name'])
+    for name, offset in OFFSETS.items():
+        if name in layout and layout.index(name) != offset:
+            raise ValueError('%s: field %r must be byte %d' % (schema['name'], name, offset))
+    if tuple(layout[len(layout) - 1 - len(optional):-1]) != tuple(optional):
+        raise ValueError('%s: only the fields just before End can be optional'
+                         % schema['name'])
+
+
+def compile_schema(schema, tables=None):
+    '''Compile a schema into a FrameEngine.  tables memoizes the label tables built from
+       packet_msg-style tables (keyed by id()), so variants can share them.'''
+    check_schema(schema)
+    layout   = tuple(schema['layout'])
+    values   = schema.get('values', {})
+    optional = schema.get('optional', ())
+    rows     = []
+    for state, name in enumerate(layout):        # state = # of packet bytes so far
+        allowed = values.get(name)
+        if state == IDLE:
+            row = bytearray([ACT_UNKNOWN]) * 256
+            hit = ACT_START
+        elif state == len(layout) - 1:
+            row = bytearray([ACT_FRAME_ERR]) * 256
+            hit = ACT_END
+        else:
+            row = bytearray([ACT_FIELD if allowed is None else ACT_FRAME_ERR]) * 256
+            hit = ACT_FIELD
+        for value in allowed or ():
+            row[value] = hit
+        if optional and name == optional[0]:     # The End byte may arrive instead
+            for value in values['end']:
+                row[value] = ACT_END
+        rows.append(bytes(row))
+
+    tables   = tables if tables is not None else {id(packet_msg): label_table}
+    messages = schema.get('messages', packet_msg)
+    if id(messages) not in tables:
+        tables[id(messages)] = build_table(messages)
+    field_ann = tuple(tuple(FIELD_PAYLOAD[rxtx][FIELDS[name]] for name in layout)
+                      for rxtx in (0, 1))
+    return FrameEngine(schema['name'], layout, tuple(rows), field_ann,
+                       tables[id(messages)])
+
+
+def compile_all(schemas=SCHEMAS):
+    '''Compile schemas; return {name: FrameEngine}'''
+    tables = {id(packet_msg): label_table}
+    return {schema['name']: compile_schema(schema, tables) for schema in schemas}
+
+ENGINES = compile_all()                          # Compiled once, at load time
+DEFAULT = ENGINES[FN_M16P['name']]
@@ -0,0 +1,302 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Offline decoding of sigrok session (.sr) files, without PulseView or sigrok-cli
+
+    The logic-1-* chunks of the session are read a block at a time (memory-mapped when
+    stored uncompressed), run through the vectorized UART receiver and then the batch
+    FN_M16P decoder, so memory use doesn't grow with the length of the capture.
+    Needs NumPy.  From the directory holding this decoder:
+
+        python -m fn_m16p.fn_m16p_session --rx D5 --tx D6 capture.sr
+
+    With -j N, segments of the capture are decoded by N worker processes instead (see
+    fn_m16p_split), with the same results.  With --cache DIR, each chunk's results are
+    kept on disk, and only the chunks that have changed are decoded next time (see
+    fn_m16p_cache).  --variant picks the module variant's frame format (see
+    fn_m16p_schema), as pd.Decoder's "variant" option does.
+'''
+
+import argparse
+import configparser
+import mmap
+import re
+import struct
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+from .fn_m16p_batch    import BatchDecoder
+from .fn_m16p_labels   import LabelCache
+from .fn_m16p_schema   import ENGINES, DEFAULT
+from .fn_m16p_transact import TransactionTracker, format_latency
+from .fn_m16p_uart     import UartReceiver
+
+BLOCK_SIZE = 1 << 20                             # Samples per block
+
+UNITS = {'': 1, 'k': 1000, 'm': 1000000, 'g': 1000000000}
+
+
+def parse_samplerate(text):
+    '''Convert a metadata samplerate such as "50 kHz" or "1 MHz" to a number (in Hz)'''
+    match = re.match(r'\s*([0-9.]+)\s*([kKmMgG]?)(?:Hz)?\s*$', text)
+    if not match:
+        raise ValueError('Unrecognized samplerate: %r' % text)
+    return int(round(float(match.group(1)) * UNITS[match.group(2).lower()]))
+
+
+class SessionReader:
+    '''Reads the logic data of a sigrok session file, a block of samples at a time'''
+
+    def __init__(self, path):
+        self.path    = path
+        self.zipfile = zipfile.ZipFile(path)
+        meta = configparser.ConfigParser(interpolation=None)
+        meta.read_string(self.zipfile.read('metadata').decode())
+        device = meta['device 1']
+
+        self.samplerate = parse_samplerate(device['samplerate'])
+        self.unitsize   = int(device.get('unitsize', '1'))
+        self.channels   = {}                     # Channel name -> bit number in a sample
+        for key, name in device.items():
+            if key.startswith('probe'):
+                self.channels[name] = int(key[len('probe'):]) - 1
+
+            # Chunks are named <capturefile>-1, -2, ... (or just <capturefile>)
+        prefix = device.get('capturefile', 'logic-1')
+        chunks = [info for info in self.zipfile.infolist()
+                  if info.filename == prefix
+                  or re.fullmatch(re.escape(prefix) + r'-\d+', info.filename)]
+        self.chunks = sorted(chunks, key=lambda info: int(info.filename.split('-')[-1])
+                             if info.filename != prefix else 0)
+        self.samples = sum(info.file_size for info in self.chunks) // self.unitsize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''Close the session file'''
+        self.zipfile.close()
+
+    def channel_bit(self, channel):
+        '''Return the bit number of a channel, given its name (e.g. "D5") or number'''
+        if channel in self.channels:
+            return self.channels[channel]
+        if str(channel).isdigit():
+            return int(channel)
+        raise KeyError('No channel named %r in %s' % (channel, self.path))
+
+    def blocks(self, block_size=BLOCK_SIZE, first=0, last=None):
+        '''Yield (first sample number, samples) for each block of samples [first, last)
+           (by default, all of them), where samples is an (N, unitsize) array of uint8'''
+        last = self.samples if last is None else min(last, self.samples)
+        base = 0
+        with open(self.path, 'rb') as raw:
+            mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for info in self.chunks:
+                    size = info.file_size // self.unitsize
+                    if base + size <= first:     # Wholly before the range: skip it
+                        base += size
+                        continue
+                    if base >= last:
+                        break
+                    skip  = max(first - base, 0)
+                    base += skip
+                    for block in self.chunk_blocks(info, mapped, block_size, skip):
+                        if base + len(block) > last:
+                            block = block[:last - base]
+                        yield base, block
+                        base += len(block)
+                        del block                # Release mmap view before the next one
+                        if base >= last:
+                            break
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:              # Caller still holds a view; let the
+                    pass                         # garbage collector close it instead
+
+    def chunk_blocks(self, info, mapped, block_size, skip=0):
+        '''Yield the blocks of one chunk, after its first "skip" samples: views into the
+           mapped file when the chunk is stored uncompressed, otherwise decompressed a
+           block at a time'''
+        step = block_size * self.unitsize
+        if info.compress_type == zipfile.ZIP_STORED:
+            name_len, extra_len = struct.unpack('<HH', mapped[info.header_offset + 26:
+                                                              info.header_offset + 30])
+            offset = info.header_offset + 30 + name_len + extra_len
+            for pos in range(skip * self.unitsize, info.file_size, step):
+                size = min(step, info.file_size - pos)
+                yield np.frombuffer(mapped, dtype=np.uint8, count=size,
+                                    offset=offset + pos).reshape(-1, self.unitsize)
+        else:
+            with self.zipfile.open(info) as chunk:
+                skip *= self.unitsize            # (Has to be decompressed all the same)
+                while skip:
+                    skip -= len(chunk.read(min(step, skip)))
+                while True:
+                    data = chunk.read(step)
+                    if not data:
+                        break
+                    yield np.frombuffer(data, dtype=np.uint8).reshape(-1, self.unitsize)
+
+
+class LineReceivers:
+    '''UART receivers for the module's RX and TX lines (rx/tx name their channels)'''
+    __slots__ = ('lines',)
+
+    def __init__(self, reader, rx, tx, baudrate=9600):
+        self.lines = []                          # (byte, bit, receiver), RX then TX
+        for channel in (rx, tx):
+            bit = reader.channel_bit(channel)
+            self.lines.append((bit // 8, bit % 8, UartReceiver(reader.samplerate, baudrate)))
+
+    def feed(self, base, block):
+        '''Return (ss, es, data, rxtx) arrays of the bytes received from a block of
+           samples.  The bytes of both lines are in time order, RX first when they finish
+           together (the uart PD's order).'''
+        parts = []
+        for rxtx, (byte, bit, receiver) in enumerate(self.lines):
+            ss, es, data = receiver.feed((block[:, byte] >> bit) & 1, base)
+            parts.append((ss, es, data, np.full(len(data), rxtx, dtype=np.uint8)))
+        ss, es, data, rxtx = (np.concatenate(col) for col in zip(*parts))
+        order = np.argsort(es, kind='stable')
+        return ss[order], es[order], data[order], rxtx[order]
+
+
+def receive_bytes(reader, rx, tx, baudrate=9600, block_size=BLOCK_SIZE, first=0,
+                  last=None):
+    '''Yield LineReceivers.feed()'s arrays for each block of samples [first, last) of
+       the session'''
+    receivers = LineReceivers(reader, rx, tx, baudrate)
+    for base, block in reader.blocks(block_size, first, last):
+        yield receivers.feed(base, block)
+        del block
+
+
+def decode_session(reader, rx, tx, baudrate=9600, block_size=BLOCK_SIZE,
+                   engine=DEFAULT):
+    '''Yield a BatchResult (see fn_m16p_batch) for each block of the session's samples,
+       with rx/tx naming the channels wired to the module's RX and TX lines, and engine
+       the module variant's compiled frame schema (see fn_m16p_schema)'''
+    decoder = BatchDecoder(engine)
+    for arrays in receive_bytes(reader, rx, tx, baudrate, block_size):
+        yield decoder.feed(*arrays)
+    yield decoder.flush()
+
+
+def main(argv=None):
+    '''Command-line entry point: print the packets found in a session file'''
+    parser = argparse.ArgumentParser(description='Decode FN-M16P packets from a sigrok '
+                                                 'session (.sr) file.')
+    parser.add_argument('session', help='sigrok session file')
+    parser.add_argument('--rx', required=True, help='channel on the module\'s RX line')
+    parser.add_argument('--tx', required=True, help='channel on the module\'s TX line')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--variant', default=DEFAULT.name, choices=sorted(ENGINES),
+                        help='module variant (default: %(default)s)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help='samples per block (default: %(default)s)')
+    parser.add_argument('--transactions', action='store_true',
+                        help='pair requests with replies, and summarize response times')
+    parser.add_argument('--timeout', type=float, default=1000.0,
+                        help='reply timeout in ms (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes decoding segments of the capture in '
+                             'parallel (default: %(default)s; 0 = one per core)')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='keep decoded chunks in (and reuse them from) this directory')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='cache size cap in MB (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    engine  = ENGINES[args.variant]
+    labels  = LabelCache(table=engine.labels)
+    packets = 0
+    tracker = None
+    cache   = None
+    started = time.perf_counter()
+    with SessionReader(args.session) as reader:
+        rate = reader.samplerate
+        if args.transactions:
+            tracker = TransactionTracker(int(args.timeout * rate / 1000))
+        if args.cache:                           # (Imported here: it imports this module)
+            from .fn_m16p_cache import DecodeCache, decode_cached
+            cache   = DecodeCache(args.cache, args.cache_size << 20)
+            results = decode_cached(reader, args.rx, args.tx, args.baudrate,
+                                    args.block_size, cache, engine)
+        elif args.jobs == 1:
+            results = decode_session(reader, args.rx, args.tx, args.baudrate,
+                                     args.block_size, engine)
+        else:                                    # (Imported here: it imports this module)
+            from .fn_m16p_split import decode_parallel
+            results = decode_parallel(args.session, args.rx, args.tx, args.baudrate,
+                                      args.block_size, args.jobs or None, engine=engine)
+        for result in results:
+            for ss, es, rxtx, label in result.packets(labels):
+                print('%d-%d %s %s' % (ss, es, ('RX', 'TX')[rxtx], label[0]))
+            if tracker is not None:
+                print_transactions(tracker, result, rate)
+            packets += len(result)
+        samples = reader.samples
+    elapsed = time.perf_counter() - started
+
+    if tracker is not None:
+        print_latencies(tracker, rate)
+    print('%d samples, %d packets in %.3f s (%.0f samples/s)'
+          % (samples, packets, elapsed, samples / elapsed if elapsed else 0.0),
+          file=sys.stderr)
+    if cache is not None:
+        print('Cache: %(hits)d hits, %(misses)d misses, %(evictions)d evicted '
+              '(%(entries)d entries, %(bytes)d bytes)' % cache.stats(), file=sys.stderr)
+
+
+def print_transactions(tracker, result, rate):
+    '''Feed a BatchResult's packets to a TransactionTracker; print the events'''
+    for ss, es, rxtx, cmd, feed in zip(result.ss.tolist(), result.es.tolist(),
+                                       result.rxtx.tolist(), result.cmd.tolist(),
+                                       result.feed.tolist()):
+        for event in tracker.packet(ss, es, rxtx, cmd, feed):
+            kind, cmd, req_ss, req_es, ans_ss, ans_es, latency = event
+            print('%d-%d %s 0x%02X %s' % (ans_ss if req_ss is None else req_ss,
+                                          req_es if ans_es is None else ans_es,
+                                          kind, cmd, format_latency(latency, rate)))
+
+
+def print_latencies(tracker, rate):
+    '''Print the response time statistics of each command'''
+    summary = tracker.summary()
+    print('Response times (cmd: count min p50 p90 p99 max):')
+    for cmd, stats in summary.items():
+        if cmd == 'events':
+            continue
+        print('  0x%02X: %5d %s' % (cmd, stats['count'],
+                                    ' '.join(format_latency(stats[key], rate) for key in
+                                             ('min', 'p50', 'p90', 'p99', 'max'))))
+    print('Events: ' + ', '.join('%s %d' % item for item in summary['events'].items()))
+
+
+if __name__ == '__main__':
+    main()
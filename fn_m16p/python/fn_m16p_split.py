@@ -0,0 +1,154 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Parallel decoding of one long sigrok session (.sr) file, split into segments
+
+    The capture is cut at points where both lines have been idle for longer than a UART
+    frame, so no byte straddles a cut and a fresh UartReceiver starting there receives
+    exactly what the serial one would.  Each segment is received and decoded (starting
+    IDLE, like fn_m16p_batch.BatchDecoder) by a worker process.  The results are then
+    stitched together in order: a segment's result is used as is when the one before it
+    ended with both directions IDLE; otherwise the packet (or corrupt frame) left
+    unfinished is carried over and that segment's bytes are decoded again after it.
+    The BatchResults, and so the packets and annotations, come out in the same order
+    and with the same contents as from fn_m16p_session.decode_session():
+
+        python -m fn_m16p.fn_m16p_session --rx D5 --tx D6 -j 8 capture.sr
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from .fn_m16p_batch   import BatchDecoder, decode_block
+from .fn_m16p_schema  import ENGINES, DEFAULT
+from .fn_m16p_session import SessionReader, receive_bytes, BLOCK_SIZE
+from .fn_m16p_uart    import UartReceiver
+
+SEGMENTS_PER_JOB = 4                             # For load balancing
+MIN_SEGMENT      = 8                             # Blocks per segment, at least
+
+
+def find_idle(reader, bits, start, stop, idle, block_size=BLOCK_SIZE):
+    '''Return the first sample number in [start, stop) before which every line (bit
+       numbers) has been high for "idle" samples, or None if there isn't one'''
+    last_low = start - idle - 1                  # (As if low just before the search)
+    for base, block in reader.blocks(block_size, max(start - idle, 0), stop):
+        high = np.ones(len(block), dtype=bool)
+        for bit in bits:
+            high &= ((block[:, bit // 8] >> (bit % 8)) & 1).astype(bool)
+        lows = np.flatnonzero(~high) + base
+        del block
+            # Between each low sample and the next, the lines are high: the first gap
+            # that is long enough gives the answer
+        prev  = np.append(last_low, lows)
+        after = np.append(lows, base + len(high))
+        cut   = np.maximum(prev + 1 + idle, start)
+        found = np.flatnonzero((cut <= after) & (cut < stop))
+        if len(found):
+            return int(cut[found[0]])
+        if len(lows):
+            last_low = int(lows[-1])
+    return None
+
+
+def plan_segments(reader, rx, tx, baudrate, jobs, block_size=BLOCK_SIZE):
+    '''Return the (first, last) sample ranges of the segments to decode in parallel'''
+    samples  = reader.samples
+    count    = max(min(jobs * SEGMENTS_PER_JOB, samples // (block_size * MIN_SEGMENT)), 1)
+    bits     = [reader.channel_bit(channel) for channel in (rx, tx)]
+        # Idle for longer than a frame takes (up to the stop bit's sample point), so
+        # every frame before the cut is over and done with
+    idle     = int(UartReceiver(reader.samplerate, baudrate).points[-1]) + 2
+    cuts     = [0]
+    for num in range(1, count):
+        target = samples * num // count
+        if target <= cuts[-1]:
+            continue
+        cut = find_idle(reader, bits, target, samples * (num + 1) // count, idle,
+                        block_size)
+        if cut is not None and cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(samples)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def decode_segment(path, rx, tx, baudrate, block_size, variant, first, last):
+    '''Receive and decode samples [first, last) of a capture (in a worker process), for
+       a module variant (named, as in fn_m16p_schema.ENGINES).  Returns (BatchResult,
+       byte arrays, pending mask): the result excludes the bytes of frames left
+       unfinished at the end, which the mask marks.'''
+    with SessionReader(path) as reader:
+        parts = list(receive_bytes(reader, rx, tx, baudrate, block_size, first, last))
+    if parts:
+        arrays = tuple(np.concatenate(column) for column in zip(*parts))
+    else:
+        arrays = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                  np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8))
+    result, pending = decode_block(*arrays, final=False, engine=ENGINES[variant])
+    return result, arrays, pending
+
+
+def stitch(segments, engine=DEFAULT):
+    '''Yield the BatchResults of a capture, given decode_segment()'s results for each
+       of its segments, in order'''
+    decoder = BatchDecoder(engine)
+    for result, arrays, pending in segments:
+        if decoder.carry is None or not len(decoder.carry[0]):
+            decoder.carry = tuple(column[pending] for column in arrays)
+            yield result                         # Started IDLE, as it should have
+        else:                                    # A frame was unfinished at the cut:
+            yield decoder.feed(*arrays)          #  decode again, following on from it
+    yield decoder.flush()
+
+
+def decode_parallel(path, rx, tx, baudrate=9600, block_size=BLOCK_SIZE, jobs=None,
+                    queue=None, engine=DEFAULT):
+    '''Yield the BatchResults of a capture, decoded by "jobs" worker processes (keeping
+       at most "queue" segments queued or in progress), with engine the module
+       variant's compiled frame schema'''
+    jobs  = max(jobs or os.cpu_count() or 1, 1)
+    queue = max(queue or 2 * jobs, 1)
+    with SessionReader(path) as reader:
+        ranges = plan_segments(reader, rx, tx, baudrate, jobs, block_size)
+    args = (path, rx, tx, baudrate, block_size, engine.name)
+    if jobs == 1:                                # No pool: easier to debug or profile
+        yield from stitch((decode_segment(*args, *span) for span in ranges), engine)
+        return
+
+    def in_order(pool):
+        '''Yield the segments' results in order, as they finish'''
+        queued   = {}                            # Future -> segment number
+        finished = {}                            # Segment number -> result
+        spans    = iter(enumerate(ranges))
+        for num in range(len(ranges)):
+            while len(queued) < queue:           # Bounded: keep the queue topped up
+                span = next(spans, None)
+                if span is None:
+                    break
+                queued[pool.submit(decode_segment, *args, *span[1])] = span[0]
+            while num not in finished:
+                done, _ = wait(queued, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[queued.pop(future)] = future.result()
+            yield finished.pop(num)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from stitch(in_order(pool), engine)
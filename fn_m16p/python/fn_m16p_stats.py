@@ -0,0 +1,152 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Opt-in instrumentation of a pd.Decoder instance (its "stats" option)
+
+    instrument() replaces the decoder's hot methods, and put(), with counting/timing
+    wrappers set on the instance itself, so a decoder without stats runs exactly the
+    same code as before.  Timings are cumulative: a method's time includes that of the
+    methods (and put() calls) it makes.  put() is counted before any coalescing (see
+    fn_m16p_coalesce).  Unexpected and frame error bytes are counted by the decoder
+    itself (see byte_error()), whatever its "detail" and "resync" options.
+'''
+
+import json
+import sys
+import time
+
+    # Decoder methods worth timing (those that don't exist in a decoder are skipped).
+    # "decode" is whichever byte handler start() chose (e.g. decode_held).
+METHODS = ('decode', 'frame_event', 'resync', 'put_fields', 'gen_packet_label',
+           'gen_packet_outputs', 'gen_transactions', 'put')
+
+DIRECTIONS = ('rx', 'tx')
+
+
+class DecoderStats:
+    '''Call counts and timings, byte counts and put() counts for one decoder'''
+    __slots__ = ('decoder', 'calls', 'seconds', 'ann_puts', 'other_puts', 'bytes',
+                 'started', 'dumped')
+
+    def __init__(self):
+        self.decoder    = None
+        self.calls      = {}                     # Method name -> calls
+        self.seconds    = {}                     # Method name -> cumulative time
+        self.ann_puts   = []                     # Annotation class -> put() calls
+        self.other_puts = {}                     # Output id -> put() calls (not OUTPUT_ANN)
+        self.bytes      = {'unexpected': [0, 0], 'frame_error': [0, 0]}  # Per direction
+                                                 # (See byte_error())
+        self.started    = None
+        self.dumped     = False
+
+    def instrument(self, decoder):
+        '''Start collecting statistics for decoder'''
+        self.decoder  = decoder
+        self.ann_puts = [0] * len(decoder.annotations)
+        self.started  = time.perf_counter()
+
+        put        = decoder.put
+        out_ann    = decoder.out_ann
+        ann_puts   = self.ann_puts
+        other_puts = self.other_puts
+
+        def counted_put(start_smpl, end_smpl, output_id, data):
+            if output_id == out_ann:
+                ann_puts[data[0]] += 1
+            else:
+                other_puts[output_id] = other_puts.get(output_id, 0) + 1
+            put(start_smpl, end_smpl, output_id, data)
+        decoder.put = counted_put
+
+        for name in METHODS:
+            method = getattr(decoder, name, None)
+            if method is not None:
+                setattr(decoder, name, self.timed(name, method))
+
+    def byte_error(self, name, rxtx):
+        '''Count a byte received outside any packet (name "unexpected"), or a byte that
+           broke a frame ("frame_error": one per bad frame, as the frame's other bytes
+           are fields, or rescanned with the "resync" option)'''
+        self.bytes[name][rxtx] += 1
+
+    def timed(self, name, method):
+        '''Return a wrapper that counts and times calls of method'''
+        calls, seconds = self.calls, self.seconds
+        calls[name]   = 0
+        seconds[name] = 0.0
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            started = clock()
+            try:
+                return method(*args)
+            finally:
+                seconds[name] += clock() - started
+                calls[name] += 1
+        return wrapper
+
+    def snapshot(self):
+        '''Return the statistics so far, as a JSON-ready dict:
+             elapsed      Seconds since instrument()
+             methods      Per method: calls, seconds and us_per_call
+             bytes        Per direction ("rx", "tx"): "unexpected" and "frame_error"
+                          byte counts (see byte_error())
+             puts         put() calls: total, per annotation id and per other output
+             label_cache  Packet label cache hits, misses, size and hit_rate
+             coalesce     Coalescer counts, with the "coalesce" option'''
+        decoder = self.decoder
+        methods = {name: {'calls':       count,
+                          'seconds':     self.seconds[name],
+                          'us_per_call': self.seconds[name] / count * 1e6 if count else 0.0}
+                   for name, count in self.calls.items()}
+        ann_ids = [ann[0] for ann in decoder.annotations]
+        result  = {
+            'elapsed': time.perf_counter() - self.started,
+            'methods': methods,
+            'bytes':   {direction: {name: counts[rxtx]
+                                    for name, counts in self.bytes.items()}
+                        for rxtx, direction in enumerate(DIRECTIONS)},
+            'puts':    {'total':       sum(self.ann_puts) + sum(self.other_puts.values()),
+                        'annotations': {ann_ids[cls]: count
+                                        for cls, count in enumerate(self.ann_puts) if count},
+                        'outputs':     {str(output): count
+                                        for output, count in self.other_puts.items()}},
+        }
+        cache = getattr(decoder, 'label_cache', None)
+        if cache is not None:
+            lookups = cache.hits + cache.misses
+            result['label_cache'] = {'hits': cache.hits, 'misses': cache.misses,
+                                     'size': len(cache.labels),
+                                     'hit_rate': cache.hits / lookups if lookups else 0.0}
+        coalescer = getattr(decoder, 'coalescer', None)
+        if coalescer is not None:                # (Its "before" matches puts' annotations)
+            result['coalesce'] = coalescer.counts()
+        return result
+
+    def dump(self, path=''):
+        '''Write the snapshot as JSON to path (or stderr), once'''
+        if self.dumped:
+            return
+        self.dumped = True
+        text = json.dumps(self.snapshot(), indent=2)
+        if path:
+            with open(path, 'w') as out:
+                out.write(text + '\n')
+        else:
+            print(text, file=sys.stderr)
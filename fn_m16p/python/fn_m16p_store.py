@@ -0,0 +1,312 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Compact, queryable storage for the annotations of long captures (needs NumPy)
+
+    Each annotation is one 19-byte row (start/end sample, class, label id) rather than a
+    handful of Python objects; label string lists are interned in a LabelTable, which
+    also remembers the command code of each packet label.  Rows live in a NumPy array
+    that moves to a memory-mapped temporary file once it outgrows spill_bytes.
+
+    Queries use sorted indexes (built when first needed after rows are added), so they
+    cost a few binary searches rather than a scan:
+
+        store = AnnotationStore()
+        decoder.put = store.put                  # Collect a Decoder's output (offline)
+        ...
+        for ss, es, cls, strings in store.records(store.packets(x, y)): ...
+        errors = store.with_cmd(0x40)            # Row numbers of all 0x40 packets
+'''
+
+import tempfile
+from collections import deque
+
+import numpy as np
+
+from .fn_m16p_messages import field_label, packet_msg
+from .fn_m16p_labels   import LabelCache, label_table, StaticLabel, IndexedLabel
+from .fn_m16p_frame    import PACKET_CLASS
+
+ROW = np.dtype([('ss', '<i8'), ('es', '<i8'), ('cls', 'u1'), ('label', '<u2')])
+
+NO_CMD         = -1                              # Label isn't a packet label
+PACKET_CLASSES = (PACKET_CLASS, PACKET_CLASS + 1)
+BUFFER_ROWS    = 4096                            # Rows held back before copying
+SPILL_BYTES    = 64 << 20                        # Array size that moves it to a file
+MAX_LABELS     = 1 << 16                         # Label ids are uint16
+MAX_WAITING    = 1024                            # Packet cmds kept for labels held back
+
+
+class LabelTable:
+    '''Interned label string lists, each with a uint16 id (and, for packet labels, the
+       command code it labels).  Starts with every field_label entry and every
+       packet_msg label that doesn't depend on the parameter bytes.'''
+    __slots__ = ('labels', 'cmds', 'ids', 'by_object')
+
+    def __init__(self):
+        self.labels    = []                      # Label id -> string list
+        self.cmds      = []                      # Label id -> cmd (or NO_CMD)
+        self.ids       = {}                      # (tuple of strings, cmd) -> label id
+        self.by_object = {}                      # id(string list) -> (list, cmd, label id)
+        for num in sorted(field_label):
+            self.intern(field_label[num])
+        for (cmd, rxtx), _ in sorted(packet_msg.items()):
+            if cmd == 0xFF:                      # "Unknown": labels many different cmds
+                continue
+            entry = label_table[(cmd << 1) | rxtx]
+            if isinstance(entry, StaticLabel):
+                self.intern(entry.strings, cmd)
+            elif isinstance(entry, IndexedLabel):
+                for choice in entry.choices:
+                    self.intern(choice, cmd)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def intern(self, strings, cmd=NO_CMD):
+        '''Return the id of a label string list (adding it if new)'''
+        seen = self.by_object.get(id(strings))   # Quick check: the very same list object
+        if seen is not None and seen[1] == cmd:  # (labels are mostly shared lists)
+            return seen[2]
+        key = (tuple(strings), cmd)
+        label_id = self.ids.get(key)
+        if label_id is None:
+            if len(self.labels) >= MAX_LABELS:
+                raise OverflowError('More than %d different labels' % MAX_LABELS)
+            label_id = self.ids[key] = len(self.labels)
+            self.labels.append(list(strings))
+            self.cmds.append(cmd)
+        if len(self.by_object) >= MAX_LABELS:    # (Lists from a LabelCache that has been
+            self.by_object.clear()               #  cleared may never be seen again)
+        self.by_object[id(strings)] = (strings, cmd, label_id)   # (Holding the list keeps
+        return label_id                                           #  its id() from reuse)
+
+    def with_cmd(self, cmd):
+        '''Return the ids of all packet labels for a command, as an array'''
+        return np.flatnonzero(np.array(self.cmds, dtype=np.int16) == cmd)
+
+
+class AnnotationStore:
+    '''Annotations as rows of typed columns, with range and command queries'''
+    __slots__ = ('table', 'rows', 'count', 'pending', 'packet', 'cmds', 'spill_bytes',
+                 'directory', 'spill_file', 'index', 'ann_id', 'python_id')
+
+    def __init__(self, spill_bytes=SPILL_BYTES, directory=None, table=None,
+                 ann_id=0, python_id=1):
+        self.table       = table if table is not None else LabelTable()
+        self.rows        = np.zeros(BUFFER_ROWS, dtype=ROW)
+        self.count       = 0                     # Rows in use
+        self.pending     = []                    # Rows not yet copied into the array
+        self.packet      = None                  # Packet row waiting for its cmd
+        self.cmds        = deque(maxlen=MAX_WAITING)   # (ss, es, cmd) of packets whose
+                                                       # label comes later (coalescing)
+        self.spill_bytes = spill_bytes
+        self.directory   = directory             # Where to put the spill file
+        self.spill_file  = None
+        self.index       = None                  # Sorted indexes, once built
+        self.ann_id      = ann_id                # Output ids, as returned by register()
+        self.python_id   = python_id             # for OUTPUT_ANN and OUTPUT_PYTHON
+
+    def __len__(self):
+        self.flush()
+        return self.count
+
+    def put(self, start_smpl, end_smpl, output_id, data):
+        '''Record a Decoder put(): annotations are stored, and a packet's OUTPUT_PYTHON
+           record supplies the packet label's cmd.  The record normally follows the
+           label, but comes first when the label was held back by coalescing (see
+           fn_m16p_coalesce), so the two are paired by the packet's start/end sample.'''
+        if output_id == self.ann_id:
+            if self.packet is not None:
+                self.add(*self.packet)
+                self.packet = None
+            cls, strings = data
+            if cls not in PACKET_CLASSES:
+                self.add(start_smpl, end_smpl, cls, strings)
+                return
+            cmd = self.cmd_of(start_smpl, end_smpl) if self.cmds else None
+            if cmd is None:                      # Its record is still to come
+                self.packet = (start_smpl, end_smpl, cls, strings)
+            else:
+                self.add(start_smpl, end_smpl, cls, strings, cmd)
+        elif output_id == self.python_id:        # ('PACKET', rxtx, cmd, ...)
+            packet = self.packet
+            if packet is not None and packet[0] == start_smpl and packet[1] == end_smpl:
+                self.add(*packet, cmd=data[2])
+                self.packet = None
+            else:                                # Label held back (or coalesced away)
+                self.cmds.append((start_smpl, end_smpl, data[2]))
+
+    def cmd_of(self, start_smpl, end_smpl):
+        '''Return the cmd of the packet from start_smpl to end_smpl, from the records
+           put() ahead of their labels (or None).  Labels come in packet order, so the
+           records before it are of packets whose labels were coalesced away.'''
+        cmds = self.cmds
+        while cmds:
+            ss, es, cmd = cmds.popleft()
+            if ss == start_smpl and es == end_smpl:
+                return cmd
+        return None
+
+    def add(self, start_smpl, end_smpl, cls, strings, cmd=NO_CMD):
+        '''Add one annotation'''
+        self.pending.append((start_smpl, end_smpl, cls, self.table.intern(strings, cmd)))
+        if len(self.pending) >= BUFFER_ROWS:
+            self.store_pending()
+
+    def add_batch(self, result, cache=None):
+        '''Add all the annotations of a fn_m16p_batch.BatchResult, in the order that
+           pd.Decoder would put() them'''
+        self.flush()
+        cache     = cache if cache is not None else LabelCache()
+        field_ids = np.array([self.table.intern(field_label[num]) if num in field_label
+                              else 0 for num in range(max(field_label) + 1)],
+                             dtype=np.uint16)
+        packet_ids = np.array([self.table.intern(label, cmd) for (_, _, _, label), cmd
+                               in zip(result.packets(cache), result.cmd.tolist())],
+                              dtype=np.uint16)
+        nbytes, npkts = len(result.byte_field), len(result)
+        rows = np.zeros(nbytes + npkts, dtype=ROW)
+            # Each packet row goes straight after its End byte's row
+        byte_pos = np.arange(nbytes) + np.searchsorted(result.last_byte, np.arange(nbytes))
+        pkt_pos  = result.last_byte + np.arange(npkts) + 1
+        for pos, columns in ((byte_pos, (result.start_smpl, result.end_smpl,
+                                         result.byte_class, field_ids[result.byte_field])),
+                             (pkt_pos,  (result.ss, result.es,
+                                         PACKET_CLASS + result.rxtx, packet_ids))):
+            for name, column in zip(ROW.names, columns):
+                rows[name][pos] = column
+        self.append(rows)
+
+    def flush(self):
+        '''Store everything added so far (including a packet still waiting for its cmd,
+           which then won't get one)'''
+        if self.packet is not None:
+            self.add(*self.packet)
+            self.packet = None
+        self.store_pending()
+
+    def store_pending(self):
+        '''Copy pending rows into the array'''
+        if self.pending:
+            rows, self.pending = np.array(self.pending, dtype=ROW), []
+            self.append(rows)
+
+    def append(self, rows):
+        '''Append an array of rows'''
+        need = self.count + len(rows)
+        if need > len(self.rows):
+            self.grow(need)
+        self.rows[self.count:need] = rows
+        self.count = need
+        self.index = None
+
+    def grow(self, need):
+        '''Make room for at least "need" rows, moving to the spill file if too big'''
+        capacity = max(need, 2 * len(self.rows))
+        if self.spill_file is None and capacity * ROW.itemsize <= self.spill_bytes:
+            rows = np.zeros(capacity, dtype=ROW)
+            rows[:self.count] = self.rows[:self.count]
+            self.rows = rows
+            return
+        if self.spill_file is None:              # First spill: copy the rows over
+            self.spill_file = tempfile.TemporaryFile(dir=self.directory)
+            rows = np.memmap(self.spill_file, dtype=ROW, mode='w+', shape=(capacity,))
+            rows[:self.count] = self.rows[:self.count]
+        else:                                    # Already in the file: just extend it
+            self.rows.flush()
+            rows = np.memmap(self.spill_file, dtype=ROW, mode='r+', shape=(capacity,))
+        self.rows = rows
+
+    def close(self):
+        '''Release the spill file (the store can't be used afterwards)'''
+        self.rows = np.zeros(0, dtype=ROW)
+        self.count = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    @property
+    def spilled(self):
+        '''Have the rows moved to a memory-mapped file?'''
+        return self.spill_file is not None
+
+    def arrays(self):
+        '''Return the rows in use (a view, in the order they were added)'''
+        self.flush()
+        return self.rows[:self.count]
+
+    def build_index(self):
+        '''Return (order by start sample, order by class then start sample, order by
+           label then start sample), with each order's sorted keys'''
+        if self.index is None:
+            rows  = self.arrays()
+            ss    = rows['ss']
+            by_ss = np.argsort(ss, kind='stable')
+            by_cls   = np.lexsort((ss, rows['cls']))
+            by_label = np.lexsort((ss, rows['label']))
+            self.index = {'ss':    (by_ss,    ss[by_ss]),
+                          'cls':   (by_cls,   rows['cls'][by_cls],     ss[by_cls]),
+                          'label': (by_label, rows['label'][by_label], ss[by_label])}
+        return self.index
+
+    def range(self, start_smpl, end_smpl, classes=None):
+        '''Return the row numbers of annotations starting at or after start_smpl and
+           before end_smpl (of the given classes, if any), in start sample order'''
+        index = self.build_index()
+        if classes is None:
+            order, keys = index['ss']
+            return order[np.searchsorted(keys, start_smpl):np.searchsorted(keys, end_smpl)]
+        return self.lookup(index['cls'], classes, start_smpl, end_smpl)
+
+    def packets(self, start_smpl, end_smpl):
+        '''Return the row numbers of the packets starting from start_smpl to end_smpl'''
+        return self.range(start_smpl, end_smpl, PACKET_CLASSES)
+
+    def with_cmd(self, cmd, start_smpl=None, end_smpl=None):
+        '''Return the row numbers of the packets with a given command code (e.g. 0x40
+           for errors reported by the module), in start sample order'''
+        return self.lookup(self.build_index()['label'], self.table.with_cmd(cmd).tolist(),
+                           start_smpl, end_smpl)
+
+    def lookup(self, index, values, start_smpl=None, end_smpl=None):
+        '''Find the rows having any of the values in an (order, sorted values, start
+           samples) index, limited to a sample range; return them in start sample order'''
+        order, keys, ss = index
+        found = []
+        for value in values:
+            first = np.searchsorted(keys, value, 'left')
+            last  = np.searchsorted(keys, value, 'right')
+            if start_smpl is not None:           # Start samples are sorted within a value
+                first += np.searchsorted(ss[first:last], start_smpl, 'left')
+            if end_smpl is not None:
+                last = first + np.searchsorted(ss[first:last], end_smpl, 'left')
+            found.append(order[first:last])
+        if len(found) == 1:
+            return found[0]
+        rows = np.concatenate(found) if found else np.zeros(0, dtype=np.intp)
+        return rows[np.argsort(self.arrays()['ss'][rows], kind='stable')]
+
+    def records(self, rows):
+        '''Yield (start sample, end sample, class, label strings) for row numbers'''
+        data   = self.arrays()[rows]
+        labels = self.table.labels
+        for ss, es, cls, label in zip(data['ss'].tolist(), data['es'].tolist(),
+                                      data['cls'].tolist(), data['label'].tolist()):
+            yield ss, es, cls, labels[label]
@@ -0,0 +1,327 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Synthetic sigrok session (.sr) captures of FN-M16P traffic, for load testing
+
+    Random request/reply transactions (built with fn_m16p_encode) are laid out on the
+    module's RX and TX lines, rendered as UART logic levels (8N1, idle high) and written
+    to a session file a chunk at a time, along with the ground truth: the packets that
+    fn_m16p_session should find, as an .npz file of the same columns as fn_m16p_pool.
+
+        python -m fn_m16p.fn_m16p_synth -o load.sr --samples 1G --truth load.npz
+
+    Rendering is vectorized: each chunk is one np.repeat() of the combined channel
+    levels between line transitions, so idle time costs next to nothing.  Needs NumPy.
+'''
+
+import argparse
+import configparser
+import io
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+from .fn_m16p_encode    import FrameEncoder, RX, TX
+from .fn_m16p_frame     import CMD, FEED, MSB, LSB
+from .fn_m16p_labels    import LabelCache
+from .fn_m16p_messages  import packet_msg
+from .fn_m16p_pool      import COLUMNS, DTYPES
+from .fn_m16p_session   import UNITS
+from .fn_m16p_transact  import QUERY_CMDS, ACK_CMD
+from .fn_m16p_uart      import UartReceiver, DATA_BITS
+
+CHUNK_SIZE = 1 << 22                             # Samples per logic-1-N chunk
+POOL_SIZE  = 512                                 # Distinct transactions to choose from
+LATENCY    = (0.005, 0.03)                       # Reply latency range (seconds)
+GAP        = (0.0, 0.01)                         # Idle time range between transactions
+
+FRAME_BITS = DATA_BITS + 2                       # Start + data + stop bits
+
+
+def parse_count(text):
+    '''Convert a sample count such as "5000000", "50M" or "2G" to a number'''
+    text = text.strip()
+    unit = UNITS.get(text[-1:].lower()) if text[-1:].isalpha() else 1
+    if unit is None:
+        raise argparse.ArgumentTypeError('Unrecognized count: %r' % text)
+    return int(float(text[:-1] if text[-1:].isalpha() else text) * unit)
+
+
+def parse_range(text):
+    '''Convert a "MIN:MAX" range of milliseconds to a (min, max) pair of seconds'''
+    try:
+        low, high = (float(part) / 1000 for part in text.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected MIN:MAX, got %r' % text) from None
+    if not 0 <= low <= high:
+        raise argparse.ArgumentTypeError('Bad range: %r' % text)
+    return low, high
+
+
+def format_samplerate(rate):
+    '''Samplerate as sigrok writes it in the metadata, e.g. "50 kHz"'''
+    for suffix, unit in (('GHz', UNITS['g']), ('MHz', UNITS['m']), ('kHz', UNITS['k'])):
+        if rate >= unit and rate % unit == 0:
+            return '%d %s' % (rate // unit, suffix)
+    return '%d Hz' % rate
+
+
+def random_param(cmd, rxtx, rng, lookup):
+    '''Return random (msb, lsb) values that give the packet a valid label'''
+    for _ in range(20):
+        msb = int(rng.choice((0, 0, 1, 2, rng.integers(256))))
+        lsb = int(rng.choice((0, 1, 2, 3, rng.integers(256))))
+        try:
+            lookup(cmd, rxtx, msb, lsb)
+            return msb, lsb
+        except IndexError:                       # Index beyond one of the string lists
+            pass
+    return 0, 0                                  # (Every list has an entry 0)
+
+
+def transaction_pool(rng, size=POOL_SIZE, no_checksum=0.2):
+    '''Return "size" random transactions: (TX packet, RX reply packet or b'') pairs.
+       Queries get their reply, other commands an ACK when they ask for feedback.'''
+    encoder  = FrameEncoder()
+    lookup   = LabelCache(strict=True).lookup
+    commands = sorted(cmd for cmd, rxtx in packet_msg if rxtx == TX and cmd != 0xFF)
+    pool     = []
+    for _ in range(size):
+        cmd  = int(rng.choice(commands))
+        feed = int(rng.integers(2))
+        _, request = encoder.frame(cmd, random_param(cmd, TX, rng, lookup), TX, feed,
+                                   rng.random() >= no_checksum)
+        reply = b''
+        if cmd in QUERY_CMDS and (cmd, RX) in packet_msg:
+            _, reply = encoder.frame(cmd, random_param(cmd, RX, rng, lookup), RX)
+        elif feed:
+            _, reply = encoder.frame(ACK_CMD, 0, RX)
+        pool.append((request, reply))
+    return pool
+
+
+class Layout:
+    '''Byte start samples and values for each line, and the packets they make up'''
+
+    def __init__(self, samplerate, baudrate):
+        self.samplerate = samplerate
+        self.baudrate   = baudrate
+        self.bit_width  = float(samplerate) / baudrate
+        self.byte_len   = int(round(FRAME_BITS * self.bit_width))  # Samples per byte
+        self.starts     = [None, None]           # Per direction: start bit samples
+        self.values     = [None, None]           #  and byte values (sorted by start)
+        self.truth      = None                   # Ground truth packet columns
+
+    def lay_out(self, pool, samples, rng, latency=LATENCY, gap=GAP):
+        '''Place random transactions from the pool one after another, until "samples"
+           samples are filled.  Each reply follows its request after a random latency,
+           and each request follows the previous transaction after a random gap
+           (both in seconds).'''
+        rate    = self.samplerate
+        lengths = np.array([[len(request), len(reply)] for request, reply in pool])
+        mean    = (lengths.sum(axis=1).mean() * self.byte_len
+                   + (latency[0] + latency[1] + gap[0] + gap[1]) / 2 * rate)
+        count   = int(samples / mean * 1.1) + 16
+        while True:                              # (Rarely needs a second try)
+            picks  = rng.integers(len(pool), size=count)
+            wait   = (rng.uniform(*latency, size=count) * rate).astype(np.int64)
+            pause  = (rng.uniform(*gap, size=count) * rate).astype(np.int64)
+            tx_len = lengths[picks, 0] * self.byte_len
+            rx_len = lengths[picks, 1] * self.byte_len
+            span   = tx_len + np.where(rx_len > 0, wait + rx_len, 0) + pause
+            tx_at  = np.concatenate(([0], np.cumsum(span)[:-1])) + self.byte_len
+            if tx_at[-1] >= samples:
+                break
+            count *= 2
+        keep  = tx_at + span - pause < samples - self.byte_len
+        picks = picks[keep]
+        tx_at = tx_at[keep]
+
+        parts = []
+        for rxtx, column, at in ((TX, 0, tx_at), (RX, 1, tx_at + tx_len[keep] + wait[keep])):
+            frames = [transaction[column] for transaction in pool]
+            sizes  = lengths[picks, column]
+            sent   = sizes > 0                   # (Not every request gets a reply)
+            at, used, sizes = at[sent], picks[sent], sizes[sent]
+                # Byte number within its packet, for every byte of every packet
+            offset = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            table  = np.frombuffer(b''.join(frames), dtype=np.uint8)
+            pos    = np.concatenate(([0], np.cumsum(lengths[:, column])[:-1]))
+            self.starts[rxtx] = np.repeat(at, sizes) + offset * self.byte_len
+            self.values[rxtx] = table[np.repeat(pos[used], sizes) + offset]
+            fields = np.array([[frame[CMD], frame[FEED], frame[MSB], frame[LSB]]
+                               if frame else [0] * 4 for frame in frames], dtype=np.uint8)
+            parts.append((rxtx, at, sizes, fields[used]))
+        self.truth = self.ground_truth(parts)
+
+    def ground_truth(self, parts):
+        '''Packet columns as fn_m16p_session/fn_m16p_pool report them (in the order of
+           their end samples, RX first on a tie)'''
+        receiver = UartReceiver(self.samplerate, self.baudrate)
+        columns  = {name: [] for name in COLUMNS}
+        for rxtx, at, sizes, fields in parts:
+            columns['ss'].append(at + receiver.start_ss)
+            columns['es'].append(at + (sizes - 1) * self.byte_len + receiver.last_es)
+            columns['rxtx'].append(np.full(len(at), rxtx))
+            for num, name in enumerate(('cmd', 'feed', 'msb', 'lsb')):
+                columns[name].append(fields[:, num])
+            columns['length'].append(sizes)
+        columns = {name: np.concatenate(columns[name]).astype(dtype, copy=False)
+                   for name, dtype in zip(COLUMNS, DTYPES)}
+        order   = np.lexsort((columns['rxtx'], columns['es']))
+        return {name: column[order] for name, column in columns.items()}
+
+
+class LineRenderer:
+    '''Renders the bytes of one line as logic levels, a chunk at a time'''
+    __slots__ = ('starts', 'values', 'edges', 'byte_len', 'mask')
+
+    def __init__(self, starts, values, bit_width, bit):
+        self.starts   = starts
+        self.values   = values
+        self.edges    = np.round(np.arange(FRAME_BITS) * bit_width).astype(np.int64)
+        self.byte_len = int(round(FRAME_BITS * bit_width))
+        self.mask     = np.uint8(1 << bit)
+
+    def transitions(self, first, last):
+        '''Return (samples, levels) of the bits of the bytes that are (at least partly)
+           in samples [first, last): each bit's first sample, and its level'''
+        lo, hi = np.searchsorted(self.starts, (first - self.byte_len, last))
+        values = self.values[lo:hi]
+        bits   = np.empty((len(values), FRAME_BITS), dtype=np.uint8)
+        bits[:, 0]  = 0                          # Start bit
+        bits[:, -1] = 1                          # Stop bit (the line stays high after it)
+        for bitnum in range(DATA_BITS):          # LSB first
+            bits[:, 1 + bitnum] = (values >> bitnum) & 1
+        return (self.starts[lo:hi, None] + self.edges).ravel(), bits.ravel()
+
+
+def render_chunk(lines, first, last, idle=0xFF):
+    '''Return samples [first, last) of all the lines, as uint8 (unitsize 1).  Other
+       channels are held at the "idle" bits.'''
+    found  = [line.transitions(first, last) for line in lines]
+    points = np.unique(np.concatenate([np.array([first], dtype=np.int64)]
+                                      + [where[(where > first) & (where < last)]
+                                         for where, _ in found]))
+    value  = np.full(len(points), idle, dtype=np.uint8)  # Levels from each point on
+    for line, (where, bits) in zip(lines, found):
+        if not len(where):                       # Idle (high) throughout
+            value |= line.mask
+            continue
+        index = np.searchsorted(where, points, side='right') - 1
+        level = np.where(index >= 0, bits[np.maximum(index, 0)], 1)
+        value = (value & ~line.mask) | (level * line.mask)
+    return np.repeat(value, np.diff(np.append(points, last)))
+
+
+class SessionWriter:
+    '''Writes logic data to a new sigrok session file, a chunk at a time'''
+
+    def __init__(self, path, samplerate, channels, compress=False):
+        self.zipfile  = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED if compress
+                                        else zipfile.ZIP_STORED, allowZip64=True)
+        self.chunks   = 0
+        self.samples  = 0
+        meta = configparser.ConfigParser(interpolation=None)
+        meta.optionxform = str
+        meta['global']   = {'sigrok version': '0.5.2'}
+        device = {'capturefile': 'logic-1', 'total probes': '8',
+                  'samplerate': format_samplerate(samplerate), 'total analog': '0'}
+        for name, bit in sorted(channels.items(), key=lambda item: item[1]):
+            device['probe%d' % (bit + 1)] = name
+        device['unitsize'] = '1'
+        meta['device 1'] = device
+        text = io.StringIO()
+        meta.write(text)
+        self.zipfile.writestr('version', '2')
+        self.zipfile.writestr('metadata', text.getvalue())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, samples):
+        '''Append a chunk of samples'''
+        self.chunks += 1
+        self.zipfile.writestr('logic-1-%d' % self.chunks, samples.tobytes())
+        self.samples += len(samples)
+
+    def close(self):
+        '''Finish the session file'''
+        self.zipfile.close()
+
+
+def synthesize(path, samples, samplerate=1000000, baudrate=9600, rx='D5', tx='D6',
+               seed=1, chunk_size=CHUNK_SIZE, compress=False, latency=LATENCY, gap=GAP):
+    '''Write a capture of "samples" samples of random traffic to path; return its
+       ground truth packet columns'''
+    rng    = np.random.default_rng(seed)
+    layout = Layout(samplerate, baudrate)
+    layout.lay_out(transaction_pool(rng), samples, rng, latency, gap)
+    bits   = {name: int(name.lstrip('Dd')) for name in (rx, tx)}
+    lines  = [LineRenderer(layout.starts[rxtx], layout.values[rxtx], layout.bit_width,
+                           bits[name]) for rxtx, name in ((RX, rx), (TX, tx))]
+    with SessionWriter(path, samplerate, bits, compress) as writer:
+        for first in range(0, samples, chunk_size):
+            writer.write(render_chunk(lines, first, min(first + chunk_size, samples)))
+    return layout.truth
+
+
+def main(argv=None):
+    '''Command-line entry point'''
+    parser = argparse.ArgumentParser(description='Write a synthetic sigrok session (.sr) '
+                                                 'file of random FN-M16P traffic.')
+    parser.add_argument('-o', '--output', required=True, help='.sr file to write')
+    parser.add_argument('--samples', type=parse_count, default=parse_count('100M'),
+                        help='samples to write, e.g. 500M or 2G (default: 100M)')
+    parser.add_argument('--samplerate', type=parse_count, default=1000000)
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--rx', default='D5', help='channel for the module\'s RX line')
+    parser.add_argument('--tx', default='D6', help='channel for the module\'s TX line')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--chunk-size', type=parse_count, default=CHUNK_SIZE,
+                        help='samples per chunk (default: %(default)s)')
+    parser.add_argument('--latency', type=parse_range, default='5:30',
+                        help='reply latency range, MIN:MAX ms (default: %(default)s)')
+    parser.add_argument('--gap', type=parse_range, default='0:10',
+                        help='idle time between transactions, MIN:MAX ms '
+                             '(default: %(default)s)')
+    parser.add_argument('--compress', action='store_true',
+                        help='deflate the chunks (smaller, but much slower)')
+    parser.add_argument('--truth', help='ground truth .npz file to write')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    truth   = synthesize(args.output, args.samples, args.samplerate, args.baudrate,
+                         args.rx, args.tx, args.seed, args.chunk_size, args.compress,
+                         args.latency, args.gap)
+    elapsed = time.perf_counter() - started
+    if args.truth:
+        np.savez(args.truth, **truth)
+    print('%d samples, %d packets in %.3f s (%.0f samples/s)'
+          % (args.samples, len(truth['ss']), elapsed, args.samples / elapsed),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Command/response transactions and response-time statistics
+
+    The FN-M16P protocol is request/reply:
+      - TX queries (0x3F, 0x42-0x4F) are answered by an RX packet with the same command,
+      - TX packets sent with FEED=1 are answered by an RX 0x41 (ACK) or 0x40 (error).
+    A TransactionTracker is fed the complete packets (in order) and pairs each reply with
+    the oldest outstanding request it can answer, keeping a latency histogram (constant
+    memory) per command.  All times are in samples.  Used by pd.Decoder's "transactions"
+    option, and usable on its own, e.g. on fn_m16p_batch results.
+'''
+
+from collections import deque
+
+RX, TX = 0, 1
+
+QUERY_CMDS = frozenset([0x3F] + list(range(0x42, 0x50)))  # Answered by the same cmd
+ACK_CMD    = 0x41                                # Feedback: command accepted
+ERROR_CMD  = 0x40                                # Feedback: command failed
+
+    # Event kinds returned by TransactionTracker.packet()
+REPLY   = 'REPLY'                                # Query answered
+ACK     = 'ACK'                                  # FEED=1 command acknowledged
+ERROR   = 'ERROR'                                # FEED=1 command answered by an error
+TIMEOUT = 'TIMEOUT'                              # No answer in time
+ORPHAN  = 'ORPHAN'                               # Answer with no request outstanding
+
+MAX_PENDING = 64                                 # Unanswered requests kept per queue
+COMPACT_AT  = 1024                               # Requests in order before compacting it
+
+SUB_BUCKETS = 4                                  # Histogram buckets per power of 2
+HIST_SIZE   = 64 * SUB_BUCKETS
+
+
+def bucket_of(value):
+    '''Histogram bucket of a (non-negative) latency: exact below SUB_BUCKETS, then
+       SUB_BUCKETS buckets per power of 2 (so within 25%)'''
+    if value < SUB_BUCKETS:
+        return value
+    exp = value.bit_length() - 3                 # Keep the top 3 bits: 1xx
+    return ((exp + 1) << 2) + ((value >> exp) & 3)
+
+
+def bucket_low(bucket):
+    '''Smallest latency falling in a histogram bucket'''
+    if bucket < SUB_BUCKETS:
+        return bucket
+    exp = (bucket >> 2) - 1
+    return (4 + (bucket & 3)) << exp
+
+
+class LatencyHistogram:
+    '''Streaming latency statistics in constant memory: count, min, max, total, and a
+       log-linear histogram for percentiles'''
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * HIST_SIZE
+        self.count  = 0
+        self.total  = 0
+        self.min    = None
+        self.max    = None
+
+    def add(self, value):
+        '''Add one latency (in samples)'''
+        self.counts[bucket_of(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        '''Mean latency, or None if there are none yet'''
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct):
+        '''Approximate pct'th percentile (the low edge of its bucket, kept within the
+           min..max seen), or None if there are no latencies yet'''
+        if not self.count:
+            return None
+        wanted = max(1, -(-self.count * pct // 100))   # Rank of the percentile (ceiling)
+        seen = 0
+        for bucket, num in enumerate(self.counts):
+            seen += num
+            if seen >= wanted:
+                return min(max(bucket_low(bucket), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        '''Return the statistics as a dict'''
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.mean(), 'p50': self.percentile(50),
+                'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+
+class Request:
+    '''An answer expected for a TX packet'''
+    __slots__ = ('ss', 'es', 'cmd', 'kind', 'done', 'timed', 'other')
+
+    def __init__(self, ss, es, cmd, kind, timed):
+        self.ss    = ss                          # Request packet's start/end sample
+        self.es    = es
+        self.cmd   = cmd                         # Request packet's command
+        self.kind  = kind                        # REPLY or ACK (which also covers ERROR)
+        self.done  = False                       # Answered (or timed out)
+        self.timed = timed                       # Does its latency go in the histogram?
+        self.other = None                        # Request waiting on the other answer of
+                                                 # a query sent with FEED=1
+
+
+class TransactionTracker:
+    '''Pairs replies with outstanding requests and keeps response time statistics
+
+       packet() returns a list of events, each a tuple:
+         (kind, cmd, request ss, request es, answer ss, answer es, latency)
+       with kind REPLY, ACK, ERROR, TIMEOUT or ORPHAN (for which the request fields are
+       None), cmd being the request's command (the answer's, for ORPHAN), and latency in
+       samples (from the end of the request to the end of the answer).
+
+       Memory stays bounded without a timeout too: a queue never holds more than
+       MAX_PENDING requests (older ones are given up on, as TIMEOUT events), and answered
+       requests are dropped from "order" even behind one still outstanding.'''
+    __slots__ = ('timeout', 'pending', 'acks', 'order', 'compact_at', 'histograms',
+                 'counts')
+
+    def __init__(self, timeout=None):
+        self.timeout    = timeout                # Samples to wait for an answer (None =
+                                                 # forever)
+        self.pending    = {}                     # cmd -> deque of Requests for REPLY
+        self.acks       = deque()                # Requests waiting for ACK/ERROR
+        self.order      = deque()                # All Requests, oldest first (for timeouts)
+        self.compact_at = COMPACT_AT             # len(order) that triggers compact()
+        self.histograms = {}                     # Request cmd -> LatencyHistogram
+        self.counts     = dict.fromkeys((REPLY, ACK, ERROR, TIMEOUT, ORPHAN), 0)
+
+    def packet(self, ss, es, rxtx, cmd, feed):
+        '''Handle the next complete packet; return the events it caused'''
+        events = self.expire(es) if self.order else []
+        if rxtx == TX:
+            events += self.request(ss, es, cmd, feed)
+        elif cmd == ACK_CMD:
+            events.append(self.answer(self.acks, ss, es, cmd, ACK))
+        elif cmd == ERROR_CMD:
+            events.append(self.answer(self.acks, ss, es, cmd, ERROR))
+        elif cmd in QUERY_CMDS:
+            events.append(self.answer(self.pending.get(cmd), ss, es, cmd, REPLY))
+        return events                            # (Other RX packets are status reports)
+
+    def request(self, ss, es, cmd, feed):
+        '''Note the answer(s) that a TX packet should get; return the events of any
+           requests given up on to make room (see limit())'''
+        query  = cmd in QUERY_CMDS
+        reply  = ack = None
+        events = []
+        if query:
+            reply = Request(ss, es, cmd, REPLY, True)
+            queue = self.pending.setdefault(cmd, deque())
+            queue.append(reply)
+            self.order.append(reply)
+            events += self.limit(queue)
+        if feed:                                 # With a query, the reply is what's timed
+            ack = Request(ss, es, cmd, ACK, not query)
+            self.acks.append(ack)
+            self.order.append(ack)
+            events += self.limit(self.acks)
+        if reply and ack:
+            reply.other, ack.other = ack, reply
+        return events
+
+    def limit(self, queue):
+        '''Give up on the oldest requests of a queue holding more than MAX_PENDING (as
+           timed out), so unanswered requests can't pile up; return their events'''
+        events = []
+        while len(queue) > MAX_PENDING:
+            req = queue.popleft()
+            if not req.done:
+                req.done = True
+                self.counts[TIMEOUT] += 1
+                events.append((TIMEOUT, req.cmd, req.ss, req.es, None, None, None))
+        return events
+
+    def answer(self, queue, ss, es, cmd, kind):
+        '''Pair an answer with the oldest outstanding request in queue; return the event'''
+        while queue:
+            req = queue.popleft()
+            if req.done:                         # Timed out, or cancelled by an error
+                continue
+            req.done = True
+            latency = es - req.es
+            if kind == ERROR and req.other:      # Failed query: no reply is coming
+                req.other.done = True
+            if req.timed or (kind == ERROR and req.other):
+                hist = self.histograms.get(req.cmd)
+                if hist is None:
+                    hist = self.histograms[req.cmd] = LatencyHistogram()
+                hist.add(latency)
+            self.counts[kind] += 1
+            return (kind, req.cmd, req.ss, req.es, ss, es, latency)
+        self.counts[ORPHAN] += 1
+        return (ORPHAN, cmd, None, None, ss, es, None)
+
+    def expire(self, now):
+        '''Time out requests still unanswered at sample "now"; return their events'''
+        events = []
+        order = self.order
+        while order:
+            req = order[0]
+            if not req.done:
+                if self.timeout is None or now - req.es <= self.timeout:
+                    break
+                req.done = True
+                self.counts[TIMEOUT] += 1
+                events.append((TIMEOUT, req.cmd, req.ss, req.es, None, None, None))
+            order.popleft()
+            self.discard_done(self.acks if req.kind == ACK else self.pending[req.cmd])
+        if len(order) > self.compact_at:         # (Held up by an outstanding request)
+            self.compact()
+        return events
+
+    def compact(self):
+        '''Drop all answered (or timed out) requests from "order", not only those in
+           front of the oldest outstanding one'''
+        self.order      = deque(req for req in self.order if not req.done)
+        self.compact_at = max(COMPACT_AT, 2 * len(self.order))
+
+    @staticmethod
+    def discard_done(queue):
+        '''Drop the answered (or timed out) requests from the front of a queue, so the
+           queues don't grow with requests that will never be answered'''
+        while queue and queue[0].done:
+            queue.popleft()
+
+    def outstanding(self):
+        '''Number of requests still waiting for an answer'''
+        return sum(1 for req in self.order if not req.done)
+
+    def summary(self):
+        '''Return {cmd: latency statistics dict} plus event counts under "events"'''
+        result = {cmd: hist.summary() for cmd, hist in sorted(self.histograms.items())}
+        result['events'] = dict(self.counts, OUTSTANDING=self.outstanding())
+        return result
+
+
+def format_latency(samples, samplerate):
+    '''Format a latency in samples as time (if the samplerate is known)'''
+    if samples is None:
+        return '-'
+    if not samplerate:
+        return '%d smpl' % samples
+    secs = samples / samplerate
+    if secs >= 1.0:
+        return '%.3f s' % secs
+    if secs >= 0.001:
+        return '%.1f ms' % (secs * 1e3)
+    return '%.0f us' % (secs * 1e6)
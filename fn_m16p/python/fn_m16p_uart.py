@@ -0,0 +1,119 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Vectorized (NumPy) UART receiver for offline decoding of logic captures
+
+    Finds start bits and sample points the same way as the 'uart' PD (8 data bits, no
+    parity, 1 stop bit, idle high -- the FN-M16P's fixed serial format), but for a whole
+    block of samples at once.  Samples are fed in blocks of any size; a frame that
+    straddles two blocks is carried over.
+'''
+
+from math import ceil, floor
+
+import numpy as np
+
+DATA_BITS = 8
+
+
+class UartReceiver:
+    '''Recovers the data bytes from one logic channel, fed a block at a time'''
+    __slots__ = ('points', 'start_ss', 'last_es', 'carry', 'carry_base', 'prev_level',
+                 'skip')
+
+    def __init__(self, samplerate, baudrate=9600, sample_point=50):
+        bit_width = float(samplerate) / baudrate
+        perc      = sample_point / 100.0         # Same sample point math as the uart PD
+            # Sample offset (from the start bit's falling edge) of the sample point of the
+            # start bit, each data bit and the stop bit
+        self.points = np.array([int((bit_width - 1) * perc + bitnum * bit_width)
+                                for bitnum in range(DATA_BITS + 2)], dtype=np.int64)
+            # Offsets of each byte's start/end samples, as passed to stacked decoders
+        self.start_ss = int(self.points[1]) - floor(bit_width / 2.0)
+        self.last_es  = int(self.points[DATA_BITS]) + ceil(bit_width / 2.0)
+
+        self.carry      = np.zeros(0, dtype=np.uint8)  # Samples of an unfinished frame
+        self.carry_base = 0                            # Sample number of carry[0]
+        self.prev_level = 1                            # Level of the sample before that
+        self.skip       = 0                            # Samples to ignore before looking
+                                                       # for the next start bit
+
+    def feed(self, bits, base):
+        '''Process a block of samples (0/1 values) starting at sample number "base".
+           Returns (ss, es, data) arrays for the bytes completed in this block.'''
+        if len(self.carry):
+            bits = np.concatenate((self.carry, bits))
+            base = self.carry_base
+        count = len(bits)
+        empty = np.zeros(0, dtype=np.int64)
+        if not count:
+            return empty, empty, np.zeros(0, dtype=np.uint8)
+
+            # Falling edges (each one *might* be a start bit)
+        edges = np.flatnonzero(np.diff(bits.astype(np.int8), prepend=self.prev_level) < 0)
+        edges = edges[edges >= self.skip]
+
+            # Like the uart PD: a falling edge whose start bit samples high was a glitch,
+            # so look for the next edge after its sample point; otherwise look for the
+            # next edge after the stop bit's sample point
+        start_pt = edges + self.points[0]
+        known    = start_pt < count              # Can we tell yet?
+        glitch   = np.zeros(len(edges), dtype=bool)
+        glitch[known] = bits[start_pt[known]] != 0
+        resume   = np.where(glitch, start_pt, edges + self.points[-1]) + 1
+
+            # Each edge has exactly one successor; the frames actually received are the
+            # chain of successors from the first edge (pointer doubling, as in
+            # fn_m16p_batch.find_frames)
+        last     = len(edges)
+        on_chain = np.zeros(last + 1, dtype=bool)
+        if last:
+            jump = np.append(np.searchsorted(edges, resume), last)
+            on_chain[0] = True
+            while True:
+                on_chain[jump[on_chain]] = True
+                if jump[0] == last:
+                    break
+                jump = jump[jump]
+        on_chain = on_chain[:last]
+        frames   = edges[on_chain & ~glitch]
+        resume   = resume[on_chain]
+
+            # A frame is reported once all of its data bits are in; it is carried over to
+            # the next block if they aren't
+        done    = frames + self.points[DATA_BITS] < count
+        pending = frames[~done]
+        frames  = frames[done]
+        value   = np.zeros(len(frames), dtype=np.uint8)
+        for bitnum in range(DATA_BITS):          # LSB first
+            value |= bits[frames + self.points[1 + bitnum]].astype(np.uint8) << bitnum
+
+        if len(pending):                         # Keep the samples of the unfinished frame
+            self.carry      = bits[pending[0]:].copy()
+            self.carry_base = base + pending[0]
+            self.prev_level = 1
+            self.skip       = 0
+        else:
+            self.carry      = bits[:0]
+            self.carry_base = base + count
+            self.prev_level = int(bits[-1])
+            self.skip       = max((int(resume[-1]) if len(resume) else self.skip) - count, 0)
+
+        frames = frames + base
+        return frames + self.start_ss, frames + self.last_es, value
@@ -21,27 +21,21 @@
 import sigrokdecode as srd
 
     # Import sets of strings for labeling I/O packets and their fields
-from .fn_m16p_messages import field_label, packet_msg,                    \
-                              list_A,  list_B,  list_C, list_D,   list_E, \
-                              list_LS, list_MS, list_O, list_40RX
-
-#                             ==========================
-#                             FN_M16P DATA PACKET FORMAT
-#                             ==========================
-#                                                  Parameter        Checksum
-#       START    VER     LEN     CMD    FEED     MSB     LSB    CHK1    CHK2     END
-#     +-------+-------+-------+-------+-------+-------+-------+-------+-------+-------+
-#     | 0x7E  | 0xFF  | 0x06  |[DATA] | 0 or 1|[DATA] |[DATA] |[CALC] |[CALC] | 0xEF  |
-#     +-------+-------+-------+-------+-------+-------+-------+-------+-------+-------+
-
-    # Byte offsets within each packet
-# START = 0, VER = 1, LEN = 2, FEED = 4, CHK1 = 7, CHK2 = 8, END = 9
-CMD = 3
-MSB = 5
-LSB = 6
-
-START_BYTE = 0x7E
-END_BYTE   = 0xEF
+from .fn_m16p_messages import list_A,  list_B,  list_C, list_D,   list_E, \
+                              list_LS, list_MS
+    # Import pre-compiled packet labels (built from the same message sets)
+from .fn_m16p_labels import LabelCache
+from .fn_m16p_stats import DecoderStats
+from .fn_m16p_coalesce import Coalescer
+from .fn_m16p_transact import TransactionTracker, QUERY_CMDS, ACK, TIMEOUT, ORPHAN, \
+                              format_latency
+
+    # Import packet format (byte offsets, etc.) and the byte-level state machine
+from .fn_m16p_frame import CMD, FEED, MSB, LSB, CHK1, CHK2, IDLE,                \
+                           PACKET_CLASS, ACT_UNKNOWN, ACT_START, ACT_FIELD, ACT_END, \
+                           CHK_OK, CHK_BAD, checksum_status
+    # Import the frame schemas of the module variants, compiled into byte engines
+from .fn_m16p_schema import ENGINES, DEFAULT, FIELD_PAYLOAD
 
 def expand_str( org_str, my_msb, my_lsb ):
     ''' "Expand" data packet labels by replacing placeholders with actual values'''
@@ -79,6 +73,28 @@ def expand_str( org_str, my_msb, my_lsb ):
                                                  # return expanded string
 
 
+    # Annotation payloads, built once so that decode() never has to allocate them.  (Each
+    # field byte's is in its channel's field_ann, indexed by state = # of bytes before it.)
+UNKNOWN_ANN   = tuple(FIELD_PAYLOAD[rxtx][0]  for rxtx in (0, 1))
+END_ANN       = tuple(FIELD_PAYLOAD[rxtx][10] for rxtx in (0, 1))
+FRAME_ERR_ANN = tuple(FIELD_PAYLOAD[rxtx][15] for rxtx in (0, 1))
+CHK_ERR_ANN   = tuple(FIELD_PAYLOAD[rxtx][14] for rxtx in (0, 1))
+
+
+#   OUTPUT_PYTHON format (one per complete packet, spanning the whole packet):
+#     ('PACKET', rxtx, cmd, feed, param, chk)
+#       rxtx  = 0 for RX, 1 for TX
+#       cmd   = Command code
+#       feed  = Feedback flag (0 or 1)
+#       param = 16-bit parameter, (MSB << 8) + LSB
+#       chk   = Checksum status: 0 = none (8-byte packet), 1 = OK, 2 = mismatch
+#               (CHK_NONE, CHK_OK, CHK_BAD in fn_m16p_frame)
+#
+#   OUTPUT_BINARY: the raw bytes of each complete packet whose checksum matched (so only
+#   10-byte packets: an 8-byte one has no checksum, so can't be told from a damaged
+#   frame, and is only on OUTPUT_PYTHON, with chk = 0).  Binary class 0 = RX, 1 = TX.
+
+
 class Decoder(srd.Decoder):
     ''' Main class of FN_M16P serial protocol decoder'''
     api_version = 3
@@ -88,10 +104,25 @@ class Decoder(srd.Decoder):
     desc        = 'FN-M16P module (MP3/WAV player) serial protocol.'
     license     = 'gplv2+'
     inputs      = ['uart']
-    outputs     = []         # ['fn_m16p'] -- For future use???
+    outputs     = ['fn_m16p']
 #    channels          = ** No extra channels needed beyond those defined for the UART decoder **
 #    optional_channels = ** NONE **
-#    options           = ** No extra options needed beyond those defined for the UART decoder **
+    options     = (
+        {'id': 'variant', 'desc': 'Module variant (frame format and messages)',
+         'default': DEFAULT.name, 'values': tuple(ENGINES)},
+        {'id': 'resync', 'desc': 'Resync after frame errors (and check checksums)',
+         'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'transactions', 'desc': 'Pair requests with replies (and time them)',
+         'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'timeout', 'desc': 'Reply timeout (ms)', 'default': 1000},
+        {'id': 'coalesce', 'desc': 'Show runs of repeated transactions as one annotation',
+         'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'detail', 'desc': 'Annotation detail (fewer annotations decode faster)',
+         'default': 'full', 'values': ('full', 'packets+errors', 'packets')},
+        {'id': 'stats', 'desc': 'Collect decoder statistics (JSON dump at end of decode)',
+         'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'stats_file', 'desc': 'Statistics file (default: stderr)', 'default': ''},
+    )
 
     annotations = (
 # ------  Identifier --- Description -------- Meaning --------------------------------------------
@@ -117,16 +148,34 @@ class Decoder(srd.Decoder):
 # PACKETS
         ('rx-packet',   'RX Packet'    ),   # 18 - Overall packet (command/query/report/feedback)
         ('tx-packet',   'TX Packet'    ),   # 19
+# ERRORS
+        ('rx-chk-err',  'RX Bad Chksum'),   # 20 - Checksum bytes don't match packet contents
+        ('tx-chk-err',  'TX Bad Chksum'),   # 21
+# TRANSACTIONS
+        ('transaction', 'Transaction'  ),   # 22 - Request and its reply/ACK/error, with latency
+        ('timeout',     'Timeout'      ),   # 23 - Request not answered in time
+        ('orphan',      'Orphan Reply' ),   # 24 - Reply/ACK/error with no request outstanding
+        ('latency',     'Latency Stats'),   # 25 - Running response time statistics for a cmd
+        ('repeat',      'Repeated'     ),   # 26 - Run of identical transactions (coalesced)
     )
     annotation_rows = (
 # ------  Identifier --- Description --- Annotation class index/ices -----------
         ('rx-fields',   'RX Fields',    ( 0,  2,  4,  6,  8, 10, 12, 14, 16,)),
         ('rx-feedback', 'RX Feedback',  (18,                                )),
+        ('rx-errors',   'RX Errors',    (20,                                )),
 
         ('tx-fields',   'TX Fields',    ( 1,  3,  5,  7,  9, 11, 13, 15, 17,)),
         ('tx-commands', 'TX Commands',  (19,                                )),
+        ('tx-errors',   'TX Errors',    (21,                                )),
+
+        ('transactions', 'Transactions', (22, 23, 24,                       )),
+        ('latencies',   'Latencies',    (25,                                )),
+        ('repeats',     'Repeats',      (26,                                )),
+    )
+    binary = (
+        ('rx-frames',   'RX frames'    ),   #  0 - Raw bytes of checksummed RX packets
+        ('tx-frames',   'TX frames'    ),   #  1 - Raw bytes of checksummed TX packets
     )
-#   binary = ** N/A **
     tags = ['Audio']
 
 ###############################
@@ -134,112 +183,141 @@ class Decoder(srd.Decoder):
 ###############################
     def __init__(self):
         self.out_ann = None                      # To avoid pylint message W0201
+        self.out_python = None
+        self.out_binary = None
+        self.samplerate = None
+        self.tracker = None                      # TransactionTracker, if enabled
+        self.coalescer = None                    # Coalescer, if enabled
+        self.stats = None                        # DecoderStats, if enabled
+        self.all_fields = True                   # Label the fields of good packets?
+        self.error_anns = True                   # Label unexpected bytes, frame errors?
+        self.label_cache = LabelCache()          # Recently expanded packet labels
+        self.engine = DEFAULT                    # Compiled frame schema (see start())
+        self.channel = DEFAULT.channels()        # Packet state for RX and TX
         self.reset()
 
 
     def reset(self):
         '''Initialize RX/TX channel-specific values'''
-                          # RX      TX
-        self.packet_ss   = [-1,     -1    ]      # Set Start Sample numbers out of range
-        self.packet_es   = [-1,     -1    ]      # Set End Sample numbers out of range
-        self.packet_data = [[],     []    ]      # Clear out data bytes for packets
-        self.state       = ['IDLE', 'IDLE']      # Set states to "Not currently in a packet"
+        for rxtx in (0, 1):
+            self.reset_channel(rxtx)
 
 
     def reset_channel(self, rxtx):
         '''Initialize channel-specific values for a single channel (RX or TX)'''
-        self.packet_ss[rxtx]   = -1              # Set Start Sample number out of range
-        self.packet_es[rxtx]   = -1              # Set End Sample number out of range
-        self.packet_data[rxtx] = []              # Clear out data bytes for packet
-        self.state[rxtx]       = 'IDLE'          # Set state to "Not currently in a packet"
+        self.channel[rxtx].reset()               # Back to IDLE (packet buffer is reused)
 
 
     def start(self):
         '''Not sure exactly when this is called...'''
-        self.out_ann = self.register(srd.OUTPUT_ANN)
-
-
-    def process_idle_byte(self, start_smpl, end_smpl, rxtx, pdata):
-        '''Handle a byte received while specified channel is in the IDLE state'''
-        if pdata == START_BYTE:                  # Received a Start Byte?
-            self.put( start_smpl, end_smpl, self.out_ann, [2+rxtx, field_label[1]] )
-                                                 #  Yes, label the Start byte
-            self.packet_ss[rxtx] = start_smpl    #   Remember packet's starting sample number
-            self.packet_data[rxtx].append(pdata) #   Add start byte to packet data
-            self.state[rxtx] = 'PACKET'          #   Change to "inside a packet" state
-        else:                                    #  No (not a Start Byte)...
-            self.put( start_smpl, end_smpl, self.out_ann, [0+rxtx, field_label[0]] )
-                                                 #   Label the unexpected byte
+        self.out_ann    = self.register(srd.OUTPUT_ANN)
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+        self.out_binary = self.register(srd.OUTPUT_BINARY)
+        if self.options['variant'] != self.engine.name:
+            self.engine      = ENGINES[self.options['variant']]   # Same decode(), other
+            self.channel     = self.engine.channels()             # tables and labels
+            self.label_cache = LabelCache(table=self.engine.labels)
+        if self.options['resync'] == 'yes':      # Rescan bad frames for a Start Byte
+            self.bad_frame = self.resync
+        if self.options['detail'] != 'full':     # Fields only of malformed frames, and
+            self.all_fields = False              # those and errors only if asked for
+            self.error_anns = self.options['detail'] == 'packets+errors'
+        if self.options['resync'] == 'yes' or self.options['detail'] != 'full':
+            self.decode = self.decode_held       # Swap in the byte handler that holds
+                                                 # frames back, so the normal one needn't
+                                                 # check a flag
+        if self.options['transactions'] == 'yes':
+            self.tracker = TransactionTracker()
+            self.set_timeout()
+        if self.options['coalesce'] == 'yes' and self.coalescer is None:
+            self.coalescer = Coalescer(self, self.put, self.out_ann,   # Replaces put() in
+                                       UNKNOWN_ANN, FRAME_ERR_ANN)     # this instance only
+            self.put = self.coalescer.put
+        if self.options['stats'] == 'yes' and self.stats is None:
+            self.stats = DecoderStats()          # Wraps the methods above (and put()) in
+            self.stats.instrument(self)          # this instance only
+
+
+    def end(self):
+        '''End of decoding: pass on coalesced annotations still held back, and dump the
+           statistics, if collected'''
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        if self.stats is not None:
+            self.stats.dump(self.options['stats_file'])
+
+
+    def metadata(self, key, value):
+        '''Samplerate is needed for reply timeouts, and to show latencies as times'''
+        if key == srd.SRD_CONF_SAMPLERATE:
+            self.samplerate = value
+            self.set_timeout()
+
+
+    def set_timeout(self):
+        '''Convert the "timeout" option to samples (no timeouts without a samplerate)'''
+        if self.tracker is not None and self.samplerate:
+            self.tracker.timeout = int(self.options['timeout']) * self.samplerate // 1000
 
 
     def gen_packet_label(self, rxtx):
         '''Controller method for generating a single label for a given data packet'''
-                                                 # Copy useful numbers
-        cmd = self.packet_data[rxtx][CMD]        #  Command Code
-        msb = self.packet_data[rxtx][MSB]        #  MSB of parameter
-        lsb = self.packet_data[rxtx][LSB]        #  LSB of parameter
-
-        if (cmd, rxtx) in packet_msg:            # Does message collection contain an
-                                                 # entry that matches packet's Command
-                                                 # Code and RX/TX direction?
-            msg = packet_msg[cmd, rxtx]          #  Yes, init local reference variable
-            if msg[0].find("^") < 0:             #   Does the entry contain any "markers"
-                                                 #   to be replaced?
-                output = msg                     #    No, use entry as-is
-            elif msg[0] == '^LO':                #    Yes, is the entry for reporting
-                                                 #    Online devices?
-                output = list_O[lsb]             #     Yes, use separate list of device
-                                                 #     combinations
-            elif msg[0] == '^LX':                #     No, is the entry for reporting
-                                                 #     eXceptions/errors?
-                output = list_40RX[lsb]          #      Yes, use separate list of errors
-            else:                                #      No, replace "standard" markers...
-                output = []                      #       Start with empty string list
-                for msg_str in msg:              #       For each str in matching entry...
-                    output.append( expand_str(msg_str, msb, lsb) )
-                                                 #        Add "expanded" version to output str list
-
-        else:                                    #  No (no matching message entry)
-            output = packet_msg[0xFF, rxtx]      #   Use the generic "Unknown Feedback
-                                                 #   / Command" message, based on RX/TX
+        chan = self.channel[rxtx]                # Copy useful numbers
+        cmd  = chan.data[CMD]                    #  Command Code
+        msb  = chan.data[MSB]                    #  MSB of parameter
+        lsb  = chan.data[LSB]                    #  LSB of parameter
+
+        output = self.label_cache.lookup(cmd, rxtx, msb, lsb)
+                                                 # Get (possibly cached) label from the
+                                                 # pre-compiled packet_msg entries
             # The one-and-only (packet level) output statement
-        self.put(self.packet_ss[rxtx],self.packet_es[rxtx],self.out_ann,[18+rxtx,output])
-
-
-    def process_packet_byte(self, start_smpl, end_smpl, rxtx, pdata):
-        '''Handle a byte received while specified channel is in the PACKET state'''
-        end_of_packet = False                    #   Yes, assume we're NOT at end of packet
-        self.packet_data[rxtx].append(pdata)     #    Add new byte to packet data
-        pkt_len = len(self.packet_data[rxtx])    #    Get # of bytes in packet so far
-        if pkt_len in (2, 3, 4, 5, 6, 7):        #    Received intermediate data byte?
-            ann_row = (pkt_len * 2) + rxtx       #     Yes, calculate appropriate annotation index
-            self.put( start_smpl, end_smpl, self.out_ann, [ann_row, field_label[pkt_len]] )
-                                                 #      Label the Ver/Len/Cmd/Feed/MSB/LSB byte
-        elif pkt_len == 8:                       #    8 bytes of packet data so far?
-            if pdata == END_BYTE:                #     Yes, is 8th byte an End Byte?
-                                                 #      (Checksum bytes are optional)
-                end_of_packet = True             #      Yes, remember to close the packet
-            else:                                #      No...
-                self.put( start_smpl, end_smpl, self.out_ann, [14+rxtx, field_label[8]] )
-                                                 #       Label the Checksum MSB byte
-        elif pkt_len == 9:                       #    9 bytes of packet data so far?
-            self.put( start_smpl, end_smpl, self.out_ann, [14+rxtx, field_label[9]] )
-                                                 #     Yes, label the Checksum LSB byte
-        elif pkt_len == 10:                      #    10 bytes of packet data so far?
-            if pdata == END_BYTE:                #     Yes, is byte #10 an End Byte?
-                end_of_packet = True             #      Yes, remember to close the packet
-            else:                                #      No...
-                self.put( start_smpl, end_smpl, self.out_ann, [ 0+rxtx, field_label[15]] )
-                                                 #       Label the out-of-place data byte
-
-        if end_of_packet:                        #    8th (or 10th) byte was an End Byte?
-            self.put( start_smpl, end_smpl, self.out_ann, [16+rxtx, field_label[10]] )
-                                                 #     Yes, label the End Byte
-            self.packet_es[rxtx] = end_smpl      #      Remember packet's ending sample number
-            self.gen_packet_label(rxtx)          #      Generate label for the overall packet
-
-        if end_of_packet or pkt_len >= 10:       #    Packet ended cleanly (or was corrupted)?
-            self.reset_channel(rxtx)             #     Yes, reset values for RX/TX "channel"
+        self.put(chan.packet_ss, chan.packet_es, self.out_ann, [PACKET_CLASS+rxtx, output])
+
+
+    def gen_packet_outputs(self, rxtx, length, chk):
+        '''Pass a complete packet on to stacked decoders (OUTPUT_PYTHON) and, if its
+           checksum matched, as raw bytes (OUTPUT_BINARY)'''
+        chan = self.channel[rxtx]
+        data = chan.data
+        self.put(chan.packet_ss, chan.packet_es, self.out_python,
+                 ('PACKET', rxtx, data[CMD], data[FEED], (data[MSB] << 8) + data[LSB], chk))
+        if chk == CHK_OK:
+            self.put(chan.packet_ss, chan.packet_es, self.out_binary,
+                     [rxtx, bytes(data[:length])])
+        if self.tracker is not None:
+            self.gen_transactions(rxtx)
+
+
+    def gen_transactions(self, rxtx):
+        '''Pair a complete packet with its request/reply; label the transactions it
+           completes (or times out), and the latency statistics of their commands'''
+        chan = self.channel[rxtx]
+        events = self.tracker.packet(chan.packet_ss, chan.packet_es, rxtx,
+                                     chan.data[CMD], chan.data[FEED])
+        for kind, cmd, req_ss, req_es, ans_ss, ans_es, latency in events:
+            if kind == ORPHAN:
+                self.put( ans_ss, ans_es, self.out_ann,
+                          [24, ['Orphan reply 0x%02X' % cmd, 'Orphan', 'O']] )
+            elif kind == TIMEOUT:
+                self.put( req_ss, req_es, self.out_ann,
+                          [23, ['Cmd 0x%02X: no reply' % cmd, 'No reply', 'NR']] )
+            else:
+                took = format_latency(latency, self.samplerate)
+                self.put( req_ss, ans_es, self.out_ann,
+                          [22, ['Cmd 0x%02X %s in %s' % (cmd, kind, took),
+                                '0x%02X %s' % (cmd, took), took]] )
+                hist = self.tracker.histograms.get(cmd)
+                if hist is not None and (kind != ACK or cmd not in QUERY_CMDS):
+                                                 # (A query's ACK isn't in its histogram)
+                    avg = format_latency(int(hist.mean()), self.samplerate)
+                    self.put( req_ss, ans_es, self.out_ann,
+                              [25, ['Cmd 0x%02X: n=%d min %s avg %s p90 %s max %s'
+                                    % (cmd, hist.count,
+                                       format_latency(hist.min, self.samplerate), avg,
+                                       format_latency(hist.percentile(90), self.samplerate),
+                                       format_latency(hist.max, self.samplerate)),
+                                    'Cmd 0x%02X: n=%d avg %s' % (cmd, hist.count, avg),
+                                    'avg %s' % avg]] )
 
 
     def decode(self, start_smpl, end_smpl, data):
@@ -253,10 +331,128 @@ class Decoder(srd.Decoder):
             # We're only interested in byte values (not individual bits)
         pdata = pdata[0]
 
-        if self.state[rxtx] == 'IDLE':           # Waiting for an FN_M16P packet to start?
-            self.process_idle_byte(start_smpl, end_smpl, rxtx, pdata)
-                                                 #  Yes, handle byte received while "IDLE"
-
-        elif self.state[rxtx] == 'PACKET':       #  No, currently inside an FN_M16P packet?
-            self.process_packet_byte(start_smpl, end_smpl, rxtx, pdata)
-                                                 #  Yes, handle byte received within the packet
+        chan   = self.channel[rxtx]
+        state  = chan.state                      # IDLE, or # of packet bytes so far
+        action = chan.rows[state][pdata]         # What to do with this byte in this state
+
+        if action == ACT_FIELD:                  # Ver/Len/Cmd/Feed/MSB/LSB/Checksum byte?
+            self.put( start_smpl, end_smpl, self.out_ann, chan.field_ann[state] )
+            chan.data[state] = pdata             #  Yes, label it and add it to packet data
+            chan.state = state + 1
+
+        elif action == ACT_START:                # Start Byte (while IDLE)?
+            self.put( start_smpl, end_smpl, self.out_ann, chan.field_ann[IDLE] )
+            chan.packet_ss = start_smpl          #  Yes, label it and remember packet's
+            chan.data[0] = pdata                 #  starting sample number
+            chan.state = 1
+
+        elif action == ACT_UNKNOWN:              # Unexpected byte (while IDLE)?
+            self.put( start_smpl, end_smpl, self.out_ann, UNKNOWN_ANN[rxtx] )
+            if self.stats is not None:
+                self.stats.byte_error('unexpected', rxtx)
+
+        elif action == ACT_END:                  # End Byte (8th, or 10th with checksum)?
+            self.put( start_smpl, end_smpl, self.out_ann, END_ANN[rxtx] )
+            chan.packet_es = end_smpl            #  Yes, label it, remember packet's ending
+            chan.data[state] = pdata             #  sample number and label the packet
+            self.gen_packet_label(rxtx)
+            self.gen_packet_outputs(rxtx, state + 1, checksum_status(chan.data, state + 1))
+            chan.reset()
+
+        else:                                    # 10th byte wasn't an End Byte (or another
+                                                 # byte wasn't allowed), so the packet was
+                                                 # corrupted
+            self.put( start_smpl, end_smpl, self.out_ann, FRAME_ERR_ANN[rxtx] )
+            if self.stats is not None:
+                self.stats.byte_error('frame_error', rxtx)
+            chan.reset()
+
+
+    def decode_held(self, start_smpl, end_smpl, data):
+        '''Replacement for decode() when the "resync" option is on, or the "detail"
+           option is reduced: each byte is held in the channel's frame buffer (see
+           Channel.hold()), and a frame's field annotations are held back until it is
+           known to be good or bad (see frame_event())'''
+        ptype, rxtx, pdata = data
+        if ptype != 'DATA':
+            return
+        action = self.channel[rxtx].hold(pdata[0], start_smpl, end_smpl)
+        if action != ACT_FIELD and action != ACT_START:   # (Most bytes: nothing more)
+            self.frame_event(rxtx, action, start_smpl, end_smpl)
+
+
+    def frame_event(self, rxtx, action, start_smpl, end_smpl):
+        '''Handle a held byte that completed a packet, broke a frame, or was outside
+           one.  A good packet's fields are labeled only in full detail; a bad frame is
+           handled by bad_frame(): drop_frame(), or resync() with the "resync" option.'''
+        chan = self.channel[rxtx]
+        if action == ACT_END:                    # Complete packet: check its checksum
+            chk = chan.checksum_status()
+            if self.all_fields or (chk == CHK_BAD and self.error_anns):
+                self.put_fields(rxtx, chan.state)
+                if chk == CHK_BAD and self.error_anns:
+                    self.put( chan.byte_ss[CHK1], chan.byte_es[CHK2], self.out_ann,
+                              CHK_ERR_ANN[rxtx] )
+                self.put( start_smpl, end_smpl, self.out_ann, END_ANN[rxtx] )
+            self.gen_packet_label(rxtx)
+            self.gen_packet_outputs(rxtx, chan.state + 1, chk)
+            chan.reset()
+
+        elif action == ACT_UNKNOWN:
+            if self.error_anns:
+                self.put( start_smpl, end_smpl, self.out_ann, UNKNOWN_ANN[rxtx] )
+            elif self.coalescer is not None:     # (Not annotated: still ends a run)
+                self.coalescer.error(rxtx)
+            if self.stats is not None:
+                self.stats.byte_error('unexpected', rxtx)
+
+        else:                                    # Byte not allowed here (ACT_FRAME_ERR)
+            if self.stats is not None:
+                self.stats.byte_error('frame_error', rxtx)
+            self.bad_frame(rxtx)
+
+
+    def put_fields(self, rxtx, count):
+        '''Label the first "count" bytes held in a channel's frame buffer as fields'''
+        chan = self.channel[rxtx]
+        for pos in range(count):
+            self.put( chan.byte_ss[pos], chan.byte_es[pos], self.out_ann,
+                      chan.field_ann[pos] )
+
+
+    def drop_frame(self, rxtx):
+        '''bad_frame() without the "resync" option: as in decode(), the frame's bytes
+           are fields (only labeled with errors shown) and the byte that broke it is a
+           Frame Error'''
+        chan = self.channel[rxtx]
+        if self.error_anns:
+            self.put_fields(rxtx, chan.state)
+            self.put( chan.byte_ss[chan.state], chan.byte_es[chan.state], self.out_ann,
+                      FRAME_ERR_ANN[rxtx] )
+        elif self.coalescer is not None:         # (Not annotated: still ends a run)
+            self.coalescer.error(rxtx)
+        chan.reset()
+
+    bad_frame = drop_frame                       # (start() swaps in resync())
+
+
+    def resync(self, rxtx):
+        '''Recover from a bad frame: everything before the next Start Byte within it is
+           labeled as a Frame Error, and the bytes from there on are handled again as if
+           newly received (without being fed in again)'''
+        chan  = self.channel[rxtx]
+        held  = list(zip(chan.data, chan.byte_ss, chan.byte_es))[:chan.state + 1]
+                                                 # (Copied, as the rescan overwrites them)
+        start = next((pos for pos in range(1, len(held))
+                      if chan.rows[IDLE][held[pos][0]] == ACT_START), len(held))
+                                                 # (len(held): no other Start Byte in it)
+        if self.error_anns:
+            for _, start_smpl, end_smpl in held[:start]:
+                self.put( start_smpl, end_smpl, self.out_ann, FRAME_ERR_ANN[rxtx] )
+        elif self.coalescer is not None:         # (Not annotated: still ends a run)
+            self.coalescer.error(rxtx)
+        chan.reset()
+        for pdata, start_smpl, end_smpl in held[start:]:
+            action = chan.hold(pdata, start_smpl, end_smpl)
+            if action != ACT_FIELD and action != ACT_START:
+                self.frame_event(rxtx, action, start_smpl, end_smpl)
@@ -0,0 +1,400 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Throughput benchmarks for the FN-M16P decoder
+
+    Runs the decoder (outside libsigrokdecode, using the stand-in sigrokdecode module in
+    this directory) over synthetic traffic from traffic.py, and reports bytes/s,
+    packets/s, put() calls per packet and peak memory for each scenario.  Results can be
+    saved as JSON and compared with an earlier run:
+
+        python bench.py --output before.json
+        ... change the decoder ...
+        python bench.py --output after.json --compare before.json
+
+    With --compare, the exit status is 1 if any scenario got slower by more than the
+    --tolerance percentage.
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import traffic as traffic_gen
+
+HERE        = os.path.dirname(os.path.abspath(__file__))
+DECODER_DIR = os.path.join(HERE, '..', '..', 'python')
+
+DESYNC_RATE = 0.1                                # Frames cut short, for scenario "resync"
+POLL_RATE   = 0.1                                # Runs of polls, for scenario "coalesce"
+
+
+def load_decoder(path):
+    '''Import the decoder directory as package "fn_m16p" (as libsigrokdecode does), using
+       the stand-in sigrokdecode module from this directory'''
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    spec = importlib.util.spec_from_file_location(
+        'fn_m16p', os.path.join(path, '__init__.py'),
+        submodule_search_locations=[os.path.abspath(path)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['fn_m16p'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, repeat):
+    '''Run func() "repeat" times; return the best time, and the peak memory allocated
+       (traced in a separate, untimed run)'''
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def has_option(pkg, name):
+    '''Does the decoder have option "name"?  Scenarios of options (or modules) that a
+       decoder predates are skipped, so older decoders can still be benchmarked.'''
+    return any(option['id'] == name for option in getattr(pkg.pd.Decoder, 'options', ()))
+
+
+def label_lookup(pkg):
+    '''Return lookup(cmd, rxtx, msb, lsb) for traffic_gen.generate(), raising IndexError
+       for parameters without a label: a strict LabelCache's, or for a decoder that
+       predates fn_m16p_labels, expand_str() on the packet_msg entry'''
+    try:
+        labels = importlib.import_module('fn_m16p.fn_m16p_labels')
+    except ImportError:
+        msgs   = pkg.fn_m16p_messages
+        expand = pkg.pd.expand_str
+
+        def lookup(cmd, rxtx, msb, lsb):
+            msg = msgs.packet_msg.get((cmd, rxtx), msgs.packet_msg[0xFF, rxtx])
+            if msg[0] == '^LO':
+                return msgs.list_O[lsb]
+            if msg[0] == '^LX':
+                return msgs.list_40RX[lsb]
+            return [expand(msg_str, msb, lsb) for msg_str in msg]
+        return lookup
+    try:
+        return labels.LabelCache(strict=True).lookup
+    except TypeError:                            # (Before "strict", lookup() always raised)
+        return labels.LabelCache().lookup
+
+
+def scenario_decode(pkg, traffic):
+    '''Whole decoder: every byte through Decoder.decode()'''
+    uart  = traffic.uart_packets()
+    stats = {}
+
+    def run():
+        decoder = pkg.pd.Decoder()
+        decoder.start()
+        decode = decoder.decode
+        for start_smpl, end_smpl, data in uart:
+            decode(start_smpl, end_smpl, data)
+        stats['puts'] = decoder.put_count
+    return run, stats
+
+
+def scenario_label(pkg, traffic):
+    '''Packet labels only: Decoder.gen_packet_label() for each good packet'''
+    if not hasattr(pkg.pd.Decoder(), 'channel'): # (Predates the Channel packet buffers)
+        return None, {}
+    stats = {}
+
+    def run():
+        decoder = pkg.pd.Decoder()
+        decoder.start()
+        for rxtx, data in traffic.good:
+            decoder.channel[rxtx].data[:len(data)] = data
+            decoder.gen_packet_label(rxtx)
+        stats['puts'] = decoder.put_count
+    return run, stats
+
+
+def scenario_expand(pkg, traffic):
+    '''Placeholder expansion only: expand_str() on every string of each good packet's
+       packet_msg entry (the work done per packet before labels were pre-compiled)'''
+    msgs    = pkg.fn_m16p_messages.packet_msg
+    cmd_at, msb_at, lsb_at = pkg.pd.CMD, pkg.pd.MSB, pkg.pd.LSB
+    strings = []
+    for rxtx, data in traffic.good:
+        msg = msgs.get((data[cmd_at], rxtx), [])
+        if msg and '^' in msg[0] and msg[0] not in ('^LO', '^LX'):
+            strings.append((msg, data[msb_at], data[lsb_at]))
+    expand_str = pkg.pd.expand_str
+
+    def run():
+        for msg, msb, lsb in strings:
+            for msg_str in msg:
+                expand_str(msg_str, msb, lsb)
+    return run, {}
+
+
+def scenario_variant(pkg, traffic):
+    '''Decoder.decode() running another variant's compiled frame schema (MP3-TF-16P:
+       its Ver/Len bytes are checked, too), which should cost the same as the default'''
+    if not has_option(pkg, 'variant'):
+        return None, {}
+    uart  = traffic.uart_packets()
+    stats = {}
+
+    def run():
+        decoder = pkg.pd.Decoder()
+        decoder.options['variant'] = 'MP3-TF-16P'
+        decoder.start()
+        decode = decoder.decode
+        for start_smpl, end_smpl, data in uart:
+            decode(start_smpl, end_smpl, data)
+        stats['puts'] = decoder.put_count
+    return run, stats
+
+
+def scenario_detail(pkg, traffic, detail):
+    '''Decoder.decode() with a reduced "detail" option'''
+    if not has_option(pkg, 'detail'):
+        return None, {}
+    uart  = traffic.uart_packets()
+    stats = {}
+
+    def run():
+        decoder = pkg.pd.Decoder()
+        decoder.options['detail'] = detail
+        decoder.start()
+        decode = decoder.decode
+        for start_smpl, end_smpl, data in uart:
+            decode(start_smpl, end_smpl, data)
+        stats['puts'] = decoder.put_count
+    return run, stats
+
+
+def scenario_errors(pkg, traffic):
+    '''Decoder.decode() with detail "packets+errors": labels and errors, no fields'''
+    return scenario_detail(pkg, traffic, 'packets+errors')
+
+
+def scenario_packets(pkg, traffic):
+    '''Decoder.decode() with detail "packets": packet labels only (OUTPUT_PYTHON and
+       OUTPUT_BINARY are still put())'''
+    return scenario_detail(pkg, traffic, 'packets')
+
+
+def scenario_resync(pkg, traffic):
+    '''Decoder.decode() with the "resync" option, on traffic where some frames are cut
+       short with the next frame following straight on.  Also reports the frames
+       recovered (packets labeled beyond those found without resyncing) per second.'''
+    if not has_option(pkg, 'resync'):
+        return None, {}
+    noisy = traffic_gen.generate(pkg.fn_m16p_messages.packet_msg,
+                                 label_lookup(pkg),
+                                 seed=traffic.seed, frames=traffic.frames,
+                                 desync_rate=DESYNC_RATE)
+    uart  = noisy.uart_packets()
+    stats = {'bytes': len(noisy), 'packets': noisy.packets}
+
+    def run(resync='yes', records=None):
+        decoder = pkg.pd.Decoder()
+        decoder.options['resync'] = resync
+        decoder.records = records
+        decoder.start()
+        decode = decoder.decode
+        for start_smpl, end_smpl, data in uart:
+            decode(start_smpl, end_smpl, data)
+        stats['puts'] = decoder.put_count
+        return records
+
+    labeled = []                                 # Packets found without/with resync
+    for resync in ('no', 'yes'):
+        labeled.append(sum(1 for record in run(resync, [])
+                           if record[2] == pkg.pd.srd.OUTPUT_PYTHON))
+    stats['recovered'] = labeled[1] - labeled[0]
+    return run, stats
+
+
+def scenario_coalesce(pkg, traffic):
+    '''Decoder.decode() with the "coalesce" option, on traffic with runs of repeated
+       polls.  Also reports the annotations put() before and after coalescing.'''
+    if not has_option(pkg, 'coalesce'):
+        return None, {}
+    polled = traffic_gen.generate(pkg.fn_m16p_messages.packet_msg,
+                                  label_lookup(pkg),
+                                  seed=traffic.seed, frames=traffic.frames,
+                                  poll_rate=POLL_RATE)
+    uart   = polled.uart_packets()
+    stats  = {'bytes': len(polled), 'packets': polled.packets}
+
+    def run():
+        decoder = pkg.pd.Decoder()
+        decoder.options['coalesce'] = 'yes'
+        decoder.start()
+        decode = decoder.decode
+        for start_smpl, end_smpl, data in uart:
+            decode(start_smpl, end_smpl, data)
+        decoder.end()
+        stats['puts'] = decoder.put_count
+        stats['coalesce'] = decoder.coalescer.counts()
+    return run, stats
+
+
+def scenario_batch(pkg, traffic):
+    '''NumPy batch decoder (fn_m16p_batch), if NumPy is installed'''
+    try:
+        batch = importlib.import_module('fn_m16p.fn_m16p_batch')
+    except ImportError:
+        return None, {}
+    arrays = (traffic.start_smpl, traffic.end_smpl, traffic.data, traffic.rxtx)
+
+    def run():
+        batch.decode_arrays(*arrays)
+    return run, {}
+
+
+SCENARIOS = {
+    'decode':     scenario_decode,
+    'variant':    scenario_variant,
+    'errors':     scenario_errors,
+    'packets':    scenario_packets,
+    'label':      scenario_label,
+    'expand_str': scenario_expand,
+    'resync':     scenario_resync,
+    'coalesce':   scenario_coalesce,
+    'batch':      scenario_batch,
+}
+
+
+def run_benchmarks(args):
+    '''Run the selected scenarios; return the results as a JSON-ready dict'''
+    pkg     = load_decoder(args.decoder)
+    traffic = traffic_gen.generate(pkg.fn_m16p_messages.packet_msg, label_lookup(pkg),
+                                   seed=args.seed, frames=args.frames)
+
+    results = {
+        'meta': {
+            'python':   platform.python_version(),
+            'platform': platform.platform(),
+            'time':     time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seed':     args.seed,
+            'frames':   traffic.frames,
+            'packets':  traffic.packets,
+            'bytes':    len(traffic),
+            'skipped':  [],                      # Scenarios this decoder can't run
+        },
+        'scenarios': {},
+    }
+    for name in args.scenario or SCENARIOS:
+        run, stats = SCENARIOS[name](pkg, traffic)
+        if run is None:
+            results['meta']['skipped'].append(name)
+            continue
+        seconds, peak = measure(run, args.repeat)
+        packets = stats.get('packets', traffic.packets)
+        entry = {
+            'seconds':     seconds,
+            'bytes_per_s': stats.get('bytes', len(traffic)) / seconds,
+            'pkts_per_s':  packets / seconds,
+            'peak_bytes':  peak,
+        }
+        if 'puts' in stats:
+            entry['puts_per_pkt'] = stats['puts'] / packets
+        if 'recovered' in stats:
+            entry['recovered']       = stats['recovered']
+            entry['recovered_per_s'] = stats['recovered'] / seconds
+        if 'coalesce' in stats:
+            entry['ann_before'] = stats['coalesce']['before']
+            entry['ann_after']  = stats['coalesce']['after']
+        results['scenarios'][name] = entry
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''Print each scenario's speed relative to the baseline; return True if any scenario
+       is slower by more than "tolerance" percent'''
+    regressed = False
+    for name, entry in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        change = (entry['seconds'] / old['seconds'] - 1.0) * 100.0
+        flag   = ''
+        if change > tolerance:
+            flag, regressed = '  <-- REGRESSION', True
+        print('  %-12s %+7.1f%% time%s' % (name, change, flag))
+    return regressed
+
+
+def main(argv=None):
+    '''Command-line entry point'''
+    parser = argparse.ArgumentParser(description='FN-M16P decoder throughput benchmarks.')
+    parser.add_argument('--decoder', default=DECODER_DIR,
+                        help='decoder directory to benchmark (default: this repo\'s)')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable; default: all)')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per scenario; the best is kept')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='allowed slowdown for --compare, in percent')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    meta    = results['meta']
+    print('%d bytes, %d frames, %d packets' % (meta['bytes'], meta['frames'], meta['packets']))
+    for name, entry in results['scenarios'].items():
+        print('  %-12s %10.0f bytes/s %9.0f pkts/s %6s puts/pkt %9d peak bytes'
+              % (name, entry['bytes_per_s'], entry['pkts_per_s'],
+                 '%.2f' % entry['puts_per_pkt'] if 'puts_per_pkt' in entry else '-',
+                 entry['peak_bytes']))
+        if 'recovered' in entry:
+            print('  %-12s %10d frames recovered (%.0f/s)'
+                  % ('', entry['recovered'], entry['recovered_per_s']))
+        if 'ann_before' in entry:
+            print('  %-12s %10d annotations coalesced to %d'
+                  % ('', entry['ann_before'], entry['ann_after']))
+    if meta['skipped']:
+        print('  (skipped: %s)' % ', '.join(meta['skipped']))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.compare:
+        with open(args.compare) as old:
+            baseline = json.load(old)
+        print('Compared with %s:' % args.compare)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Lightweight stand-in for libsigrokdecode's "sigrokdecode" module, for benchmarking
+
+    Only provides what a stacked PD like fn_m16p uses: the OUTPUT_* and SRD_CONF_SAMPLERATE
+    constants and a Decoder base class with register() and put().  put() just counts calls
+    (per output), unless "records" is set to a list, in which case every call is also
+    appended to it.
+    As in libsigrokdecode, a new decoder's "options" holds the default for each option;
+    change them before calling start().
+'''
+
+    # Same values as libsigrokdecode's SRD_OUTPUT_* enum
+OUTPUT_ANN    = 0
+OUTPUT_PYTHON = 1
+OUTPUT_BINARY = 2
+OUTPUT_LOGIC  = 3
+OUTPUT_META   = 4
+
+SRD_CONF_SAMPLERATE = 10000                      # Metadata key for the samplerate
+
+
+class Decoder:
+    '''Base class for protocol decoders'''
+    put_count = 0                                # Total put() calls
+    put_counts = None                            # put() calls per output id
+    records   = None                             # Set to a list to keep every put()
+
+    def __new__(cls, *args, **kwargs):
+        inst = super().__new__(cls)
+        inst.options = {option['id']: option['default']
+                        for option in getattr(cls, 'options', ())}
+        return inst
+
+    def register(self, output_type, meta=None, proto_id=None):
+        '''Register an output; returns its id (here, just the output type)'''
+        # pylint: disable=unused-argument
+        if self.put_counts is None:
+            self.put_counts = {}
+        self.put_counts.setdefault(output_type, 0)
+        return output_type
+
+    def put(self, start_smpl, end_smpl, output_id, data):
+        '''Count (and optionally record) an output from the decoder'''
+        self.put_count += 1
+        self.put_counts[output_id] += 1
+        if self.records is not None:
+            self.records.append((start_smpl, end_smpl, output_id, data))
@@ -0,0 +1,164 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Synthetic (but reproducible) FN-M16P traffic for benchmarking the decoder
+
+    Frames are generated for every (cmd, rxtx) entry of packet_msg, plus commands with
+    no entry at all, mixed with:
+      - frames without checksum bytes (8 bytes long),
+      - frames with a wrong checksum (the decoder doesn't check it, but should cope),
+      - corrupted frames (cut short, then padded to a bad 10th byte: a Frame Error),
+      - unexpected bytes between frames,
+      - optionally, frames cut short with the next frame following straight on (which
+        costs the next frame too, unless the decoder resyncs),
+      - optionally, runs of identical status/volume polls (TX query, RX reply), as
+        sent by a controller waiting for a track to end.
+    Parameters are chosen so that every well-formed frame has a valid label.
+'''
+
+import random
+
+START_BYTE = 0x7E
+END_BYTE   = 0xEF
+VERSION    = 0xFF
+LENGTH     = 0x06
+
+POLL_CMDS  = (0x42, 0x43)                        # Status and volume queries
+
+
+def checksum(body):
+    '''DFPlayer checksum of the Ver/Len/Cmd/Feed/MSB/LSB bytes, as (CHK1, CHK2)'''
+    value = -sum(body) & 0xFFFF
+    return value >> 8, value & 0xFF
+
+
+class Traffic:
+    '''A generated byte stream: parallel lists of start/end sample, direction and byte,
+       plus the number of good packets (the ones the decoder should label)'''
+
+    def __init__(self):
+        self.start_smpl = []
+        self.end_smpl   = []
+        self.rxtx       = []
+        self.data       = []
+        self.packets    = 0                      # Frames that should be labeled
+        self.good       = []                     # Their (rxtx, frame bytes)
+        self.frames     = 0                      # All frames, good or bad
+        self.cut        = 0                      # Frames cut short by "desync_rate"
+        self.seed       = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        '''Yield (start_smpl, end_smpl, rxtx, byte) for each byte'''
+        return zip(self.start_smpl, self.end_smpl, self.rxtx, self.data)
+
+    def uart_packets(self):
+        '''Return the bytes as (start_smpl, end_smpl, data) arguments for Decoder.decode'''
+        return [(ss, es, ['DATA', rxtx, (byte, [])]) for ss, es, rxtx, byte in self.items()]
+
+
+def param_choices(cmd, rxtx, lookup):
+    '''Return a function giving random (msb, lsb) values that produce a valid label'''
+    def choose(rng):
+        for _ in range(20):
+            msb = rng.choice((0, 0, 1, 2, rng.randrange(256)))
+            lsb = rng.choice((0, 1, 2, 3, rng.randrange(256)))
+            try:
+                lookup(cmd, rxtx, msb, lsb)
+                return msb, lsb
+            except IndexError:                   # Index beyond one of the string lists
+                pass
+        return 0, 0                              # (Every list has an entry 0)
+    return choose
+
+
+def generate(packet_msg, lookup, seed=1, frames=10000, samplerate=50000, baudrate=9600,
+             error_rate=0.05, noise_rate=0.02, desync_rate=0.0, poll_rate=0.0):
+    '''Generate a Traffic stream of roughly "frames" frames
+
+       lookup(cmd, rxtx, msb, lsb) must return a packet's label (raising IndexError for
+       parameters it can't label); fn_m16p_labels.LabelCache(strict=True).lookup will
+       do.'''
+    rng     = random.Random(seed)
+    keys    = sorted(key for key in packet_msg if key[0] != 0xFF)
+    unknown = [(cmd, rxtx) for cmd in (0x50, 0xA5) for rxtx in (0, 1)]   # No entry
+    choices = {key: param_choices(key[0], key[1], lookup) for key in keys + unknown}
+    traffic = Traffic()
+    traffic.seed = seed
+    byte_len = int(samplerate * 10 / baudrate)   # Start + 8 data + stop bits
+    smpl     = 0
+    noise    = [byte for byte in range(256) if byte != START_BYTE]
+
+    def send(rxtx, byte):
+        nonlocal smpl
+        traffic.start_smpl.append(smpl)
+        traffic.end_smpl.append(smpl + byte_len)
+        traffic.rxtx.append(rxtx)
+        traffic.data.append(byte)
+        smpl += byte_len + 2
+
+    for num in range(frames):
+            # Walk through every key in turn (so all are covered), then pick at random
+        key = keys[num] if num < len(keys) else rng.choice(keys + unknown)
+        cmd, rxtx = key
+        msb, lsb  = choices[key](rng)
+        body  = [VERSION, LENGTH, cmd, rng.randrange(2), msb, lsb]
+        frame = [START_BYTE] + body
+        if rng.random() < 0.8:                   # Most senders include the checksum
+            chk1, chk2 = checksum(body)
+            if rng.random() < error_rate:
+                chk2 ^= 0x55                     # Wrong checksum
+            frame += [chk1, chk2]
+        frame.append(END_BYTE)
+
+        if rng.random() < error_rate:            # Corrupted: cut short and padded out
+            frame = frame[:rng.randrange(1, 8)]
+            frame += [0x00] * (10 - len(frame))
+        elif rng.random() < desync_rate:         # Cut short, next frame straight after
+            frame = frame[:rng.randrange(1, 8)]
+            traffic.cut += 1
+        else:
+            traffic.packets += 1
+            traffic.good.append((rxtx, bytes(frame)))
+        traffic.frames += 1
+
+        while rng.random() < noise_rate:         # Unexpected bytes between frames
+            send(rxtx, rng.choice(noise))
+        for byte in frame:
+            send(rxtx, byte)
+        smpl += byte_len * rng.randrange(1, 4)   # Idle time between frames
+
+        if poll_rate and rng.random() < poll_rate:   # A run of identical polls
+            cmd  = rng.choice(POLL_CMDS)
+            poll = []
+            for rxtx in (1, 0):                  # Query, then reply
+                body = [VERSION, LENGTH, cmd, 0] + list(choices[(cmd, rxtx)](rng))
+                poll.append((rxtx, [START_BYTE] + body + list(checksum(body)) + [END_BYTE]))
+            for _ in range(rng.randrange(2, 20)):
+                for rxtx, frame in poll:
+                    for byte in frame:
+                        send(rxtx, byte)
+                    smpl += byte_len * 20        # Reply (or next query) comes later
+                    traffic.good.append((rxtx, bytes(frame)))
+                traffic.packets += 2
+                traffic.frames  += 2
+
+    return traffic
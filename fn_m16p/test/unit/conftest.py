@@ -0,0 +1,72 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' pytest setup: the decoder directory is imported as package "fn_m16p" (as
+    libsigrokdecode does), with the stand-in sigrokdecode module from ../benchmark
+
+        python -m pytest fn_m16p/test/unit
+'''
+
+import os
+import sys
+
+HERE  = os.path.dirname(os.path.abspath(__file__))
+BENCH = os.path.join(HERE, '..', 'benchmark')
+if BENCH not in sys.path:
+    sys.path.insert(0, BENCH)
+
+import bench                                     # pylint: disable=wrong-import-position
+import traffic as traffic_gen                    # pylint: disable=wrong-import-position
+
+PKG = bench.load_decoder(bench.DECODER_DIR)
+
+
+def run_decoder(items, **options):
+    '''Run a pd.Decoder with the given options over (rxtx, byte) items (one byte every
+       10 samples); return the decoder, with every put() in its "records"'''
+    decoder = PKG.pd.Decoder()
+    decoder.options.update(options)
+    decoder.records = []
+    decoder.start()
+    for num, (rxtx, byte) in enumerate(items):
+        decoder.decode(num * 10, num * 10 + 9, ['DATA', rxtx, [byte, []]])
+    decoder.end()
+    return decoder
+
+
+def frames(*packets):
+    '''(rxtx, byte) items for a series of (rxtx, packet bytes)'''
+    return [(rxtx, byte) for rxtx, data in packets for byte in data]
+
+
+def annotations(decoder, classes=None):
+    '''(class, first string) of each annotation put(), optionally only those classes'''
+    return [(data[0], data[1][0]) for _, _, output_id, data in decoder.records
+            if output_id == decoder.out_ann and (classes is None or data[0] in classes)]
+
+
+
+def outputs(decoder, output_id):
+    '''The data of every put() to one output'''
+    return [data for _, _, out, data in decoder.records if out == output_id]
+
+def generate(**kwargs):
+    '''Synthetic traffic (see ../benchmark/traffic.py)'''
+    lookup = PKG.fn_m16p_labels.LabelCache(strict=True).lookup
+    return traffic_gen.generate(PKG.fn_m16p_messages.packet_msg, lookup, **kwargs)
@@ -0,0 +1,115 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' NumPy batch decoder (fn_m16p_batch) against pd.Decoder'''
+
+import pytest
+
+from conftest import PKG, run_decoder, frames, outputs, generate
+
+np    = pytest.importorskip('numpy')
+batch = pytest.importorskip('fn_m16p.fn_m16p_batch')
+
+TRAFFIC = generate(seed=4, frames=3000, desync_rate=0.05)
+ARRAYS  = (TRAFFIC.start_smpl, TRAFFIC.end_smpl, TRAFFIC.data, TRAFFIC.rxtx)
+ENGINES = PKG.fn_m16p_schema.ENGINES
+
+
+def pd_run(variant=PKG.fn_m16p_schema.DEFAULT.name):
+    '''pd.Decoder over the traffic, with the traffic's own sample numbers'''
+    decoder = PKG.pd.Decoder()
+    decoder.options['variant'] = variant
+    decoder.records = []
+    decoder.start()
+    for start_smpl, end_smpl, data in TRAFFIC.uart_packets():
+        decoder.decode(start_smpl, end_smpl, data)
+    return decoder
+
+
+def test_same_annotations_as_decoder():
+    '''decode_arrays() annotates every byte and packet as pd.Decoder does, in order'''
+    decoder  = pd_run()
+    expected = [(ss, es, data) for ss, es, out, data in decoder.records
+                if out == decoder.out_ann]
+    got      = list(batch.decode_arrays(*ARRAYS).annotations())
+    assert got == expected
+
+
+def test_packets_are_labeled():
+    '''packets() gives the label pd.Decoder puts for each packet'''
+    decoder  = pd_run()
+    expected = [(ss, es, data[0] & 1, data[1]) for ss, es, out, data in decoder.records
+                if out == decoder.out_ann and data[0] in (18, 19)]
+    assert list(batch.decode_arrays(*ARRAYS).packets()) == expected
+
+
+def test_parameter_out_of_range():
+    '''packets() and annotations() label a parameter beyond its message's strings as
+       pd.Decoder does'''
+    encode  = PKG.fn_m16p_frame.encode_frame
+    items   = frames((1, encode(0x07, 0, 200)), (0, encode(0x3F, 0, 40)))
+    smpl    = np.arange(len(items)) * 10
+    result  = batch.decode_arrays(smpl, smpl + 9, [byte for _, byte in items],
+                                  [rxtx for rxtx, _ in items])
+    assert [label[0] for _, _, _, label in result.packets()] == \
+        ['Unknown Command 0x07 (0x00 0xC8)', 'Unknown Feedback 0x3F (0x00 0x28)']
+    decoder = run_decoder(items)
+    assert list(result.annotations()) == [(ss, es, data) for ss, es, out, data
+                                          in decoder.records if out == decoder.out_ann]
+
+
+def test_same_packets_as_decoder():
+    '''The packet columns match pd.Decoder's OUTPUT_PYTHON records'''
+    decoder = pd_run()
+    result  = batch.decode_arrays(*ARRAYS)
+    got     = [('PACKET', rxtx, cmd, feed, (msb << 8) + lsb) for rxtx, cmd, feed, msb, lsb
+               in zip(result.rxtx.tolist(), result.cmd.tolist(), result.feed.tolist(),
+                      result.msb.tolist(), result.lsb.tolist())]
+    assert got == [record[:5] for record in outputs(decoder, decoder.out_python)]
+
+
+@pytest.mark.parametrize('variant', sorted(ENGINES))
+def test_variants_same_as_decoder(variant):
+    '''Each module variant's frames are found as pd.Decoder finds them'''
+    decoder  = pd_run(variant)
+    expected = [(ss, es, data) for ss, es, out, data in decoder.records
+                if out == decoder.out_ann]
+    engine   = ENGINES[variant]
+    labels   = PKG.fn_m16p_labels.LabelCache(table=engine.labels)
+    got      = list(batch.decode_arrays(*ARRAYS, engine=engine).annotations(labels))
+    assert got == expected
+
+
+def test_variants_differ():
+    '''(The traffic has frames that only the lax variant accepts)'''
+    counts = {len(batch.decode_arrays(*ARRAYS, engine=engine)) for engine in ENGINES.values()}
+    assert len(counts) > 1
+
+
+@pytest.mark.parametrize('block', [23, 64, 1000])
+@pytest.mark.parametrize('variant', sorted(ENGINES))
+def test_blocks_give_same_result(block, variant):
+    '''BatchDecoder gives the same packets and annotations whatever the block size'''
+    whole   = batch.decode_arrays(*ARRAYS, engine=ENGINES[variant])
+    decoder = batch.BatchDecoder(ENGINES[variant])
+    results = [decoder.feed(*(column[pos:pos + block] for column in ARRAYS))
+               for pos in range(0, len(TRAFFIC), block)]
+    merged  = batch.concatenate(results + [decoder.flush()])
+    for name in batch.BatchResult.__slots__:
+        assert np.array_equal(getattr(merged, name), getattr(whole, name)), name
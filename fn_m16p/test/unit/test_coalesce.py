@@ -0,0 +1,67 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Coalescing of repeated transactions (pd.Decoder's "coalesce" option)'''
+
+from conftest import PKG, run_decoder, frames, annotations
+
+RX, TX  = 0, 1
+encode  = PKG.fn_m16p_frame.encode_frame
+REPEAT  = PKG.fn_m16p_coalesce.REPEAT_CLASS
+POLL    = ((TX, encode(0x43, 0, 0)), (RX, encode(0x43, 0, 20)))   # Volume query/reply
+
+
+def test_run_of_polls():
+    '''Five identical transactions: the first keeps its annotations, the other four are
+       summarized by one annotation spanning the run'''
+    plain   = run_decoder(frames(*POLL))
+    decoder = run_decoder(frames(*POLL * 5), coalesce='yes')
+    anns    = annotations(decoder)
+    assert anns[:-1] == annotations(plain)
+    assert anns[-1][0] == REPEAT and anns[-1][1].startswith('5 x ')
+    assert decoder.coalescer.counts() == {'before': 5 * len(annotations(plain)),
+                                          'after': len(anns)}
+
+
+def test_different_transaction_breaks_run():
+    '''A different transaction ends the run, and is shown in full'''
+    other   = (TX, encode(0x06, 0, 20))
+    decoder = run_decoder(frames(*POLL * 3, other, *POLL), coalesce='yes')
+    repeats = annotations(decoder, (REPEAT,))
+    assert len(repeats) == 1 and repeats[0][1].startswith('3 x ')
+    assert (19, 'Set Volume to 20') in annotations(decoder)
+
+
+def test_frame_error_breaks_run():
+    '''A corrupted frame ends the run, and stays visible'''
+    bad     = (TX, encode(0x43, 0, 0)[:5] + bytes(5))
+    decoder = run_decoder(frames(*POLL * 2, bad, *POLL * 2), coalesce='yes')
+    repeats = [text for _, text in annotations(decoder, (REPEAT,))]
+    assert len(repeats) == 2 and all(text.startswith('2 x ') for text in repeats)
+    assert (1, 'Frame Error') in annotations(decoder)
+
+
+def test_unannotated_frame_error_breaks_run():
+    '''With "packets" detail, a corrupted frame isn't annotated, but still ends the run'''
+    bad     = (TX, encode(0x43, 0, 0)[:9] + bytes(1))
+    decoder = run_decoder(frames(*POLL * 2, bad, *POLL * 3), coalesce='yes',
+                          detail='packets')
+    repeats = [text for _, text in annotations(decoder, (REPEAT,))]
+    assert [text[:4] for text in repeats] == ['2 x ', '3 x ']
+    assert (1, 'Frame Error') not in annotations(decoder)
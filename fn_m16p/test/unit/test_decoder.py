@@ -0,0 +1,180 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' pd.Decoder: packets, structured outputs, resync recovery and checksum checks'''
+
+import gc
+import json
+import weakref
+
+import pytest
+
+from conftest import PKG, run_decoder, frames, annotations, outputs, generate
+
+RX, TX   = 0, 1
+PACKETS  = (18, 19)
+CHK_ERR  = (20, 21)
+encode   = PKG.fn_m16p_frame.encode_frame
+VOLUME   = encode(0x06, 0, 20)                   # Set volume to 20 (with checksum)
+STATUS   = encode(0x3F, 0, 2, with_checksum=False)   # Storage status (no checksum)
+
+
+def test_good_packet():
+    '''A packet: field annotations, its label, and OUTPUT_PYTHON/OUTPUT_BINARY'''
+    decoder = run_decoder(frames((TX, VOLUME)))
+    anns    = annotations(decoder)
+    assert len(anns) == 11                       # 10 fields and the packet
+    assert anns[-1] == (19, 'Set Volume to 20')
+    assert outputs(decoder, decoder.out_python) == [('PACKET', TX, 0x06, 0, 20, 1)]
+    assert outputs(decoder, decoder.out_binary) == [[TX, VOLUME]]
+
+
+def test_eight_byte_packet():
+    '''A packet without checksum bytes ends at its 8th byte, and isn't passed on raw'''
+    decoder = run_decoder(frames((RX, STATUS)))
+    assert len(annotations(decoder)) == 9        # 8 fields and the packet
+    assert outputs(decoder, decoder.out_python) == [('PACKET', RX, 0x3F, 0, 2, 0)]
+    assert outputs(decoder, decoder.out_binary) == []   # Not checksummed, so not raw
+
+
+def test_frame_error_loses_next_packet():
+    '''Without resync, a Start byte inside a corrupted frame is lost with it'''
+    items = frames((TX, VOLUME[:4]), (TX, VOLUME))
+    assert annotations(run_decoder(items), PACKETS) == []
+
+
+def test_resync_recovers_packet():
+    '''With resync, the bytes of a corrupted frame are rescanned from its next Start
+       byte, so the packet that follows the glitch is still found'''
+    decoder = run_decoder(frames((TX, VOLUME[:4]), (TX, VOLUME)), resync='yes')
+    assert annotations(decoder, PACKETS) == [(19, 'Set Volume to 20')]
+    assert [cls for cls, text in annotations(decoder) if text == 'Frame Error'] == [1] * 4
+
+
+def test_resync_checksum_mismatch():
+    '''With resync, a checksum mismatch gets its own annotation (and no binary output)'''
+    bad     = VOLUME[:8] + bytes([VOLUME[8] ^ 0x55]) + VOLUME[9:]
+    decoder = run_decoder(frames((TX, bad)), resync='yes')
+    assert annotations(decoder, CHK_ERR) == [(21, 'Chksum Mismatch')]
+    assert outputs(decoder, decoder.out_python)[0][5] == 2
+    assert outputs(decoder, decoder.out_binary) == []
+
+
+def test_checksum_mismatch_without_resync():
+    '''With errors shown, a checksum mismatch is annotated without resync too'''
+    bad     = VOLUME[:8] + bytes([VOLUME[8] ^ 0x55]) + VOLUME[9:]
+    decoder = run_decoder(frames((TX, bad)), detail='packets+errors')
+    assert annotations(decoder, CHK_ERR) == [(21, 'Chksum Mismatch')]
+
+
+@pytest.mark.parametrize('resync', ['no', 'yes'])
+def test_parameter_out_of_range(resync):
+    '''A parameter beyond its message's strings gets a raw label, and decoding goes on'''
+    items   = frames((TX, encode(0x07, 0, 200)), (RX, encode(0x3F, 0, 40)), (TX, VOLUME))
+    decoder = run_decoder(items, resync=resync)
+    assert annotations(decoder, PACKETS) == [(19, 'Unknown Command 0x07 (0x00 0xC8)'),
+                                             (18, 'Unknown Feedback 0x3F (0x00 0x28)'),
+                                             (19, 'Set Volume to 20')]
+    assert len(outputs(decoder, decoder.out_python)) == 3
+
+
+def test_resync_recovers_frames_from_noise():
+    '''On noisy traffic, resync finds every packet found without it, and more'''
+    noisy = generate(seed=2, frames=3000, desync_rate=0.1)
+    found = []
+    for resync in ('no', 'yes'):
+        decoder = run_decoder([(rxtx, byte) for rxtx, byte in
+                               zip(noisy.rxtx, noisy.data)], resync=resync)
+        found.append(outputs(decoder, decoder.out_python))
+    assert len(found[1]) > len(found[0])
+    remaining = iter(found[1])
+    assert all(packet in remaining for packet in found[0])
+
+
+BAD_CHK = VOLUME[:8] + bytes([VOLUME[8] ^ 0x55]) + VOLUME[9:]
+BROKEN  = VOLUME[:9] + bytes([0x00])             # 10th byte isn't an End byte
+ITEMS   = frames((TX, VOLUME), (TX, BROKEN), (RX, BAD_CHK), (TX, VOLUME))
+
+
+@pytest.mark.parametrize('resync', ['no', 'yes'])
+def test_detail_packets(resync):
+    '''"packets" detail: one annotation per packet, and nothing for bad frames'''
+    decoder = run_decoder(ITEMS, detail='packets', resync=resync)
+    assert decoder.put_counts[decoder.out_ann] == 3
+    assert annotations(decoder) == [(19, 'Set Volume to 20'), (18, 'Unknown Feedback'),
+                                    (19, 'Set Volume to 20')]
+
+
+@pytest.mark.parametrize('resync', ['no', 'yes'])
+def test_detail_packets_and_errors(resync):
+    '''"packets+errors" detail: a good packet is just its label; the fields of a bad
+       frame or checksum are shown, with the error'''
+    decoder = run_decoder(ITEMS, detail='packets+errors', resync=resync)
+    anns    = annotations(decoder)
+    assert anns.count((21, 'Chksum Mismatch')) == 0
+    assert annotations(decoder, CHK_ERR) == [(20, 'Chksum Mismatch')]
+    assert len([ann for ann in anns if ann[0] == 1]) == (1 if resync == 'no' else 10)
+    assert len([ann for ann in anns if ann[0] in range(2, 18, 2)]) == 10   # RX fields
+    assert len([ann for ann in anns if ann[0] in range(3, 18, 2)]) == (9 if resync == 'no'
+                                                                       else 0)
+    assert annotations(decoder, PACKETS) == [(19, 'Set Volume to 20'),
+                                             (18, 'Unknown Feedback'),
+                                             (19, 'Set Volume to 20')]
+
+
+@pytest.mark.parametrize('resync', ['no', 'yes'])
+@pytest.mark.parametrize('detail', ['packets+errors', 'packets'])
+def test_detail_keeps_structured_outputs(detail, resync):
+    '''"detail" only reduces the annotations: stacked decoders get the same OUTPUT_PYTHON
+       and OUTPUT_BINARY as in full detail'''
+    full    = run_decoder(ITEMS, resync=resync)
+    decoder = run_decoder(ITEMS, detail=detail, resync=resync)
+    for output_id in (decoder.out_python, decoder.out_binary):
+        assert outputs(decoder, output_id) == outputs(full, output_id)
+    assert len(outputs(decoder, decoder.out_python)) == 3
+
+
+def test_stats_dumped_by_end(tmp_path):
+    '''Statistics are written by end(), and nothing is left registered to run later'''
+    path    = tmp_path / 'stats.json'
+    decoder = run_decoder(frames((TX, VOLUME)), stats='yes', stats_file=str(path))
+    assert json.loads(path.read_text())
+    alive   = weakref.ref(decoder)
+    del decoder
+    gc.collect()
+    assert alive() is None
+
+
+@pytest.mark.parametrize('detail', ['full', 'packets+errors', 'packets'])
+@pytest.mark.parametrize('resync', ['no', 'yes'])
+def test_stats_byte_counts(tmp_path, detail, resync):
+    '''Unexpected and frame error bytes are counted the same whatever is annotated'''
+    path  = tmp_path / 'stats.json'
+    items = frames((TX, b'\x00\x01'), (TX, BROKEN), (TX, VOLUME), (RX, BROKEN))
+    run_decoder(items, detail=detail, resync=resync, stats='yes', stats_file=str(path))
+    assert json.loads(path.read_text())['bytes'] == \
+        {'rx': {'unexpected': 0, 'frame_error': 1}, 'tx': {'unexpected': 2, 'frame_error': 1}}
+
+
+def test_variant_messages():
+    '''The DFPlayer Mini labels 0x08 with its own message; the FN-M16P doesn't'''
+    items = frames((TX, encode(0x08, 0, 3)))
+    assert annotations(run_decoder(items), PACKETS) == [(19, 'Loop Device Track 3')]
+    assert annotations(run_decoder(items, variant='YX5200'), PACKETS) == \
+        [(19, 'Set Playback Mode 3')]
@@ -0,0 +1,56 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Frame encoder (fn_m16p_encode): the inverse of the packet labels'''
+
+import random
+
+import pytest
+
+from conftest import PKG
+from fn_m16p import fn_m16p_encode            # pylint: disable=wrong-import-order
+
+ENCODER = fn_m16p_encode.FrameEncoder()
+MSGS    = PKG.fn_m16p_messages.packet_msg
+
+
+def test_frame_by_name():
+    '''Frames built from a command name, an entry's other strings, or the code'''
+    expected = (1, PKG.fn_m16p_frame.encode_frame(0x06, 0, 20))
+    assert ENCODER.frame('Set Volume to', 20) == expected
+    assert ENCODER.frame(0x06, 20) == expected
+    with pytest.raises(ValueError):
+        ENCODER.frame('No such command')
+
+
+@pytest.mark.parametrize('key', sorted(key for key in MSGS if key[0] != 0xFF))
+def test_label_round_trip(key):
+    '''Label strings of random packets parse back to a packet with the same string'''
+    cmd, rxtx = key
+    lookup    = PKG.fn_m16p_labels.LabelCache(strict=True).lookup
+    rng       = random.Random(cmd * 2 + rxtx)
+    for _ in range(20):
+        msb, lsb = rng.randrange(256), rng.randrange(256)
+        try:
+            label = lookup(cmd, rxtx, msb, lsb)
+        except IndexError:
+            continue
+        for text in label:
+            got = ENCODER.parse(text, rxtx)     # (Short strings can be shared by
+            assert text in lookup(*got)          # several commands: any will do)
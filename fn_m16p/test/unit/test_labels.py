@@ -0,0 +1,74 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Pre-compiled packet labels (fn_m16p_labels) against pd.expand_str()'''
+
+import random
+
+import pytest
+
+from conftest import PKG
+
+MSGS = PKG.fn_m16p_messages.packet_msg
+
+
+def params(rng):
+    '''Parameters to try: the edges, and a few at random'''
+    return [(0, 0), (0, 1), (1, 0), (0x0F, 0xFF), (0xFF, 0xFF)] + \
+           [(rng.randrange(256), rng.randrange(256)) for _ in range(20)]
+
+
+@pytest.mark.parametrize('key', sorted(MSGS))
+def test_labels_match_expand_str(key):
+    '''Every entry renders exactly as expand_str() expands it, through the cache too'''
+    cmd, rxtx = key
+    msg   = MSGS[key]
+    cache = PKG.fn_m16p_labels.LabelCache(maxsize=8, strict=True)
+    if msg[0] in ('^LO', '^LX'):                 # Whole label chosen by the LSB
+        return
+    for msb, lsb in params(random.Random(cmd)):
+        try:
+            expected = [PKG.pd.expand_str(text, msb, lsb) for text in msg]
+        except IndexError:                       # Out of range for the entry's lists
+            with pytest.raises(IndexError):
+                cache.lookup(cmd, rxtx, msb, lsb)
+            continue
+        assert cache.lookup(cmd, rxtx, msb, lsb) == expected
+        assert cache.lookup(cmd, rxtx, msb, lsb) == expected      # (Cached, now)
+
+
+@pytest.mark.parametrize('rxtx, cmd, lsb', [(1, 0x07, 200), (0, 0x3F, 40), (0, 0x40, 200)])
+def test_parameter_out_of_range(rxtx, cmd, lsb):
+    '''A parameter beyond its message's strings gets a raw label (and is counted), or
+       raises IndexError with strict=True'''
+    cache = PKG.fn_m16p_labels.LabelCache()
+    for _ in range(2):                           # (Raw labels aren't cached)
+        label = cache.lookup(cmd, rxtx, 0, lsb)
+        assert label[0] == '%s 0x%02X (0x00 0x%02X)' % (MSGS[0xFF, rxtx][0], cmd, lsb)
+        assert label[1:] == ['%s 0x%02X' % (MSGS[0xFF, rxtx][1], cmd), MSGS[0xFF, rxtx][2]]
+    assert cache.bad_params[rxtx] == 2 and cache.bad_params[1 - rxtx] == 0
+    with pytest.raises(IndexError):
+        PKG.fn_m16p_labels.LabelCache(strict=True).lookup(cmd, rxtx, 0, lsb)
+
+
+def test_unknown_command_label():
+    '''Commands without an entry get the "Unknown" label of their direction'''
+    lookup = PKG.fn_m16p_labels.LabelCache().lookup
+    assert lookup(0x50, 1, 0, 0) == MSGS[0xFF, 1]
+    assert lookup(0x50, 0, 0, 0) == MSGS[0xFF, 0]
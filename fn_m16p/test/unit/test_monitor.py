@@ -0,0 +1,64 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+''' Live decoding of byte streams (fn_m16p_monitor.StreamDecoder)'''
+
+import pytest
+
+from conftest import PKG
+
+pytest.importorskip('termios')                   # (POSIX only)
+from fn_m16p import fn_m16p_monitor as monitor   # pylint: disable=wrong-import-position
+
+RX, TX = 0, 1
+encode = PKG.fn_m16p_frame.encode_frame
+
+
+def test_packets_in_any_chunks():
+    '''Packets are found however the bytes are split into reads'''
+    data = encode(0x06, 0, 20) + b'\x00' + encode(0x03, 0, 1, with_checksum=False)
+    for size in (1, 3, len(data)):
+        decoder = monitor.StreamDecoder()
+        found   = []
+        for pos in range(0, len(data), size):
+            found += decoder.feed(TX, data[pos:pos + size], pos)
+        assert [frame.label[0] for frame in found] == ['Set Volume to 20', 'Play Track /1']
+        assert [frame.chk for frame in found] == [1, 0]
+        assert (found[0].start_time, found[0].end_time) == (0, 9 // size * size)
+        assert decoder.unexpected == [0, 1]
+
+
+@pytest.mark.parametrize('rxtx, cmd, lsb', [(TX, 0x07, 200), (RX, 0x3F, 40)])
+def test_parameter_out_of_range(rxtx, cmd, lsb):
+    '''A parameter beyond its message's strings gets a raw label, and decoding goes on'''
+    decoder = monitor.StreamDecoder()
+    found   = decoder.feed(rxtx, encode(cmd, 0, lsb) + encode(0x06, 0, 20), 0)
+    assert [frame.cmd for frame in found] == [cmd, 0x06]
+    assert found[0].label[0].startswith('Unknown ')
+    assert '0x%02X' % cmd in found[0].label[0]
+    assert decoder.label_cache.bad_params[rxtx] == 1
+    assert decoder.channel[rxtx].state == 0
+
+
+def test_frame_error():
+    '''A bad frame is counted, and the next packet is still found'''
+    decoder = monitor.StreamDecoder()
+    found   = decoder.feed(TX, encode(0x06, 0, 20)[:9] + b'\x00' + encode(0x06, 0, 20), 0)
+    assert len(found) == 1 and decoder.frame_errors == [0, 1]
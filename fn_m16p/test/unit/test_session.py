@@ -0,0 +1,212 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Offline decoding of session files: the example capture of ../sigrok_PulseView
+    (50 kHz samplerate, 9600 baud, module RX on D5 and TX on D6) and synthesized
+    captures (fn_m16p_synth), decoded serially (fn_m16p_session), in parallel segments
+    (fn_m16p_split), through the chunk cache (fn_m16p_cache) and on a worker pool
+    (fn_m16p_pool)'''
+
+import argparse
+import os
+
+import pytest
+
+np      = pytest.importorskip('numpy')
+synth   = pytest.importorskip('fn_m16p.fn_m16p_synth')
+session = pytest.importorskip('fn_m16p.fn_m16p_session')
+split   = pytest.importorskip('fn_m16p.fn_m16p_split')
+cache   = pytest.importorskip('fn_m16p.fn_m16p_cache')
+pool    = pytest.importorskip('fn_m16p.fn_m16p_pool')
+schema  = pytest.importorskip('fn_m16p.fn_m16p_schema')
+frame   = pytest.importorskip('fn_m16p.fn_m16p_frame')
+
+CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'sigrok_PulseView', 'FullFunction_Tweaked-Bitstream.sr')
+
+RATE, BAUD = 1000000, 115200
+SAMPLES    = 6000000
+BLOCK      = 1 << 18
+
+
+@pytest.fixture(scope='module')
+def capture(tmp_path_factory):
+    '''A synthetic capture (several chunks), and its ground truth'''
+    path  = str(tmp_path_factory.mktemp('capture') / 'synth.sr')
+    truth = synth.synthesize(path, SAMPLES, RATE, BAUD, seed=7, chunk_size=1 << 20,
+                             latency=(0.0005, 0.002), gap=(0.0, 0.002))
+    return path, truth
+
+
+def columns(results):
+    '''The packet columns (see fn_m16p_pool) of a series of BatchResults, merged'''
+    results = list(results)
+    return {name: np.concatenate([getattr(result, name) for result in results])
+            for name in pool.COLUMNS}
+
+
+def assert_same(result, other):
+    '''Two sets of packet columns hold the same packets'''
+    for name in pool.COLUMNS:
+        assert np.array_equal(result[name], other[name]), name
+
+
+def serial(path):
+    '''decode_session() of a capture'''
+    with session.SessionReader(path) as reader:
+        return columns(session.decode_session(reader, 'D5', 'D6', BAUD, BLOCK))
+
+
+def packets(block_size=session.BLOCK_SIZE):
+    '''(ss, es, rxtx, label) of every packet in the example capture'''
+    with session.SessionReader(CAPTURE) as reader:
+        return [packet for result in session.decode_session(reader, 'D5', 'D6', 9600,
+                                                            block_size)
+                for packet in result.packets()]
+
+
+def test_example_capture():
+    '''The example capture's packets are all found, with their times and labels'''
+    found = packets()
+    assert len(found) == 81
+    assert [(ss, es, rxtx, label[0]) for ss, es, rxtx, label in found[:3]] == \
+        [(1594, 2104, 1, 'Reset Module'), (2112, 2626, 0, 'Command Acknowledged'),
+         (31648, 32162, 0, 'Online: SD Card')]
+
+
+@pytest.mark.parametrize('block_size', [1000, 4096])
+def test_blocks_give_same_packets(block_size):
+    '''Packets cut by block boundaries are still found, whatever the block size'''
+    assert packets(block_size) == packets()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_pool_merged_output(tmp_path, jobs):
+    '''The pool's merged output holds each capture's packets, indexed'''
+    args = argparse.Namespace(rx='D5', tx='D6', baudrate=9600, block_size=4096, jobs=jobs,
+                              queue=2, variant='FN-M16P')
+    output = str(tmp_path / 'merged.npz')
+    with pool.MergedOutput([CAPTURE] * 3, output) as merged:
+        pool.run_pool(merged, args, progress=None).save()
+    merged = np.load(output)
+    found  = packets()
+    count  = len(found)
+    assert merged['count'].tolist() == [count] * 3
+    assert merged['offset'].tolist() == [0, count, 2 * count]
+    assert merged['capture'].tolist() == [0] * count + [1] * count + [2] * count
+    assert merged['ss'][count:2 * count].tolist() == [ss for ss, _, _, _ in found]
+    assert os.listdir(str(tmp_path)) == ['merged.npz']
+
+
+def test_merged_output_streams_in_order(tmp_path):
+    '''Results are written as soon as the ones before them are; missing ones are
+       recorded as not decoded'''
+    def result(count):
+        columns = pool.empty_columns()
+        columns['ss'] = np.arange(count, dtype=np.int64)
+        columns = {name: np.resize(column, count) for name, column in columns.items()}
+        return columns, RATE, count, ''
+
+    with pool.MergedOutput(['a', 'b', 'c', 'd'], str(tmp_path / 'out.npz')) as merged:
+        merged.add(1, result(2))
+        assert (merged.written, merged.waiting()) == (0, 1)
+        merged.add(0, result(3))
+        assert (merged.written, merged.waiting(), merged.packets) == (2, 0, 5)
+        merged.add(3, result(1))
+        index = merged.save()
+    assert index['count'].tolist() == [3, 2, 0, 1]
+    assert index['errors'].tolist() == ['', '', 'Not decoded', '']
+    assert np.load(str(tmp_path / 'out.npz'))['ss'].tolist() == [0, 1, 2, 0, 1, 0]
+
+
+def test_decode_matches_ground_truth(capture):
+    '''Every synthesized packet is decoded, with the right times and contents'''
+    path, truth = capture
+    result = serial(path)
+    assert len(result['ss']) > 100
+    assert_same(result, truth)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_parallel_matches_serial(capture, jobs):
+    '''Segments decoded separately and stitched give the serial results'''
+    path, _ = capture
+    assert_same(columns(split.decode_parallel(path, 'D5', 'D6', BAUD, BLOCK, jobs)),
+                serial(path))
+
+
+def test_cache_hits(capture, tmp_path):
+    '''A second decode is served from the cache, with the same results'''
+    path, _ = capture
+    store   = cache.DecodeCache(str(tmp_path))
+    with session.SessionReader(path) as reader:
+        cold = columns(cache.decode_cached(reader, 'D5', 'D6', BAUD, BLOCK, store))
+        chunks = len(reader.chunks)
+        warm = columns(cache.decode_cached(reader, 'D5', 'D6', BAUD, BLOCK, store))
+    assert_same(cold, serial(path))
+    assert_same(warm, cold)
+    assert (store.hits, store.misses) == (chunks, chunks)
+
+
+def test_cache_eviction(capture, tmp_path):
+    '''Under a small size cap, the least recently used entries are evicted'''
+    path, _ = capture
+    store   = cache.DecodeCache(str(tmp_path), max_bytes=1)
+    with session.SessionReader(path) as reader:
+        result = columns(cache.decode_cached(reader, 'D5', 'D6', BAUD, BLOCK, store))
+        chunks = len(reader.chunks)
+    assert_same(result, serial(path))
+    assert store.evictions == chunks - 1 and len(store.index) == 1
+
+
+def test_variant_threaded_through(capture, tmp_path):
+    '''Serial, parallel and cached decoding all run the chosen variant's engine, and
+       the variant is part of the cache key'''
+    path, _ = capture
+    engine  = schema.ENGINES['YX5200']
+    with session.SessionReader(path) as reader:
+        serial_result = columns(session.decode_session(reader, 'D5', 'D6', BAUD, BLOCK,
+                                                       engine))
+        store  = cache.DecodeCache(str(tmp_path))
+        cached = columns(cache.decode_cached(reader, 'D5', 'D6', BAUD, BLOCK, store))
+        chunks = len(reader.chunks)
+        cached = columns(cache.decode_cached(reader, 'D5', 'D6', BAUD, BLOCK, store,
+                                             engine))
+    assert store.misses == 2 * chunks
+    assert_same(cached, serial_result)
+    assert_same(columns(split.decode_parallel(path, 'D5', 'D6', BAUD, BLOCK, 2,
+                                              engine=engine)), serial_result)
+
+
+def test_cli_parameter_out_of_range(tmp_path, capsys):
+    '''The command line labels a parameter beyond its message's strings by its raw
+       bytes, and goes on decoding'''
+    path   = str(tmp_path / 'out_of_range.sr')
+    pool   = [(frame.encode_frame(0x07, 0, 200), frame.encode_frame(0x3F, 0, 40))]
+    layout = synth.Layout(RATE, BAUD)
+    layout.lay_out(pool, 100000, np.random.default_rng(1))
+    lines  = [synth.LineRenderer(layout.starts[rxtx], layout.values[rxtx],
+                                 layout.bit_width, bit) for rxtx, bit in ((0, 5), (1, 6))]
+    with synth.SessionWriter(path, RATE, {'D5': 5, 'D6': 6}) as writer:
+        writer.write(synth.render_chunk(lines, 0, 100000))
+    session.main([path, '--rx', 'D5', '--tx', 'D6', '--baudrate', str(BAUD)])
+    printed = [line.split(' ', 1)[1] for line in capsys.readouterr().out.splitlines()]
+    assert len(printed) == len(layout.truth['ss']) > 2
+    assert set(printed) == {'TX Unknown Command 0x07 (0x00 0xC8)',
+                            'RX Unknown Feedback 0x3F (0x00 0x28)'}
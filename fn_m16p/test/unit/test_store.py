@@ -0,0 +1,95 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Array-backed annotation store (fn_m16p_store)'''
+
+import pytest
+
+from conftest import PKG, generate
+
+np    = pytest.importorskip('numpy')
+store_mod = pytest.importorskip('fn_m16p.fn_m16p_store')
+
+TRAFFIC = generate(seed=6, frames=2000)
+POLLED  = generate(seed=6, frames=2000, poll_rate=0.1)
+
+
+def decoded(store, traffic=TRAFFIC, **options):
+    '''Run pd.Decoder with the given options over the traffic into a store; return the
+       decoder, with its records'''
+    decoder = PKG.pd.Decoder()
+    decoder.options.update(options)
+    decoder.records = []
+    decoder.start()
+    for start_smpl, end_smpl, data in traffic.uart_packets():
+        decoder.decode(start_smpl, end_smpl, data)
+    decoder.end()
+    for record in decoder.records:
+        store.put(*record)
+    return decoder
+
+
+@pytest.mark.parametrize('spill_bytes', [store_mod.SPILL_BYTES, 1 << 16])
+def test_store_keeps_every_annotation(spill_bytes, tmp_path):
+    '''Every annotation comes back, in order, whether or not the rows spilled to a file'''
+    store   = store_mod.AnnotationStore(spill_bytes=spill_bytes, directory=str(tmp_path))
+    decoder = decoded(store)
+    expected = [(ss, es, data[0], data[1]) for ss, es, out, data in decoder.records
+                if out == decoder.out_ann]
+    assert len(store) == len(expected)
+    assert store.spilled == (spill_bytes == 1 << 16)
+    assert list(store.records(np.arange(len(store)))) == expected
+    store.close()
+
+
+def test_range_and_cmd_queries():
+    '''Range and command queries give the same rows as a scan'''
+    store   = store_mod.AnnotationStore()
+    decoder = decoded(store)
+    rows    = store.arrays()
+    first, last = int(rows['ss'][len(rows) // 3]), int(rows['es'][len(rows) // 2])
+    within  = np.flatnonzero((rows['ss'] >= first) & (rows['ss'] < last))
+    assert sorted(store.range(first, last).tolist()) == within.tolist()
+    volumes = [record for record in decoder.records
+               if record[2] == decoder.out_python and record[3][2] == 0x06]
+    assert len(store.with_cmd(0x06)) == len(volumes)
+
+
+def test_cmd_query_with_packets_detail():
+    '''Command queries work in "packets" detail too (packet records are still output)'''
+    full    = store_mod.AnnotationStore()
+    decoded(full)
+    store   = store_mod.AnnotationStore()
+    decoded(store, detail='packets')
+    for cmd in (0x06, 0x40, 0x41):
+        assert len(store.with_cmd(cmd)) == len(full.with_cmd(cmd)) > 0
+
+
+def test_cmd_query_with_coalesce():
+    '''Packet labels held back by coalescing (so put() after their OUTPUT_PYTHON
+       record) still get their packet's cmd'''
+    store   = store_mod.AnnotationStore()
+    decoder = decoded(store, POLLED, coalesce='yes')
+    cmds    = {(ss, es): data[2] for ss, es, out, data in decoder.records
+               if out == decoder.out_python}
+    rows    = store.arrays()
+    packets = np.flatnonzero(np.isin(rows['cls'], store_mod.PACKET_CLASSES))
+    assert len(packets) < len(cmds)              # (Some were coalesced away)
+    assert [store.table.cmds[rows['label'][row]] for row in packets] == \
+        [cmds[int(rows['ss'][row]), int(rows['es'][row])] for row in packets]
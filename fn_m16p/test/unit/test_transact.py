@@ -0,0 +1,103 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2021 Kerry Burton <KerryKJB1@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+''' Request/reply pairing and latency statistics (fn_m16p_transact)'''
+
+from conftest import PKG
+
+transact = PKG.fn_m16p_transact
+RX, TX   = 0, 1
+
+
+def kinds(events):
+    '''Event kinds, with the request's cmd'''
+    return [(event[0], event[1]) for event in events]
+
+
+def test_query_reply():
+    '''A query is answered by an RX packet with the same cmd, with its latency timed'''
+    tracker = transact.TransactionTracker()
+    assert tracker.packet(0, 100, TX, 0x43, 0) == []
+    events = tracker.packet(500, 600, RX, 0x43, 0)
+    assert events == [(transact.REPLY, 0x43, 0, 100, 500, 600, 500)]
+    assert tracker.histograms[0x43].count == 1
+    assert tracker.outstanding() == 0
+
+
+def test_feedback_ack_and_error():
+    '''FEED=1 commands are answered by 0x41 ACK or 0x40 error, oldest first'''
+    tracker = transact.TransactionTracker()
+    tracker.packet(0, 10, TX, 0x06, 1)
+    tracker.packet(20, 30, TX, 0x0D, 1)
+    assert kinds(tracker.packet(40, 50, RX, 0x41, 0)) == [(transact.ACK, 0x06)]
+    assert kinds(tracker.packet(60, 70, RX, 0x40, 0)) == [(transact.ERROR, 0x0D)]
+
+
+def test_failed_query_cancels_reply():
+    '''A query sent with FEED=1 that gets an error will get no reply, so no timeout'''
+    tracker = transact.TransactionTracker(timeout=100)
+    tracker.packet(0, 10, TX, 0x48, 1)
+    assert kinds(tracker.packet(20, 30, RX, 0x40, 0)) == [(transact.ERROR, 0x48)]
+    assert tracker.packet(1000, 1010, TX, 0x06, 0) == []
+    assert tracker.outstanding() == 0
+
+
+def test_timeout_and_orphan():
+    '''Unanswered requests time out; answers with no request are orphans'''
+    tracker = transact.TransactionTracker(timeout=100)
+    tracker.packet(0, 10, TX, 0x42, 0)
+    assert kinds(tracker.packet(500, 510, RX, 0x42, 0)) == [(transact.TIMEOUT, 0x42),
+                                                           (transact.ORPHAN, 0x42)]
+    assert tracker.counts[transact.TIMEOUT] == tracker.counts[transact.ORPHAN] == 1
+
+
+def test_histogram_percentiles():
+    '''Percentiles are within a bucket (25%) of the exact values'''
+    hist = transact.LatencyHistogram()
+    for value in range(1, 1001):
+        hist.add(value)
+    assert (hist.min, hist.max, hist.mean()) == (1, 1000, 500.5)
+    for pct in (50, 90, 99):
+        assert 0.75 * pct * 10 <= hist.percentile(pct) <= pct * 10
+
+
+def test_queues_bounded_under_timeouts():
+    '''Requests that time out are dropped from the reply queues too'''
+    tracker = transact.TransactionTracker(timeout=100)
+    for num in range(1000):
+        tracker.packet(num * 1000, num * 1000 + 10, TX, 0x42, 1)
+    assert tracker.counts[transact.TIMEOUT] == 2 * 999
+    assert len(tracker.acks) <= 1 and len(tracker.pending[0x42]) <= 1
+    assert len(tracker.order) <= 2
+
+
+def test_queues_bounded_without_timeout():
+    '''Without a timeout, answered requests behind an unanswered one are dropped, and
+       each queue keeps only its newest MAX_PENDING unanswered requests'''
+    tracker = transact.TransactionTracker()
+    tracker.packet(0, 10, TX, 0x42, 0)           # Never answered
+    for num in range(1, 5000):
+        tracker.packet(num * 100, num * 100 + 10, TX, 0x43, 0)
+        tracker.packet(num * 100 + 50, num * 100 + 60, RX, 0x43, 0)
+        tracker.packet(num * 100 + 70, num * 100 + 80, TX, 0x06, 1)   # Never ACKed
+    assert tracker.counts[transact.REPLY] == 4999
+    assert tracker.counts[transact.TIMEOUT] == 4999 - transact.MAX_PENDING
+    assert len(tracker.acks) == transact.MAX_PENDING
+    assert len(tracker.order) <= 2 * transact.COMPACT_AT
+    assert tracker.outstanding() == 1 + transact.MAX_PENDING